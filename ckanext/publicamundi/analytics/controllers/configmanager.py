@@ -1,4 +1,5 @@
 import os
+from paste.deploy.converters import asbool
 from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import scoped_session, sessionmaker
@@ -15,6 +16,7 @@ Session = None
 export_date_format = '%Y-%m-%d'
 ha_proxy_time_format = '%d/%b/%Y:%H:%M:%S'
 logfile_pattern = None
+cache_responses = True
 
 def setup(config):
     '''Setup this module when configuration is available.
@@ -28,6 +30,7 @@ def setup(config):
     global export_date_format
     global ha_proxy_datetime_format
     global logfile_pattern
+    global cache_responses
 
     # Database-related options, session factory
 
@@ -56,4 +59,7 @@ def setup(config):
         'ckanext.publicamundi.analytics.ha_proxy_datetime_format',
         '%d/%b/%Y:%H:%M:%S')
 
-    
+    # API-related options
+
+    cache_responses = asbool(config.get(
+        'ckanext.publicamundi.analytics.cache_responses', True))
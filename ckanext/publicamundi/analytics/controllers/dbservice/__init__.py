@@ -1,3 +1,4 @@
 
 from .dbmanager import DbManager
 from .dbreader import DbReader
+from .dbwriter import DbWriter
@@ -1,55 +1,111 @@
+from collections import OrderedDict
+from dateutil.parser import parse as parse_date
 from ckanext.publicamundi.analytics.controllers import configmanager
+from ckanext.publicamundi.analytics.controllers.dbservice import rollups
 from ckanext.publicamundi.analytics.controllers.parsedinfo.habboxaccessinfo import HABboxAccessInfo
 from ckanext.publicamundi.analytics.controllers.parsedinfo.hacoveragebandsinfo import HACoverageBandsInfo
 from ckanext.publicamundi.analytics.controllers.parsedinfo.haserviceaccessinfo import HAServiceAccessInfo
 from ckanext.publicamundi.analytics.controllers.parsedinfo.hausedcoveragesinfo import HAUsedCoveragesInfo
-from ckanext.publicamundi.analytics.controllers.parsers.haparser import HAParser
+from ckanext.publicamundi.analytics.controllers.util.habbox import HABbox, HABboxDensityCell
 from ckanext.publicamundi.analytics.controllers.util.system import SystemInfo
 
 
 class DbReader:
+    """
+    Reads access counts (totals within a range of dates) from the rollup tables (see rollups).
+    The returned HA*Info objects are built from aggregated rows, and are not attached to the session.
+    """
+
     def __init__(self):
         pass
 
     @staticmethod
     def read_used_coverages_totals(start_date, end_date):
         session = configmanager.session
-        used_coverages = session.query(HAUsedCoveragesInfo).filter(
-            HAUsedCoveragesInfo.date.between(start_date, end_date)).all()
-        return HAParser.merge_info_list(
-            used_coverages, HAUsedCoveragesInfo.coverage_name_property_key)
+        rows = rollups.used_coverages.read(
+            session, to_date(start_date), to_date(end_date), ["coverage_name"])
+        result = [HAUsedCoveragesInfo(r.min_date, r.coverage_name, r.access_count) for r in rows]
+        result.sort(key=lambda x: x.access_count, reverse=True)
+        return result
 
     @staticmethod
     def read_service_access_by_date(start_date, end_date):
         session = configmanager.session
-        service_access = session.query(HAServiceAccessInfo).filter(
-            HAServiceAccessInfo.date.between(start_date, end_date)).all()
-        return HAParser.merge_info_list(service_access, HAServiceAccessInfo.date_key)
+        rows = rollups.service_access.read(
+            session, to_date(start_date), to_date(end_date), ["date"])
+        return sorted([
+            HAServiceAccessInfo(r.date, r.rasdaman, r.wcs, r.wcps, r.wms, r.geoserver) for r in rows],
+            key=lambda x: x.date)
 
     @staticmethod
     def read_coverage_bands_totals(coverage_name, start_date, end_date):
         session = configmanager.session
-        coverage_bands = session.query(HACoverageBandsInfo).filter(
-            (HACoverageBandsInfo.date.between(start_date, end_date)) &
-            (HACoverageBandsInfo.coverage_name == coverage_name)).all()
-        return HAParser.merge_info_list(
-            coverage_bands, HACoverageBandsInfo.band_property_key)
+        rows = rollups.coverage_bands.read(
+            session, to_date(start_date), to_date(end_date), ["band_name"],
+            where="coverage_name = :coverage_name", params={"coverage_name": coverage_name})
+        return [
+            HACoverageBandsInfo(r.min_date, coverage_name, r.band_name, r.access_count, r.color or "")
+            for r in rows]
 
     @staticmethod
     def read_coverage_access_by_date(coverage_name, start_date, end_date):
         session = configmanager.session
-        coverage_access = session.query(HAUsedCoveragesInfo).filter(
-            (HAUsedCoveragesInfo.coverage_name == coverage_name) &
-            (HAUsedCoveragesInfo.date.between(start_date, end_date))).all()
-        return HAParser.merge_info_list(
-            coverage_access, HAUsedCoveragesInfo.date_key)
+        rows = rollups.used_coverages.read(
+            session, to_date(start_date), to_date(end_date), ["date"],
+            where="coverage_name = :coverage_name", params={"coverage_name": coverage_name})
+        return sorted([
+            HAUsedCoveragesInfo(r.date, coverage_name, r.access_count) for r in rows],
+            key=lambda x: x.date)
+
+    @staticmethod
+    def read_bbox_access_totals(start_date, end_date, within=None, limit=None):
+        """
+        Reads the access counts of bboxes, in descending order by access count.
+        :param <[float]> within: an extent (min_x, min_y, max_x, max_y) containing the bboxes to be read, if given.
+        :param <int> limit: the maximum number of bboxes to be read, if given.
+        """
+        session = configmanager.session
+        where, params = "", {}
+        if within is not None:
+            # Note Matches the (spatially indexed) box of the rollup
+            where = rollups.bbox_access.box_expression() + " <@ box(point(:x0, :y0), point(:x1, :y1))"
+            params = dict(zip(("x0", "y0", "x1", "y1"), within))
+        rows = rollups.bbox_access.read(
+            session, to_date(start_date), to_date(end_date), ["min_x", "min_y", "max_x", "max_y"],
+            where=where, params=params, order_by="access_count DESC", limit=limit)
+        return [
+            HABboxAccessInfo(r.min_date, HABbox(r.min_x, r.min_y, r.max_x, r.max_y), r.access_count, r.crs or "")
+            for r in rows]
 
     @staticmethod
-    def read_bbox_access_totals(start_date, end_date):
+    def read_bbox_access_density(start_date, end_date, extent, zoom):
+        """
+        Reads the access density of bboxes within an extent, as a grid of 2^zoom x 2^zoom cells: every cell counts
+        the accesses of the bboxes centered within it. Only cells with accesses are returned.
+        :param <[float]> extent: the extent (min_x, min_y, max_x, max_y) of the grid.
+        :param <int> zoom: the zoom level of the grid.
+        :return: <[HABboxDensityCell]> the cells with accesses, in descending order by access count.
+        """
         session = configmanager.session
-        bbox_access = session.query(HABboxAccessInfo).filter(
-            HABboxAccessInfo.date.between(start_date, end_date)).all()
-        return HAParser.merge_info_list(bbox_access, HABboxAccessInfo.bbox_key)
+        size = 2 ** zoom
+        x0, y0, x1, y1 = extent
+        dx, dy = (x1 - x0) / size, (y1 - y0) / size
+        expressions = OrderedDict([
+            ("cell_x", "least(floor(((min_x + max_x) / 2 - :x0) / :dx), :last)"),
+            ("cell_y", "least(floor(((min_y + max_y) / 2 - :y0) / :dy), :last)"),
+        ])
+        # Note The overlap condition is the one matching the spatial index, centers are then checked
+        where = (rollups.bbox_access.box_expression() + " && box(point(:x0, :y0), point(:x1, :y1)) AND "
+                 "(min_x + max_x) / 2 BETWEEN :x0 AND :x1 AND (min_y + max_y) / 2 BETWEEN :y0 AND :y1")
+        rows = rollups.bbox_access.read(
+            session, to_date(start_date), to_date(end_date), [], where=where,
+            params={"x0": x0, "y0": y0, "x1": x1, "y1": y1, "dx": dx, "dy": dy, "last": size - 1},
+            expressions=expressions, order_by="access_count DESC")
+        return [
+            HABboxDensityCell(int(r.cell_x), int(r.cell_y), HABbox(
+                x0 + r.cell_x * dx, y0 + r.cell_y * dy, x0 + (r.cell_x + 1) * dx, y0 + (r.cell_y + 1) * dy),
+                r.access_count)
+            for r in rows]
 
     @staticmethod
     def read_system_info():
@@ -57,3 +113,14 @@ class DbReader:
         system_info = session.query(SystemInfo).filter(
             SystemInfo.key == SystemInfo.LATEST_DATE_KEY).one()
         return system_info
+
+
+def to_date(value):
+    """
+    Converts a date (or a string representing a date, as given to API endpoints) to a date.
+    """
+    if isinstance(value, basestring):
+        value = parse_date(value)
+    if hasattr(value, "date"):
+        value = value.date()
+    return value
@@ -0,0 +1,52 @@
+from sqlalchemy.orm import joinedload
+from ckanext.publicamundi.analytics.controllers import configmanager
+from ckanext.publicamundi.analytics.controllers.parsedinfo.habboxaccessinfo import HABboxAccessInfo
+from ckanext.publicamundi.analytics.controllers.parsedinfo.hacoveragebandsinfo import HACoverageBandsInfo
+from ckanext.publicamundi.analytics.controllers.parsedinfo.haserviceaccessinfo import HAServiceAccessInfo
+from ckanext.publicamundi.analytics.controllers.parsedinfo.hausedcoveragesinfo import HAUsedCoveragesInfo
+
+
+class DbWriter:
+    """
+    Writes parsed information into the tables of parsed information, by accumulating the access counts into the
+    existing entries (of the same date and key), so that the information of a date may be written in several batches.
+    """
+
+    def __init__(self):
+        pass
+
+    @staticmethod
+    def accumulate_info_list(info_list, session=None):
+        """
+        Accumulates a list of HA*Info objects into the existing entries, new entries are added.
+        :param <[HA*Info]> info_list: the (transient) objects to be written.
+        :param session: the database session (the configured one, if not given).
+        """
+        session = session or configmanager.session
+        by_class = {}
+        for info in info_list:
+            by_class.setdefault(type(info), []).append(info)
+        for cls, infos in by_class.items():
+            key = DbWriter.entry_keys[cls]
+            dates = list(set(info.date for info in infos))
+            q = session.query(cls).filter(cls.date.in_(dates))
+            if cls is HABboxAccessInfo:
+                q = q.options(joinedload(HABboxAccessInfo.bbox))
+            existing = dict((key(entry), entry) for entry in q)
+            for info in infos:
+                entry = existing.get(key(info))
+                if entry is None:
+                    session.add(info)
+                    existing[key(info)] = info
+                else:
+                    entry.accumulate(info)
+
+    """
+    The key of an entry, for every type of parsed information.
+    """
+    entry_keys = {
+        HAServiceAccessInfo: lambda x: x.date,
+        HAUsedCoveragesInfo: lambda x: (x.date, x.coverage_name),
+        HACoverageBandsInfo: lambda x: (x.date, x.coverage_name, x.band_name),
+        HABboxAccessInfo: lambda x: (x.date, x.bbox),
+    }
@@ -0,0 +1,212 @@
+"""
+Rollup tables, i.e. access counts pre-aggregated by day and by month, for every metric (services, coverages,
+coverage bands and bounding boxes).
+
+Daily rollups are computed from the tables of parsed information, monthly rollups from the daily ones. Both are
+refreshed (incrementally) for every date analyzed, and are queried with GROUP BY aggregates: a query for a range of
+dates reads the monthly rollups for the whole months within the range, and the daily rollups for the rest.
+"""
+from datetime import timedelta
+from sqlalchemy import Table, Column, Integer, Float, String, Date, Index, PrimaryKeyConstraint, DDL, event
+from ckanext.publicamundi.analytics.controllers import configmanager
+
+DAY = "day"
+MONTH = "month"
+
+metadata = configmanager.Base.metadata
+
+
+class Rollup(object):
+    """
+    A rollup table for a metric.
+    """
+
+    def __init__(self, name, source, keys, sums, others=(), indexes=(), key_type=String, box=None):
+        """
+        Class constructor.
+        :param <string> name: the name of the rollup table.
+        :param <string> source: a SELECT statement on the parsed information (must provide a date column, along with
+        all other columns).
+        :param <[string]> keys: the columns to group by (along with the date).
+        :param <[string]> sums: the columns (counts) to be summed.
+        :param <[string]> others: other columns, aggregated by their minimum.
+        :param <[[string]]> indexes: the columns of additional indexes.
+        :param key_type: the type of key columns.
+        :param <[string]> box: the (min_x, min_y, max_x, max_y) columns of a bounding box, to be indexed spatially
+        (a GiST index on the box they define, see box_expression).
+        """
+        self.name = name
+        self.source = source
+        self.keys = list(keys)
+        self.sums = list(sums)
+        self.others = list(others)
+        self.box = box
+        columns = [
+            Column("granularity", String(8), nullable=False),
+            Column("date", Date, nullable=False),
+        ]
+        columns += [Column(k, key_type, nullable=False) for k in self.keys]
+        columns += [Column(k, Integer, nullable=False) for k in self.sums]
+        columns += [Column(k, String) for k in self.others]
+        self.table = Table(name, metadata, *columns)
+        self.table.append_constraint(
+            PrimaryKeyConstraint("granularity", "date", *self.keys, name=name + "_pkey"))
+        for index_columns in indexes:
+            Index("ix_%s_%s" % (name, "_".join(index_columns)),
+                  *[self.table.c[k] for k in index_columns])
+        if box is not None:
+            # Note A functional GiST index on the (builtin) box type, so that PostGIS is not required
+            event.listen(self.table, "after_create", DDL(
+                "CREATE INDEX ix_%(table)s_box ON %(table)s USING gist (" + self.box_expression() + ")"
+            ).execute_if(dialect="postgresql"))
+
+    def box_expression(self):
+        """
+        :return: <string> the SQL expression of the box defined by the box columns (as indexed).
+        """
+        return "box(point(%s, %s), point(%s, %s))" % tuple(self.box)
+
+    def refresh(self, session, day):
+        """
+        Recomputes the daily rollup of a date, and the monthly rollup of its month.
+        :param session: the database session
+        :param <date> day: the date
+        """
+        month = day.replace(day=1)
+        self._rollup(session, DAY, day, day + timedelta(days=1))
+        self._rollup(session, MONTH, month, next_month(month))
+
+    def rebuild(self, session):
+        """
+        Recomputes all (daily and monthly) rollups.
+        """
+        self._rollup(session, DAY)
+        self._rollup(session, MONTH)
+
+    def read(self, session, start_date, end_date, group_by, where="", params=None, expressions=None,
+             order_by=None, limit=None):
+        """
+        Reads the aggregated counts within a range of dates.
+        :param session: the database session
+        :param <date> start_date: the first date of the range.
+        :param <date> end_date: the last date of the range (inclusive).
+        :param <[string]> group_by: the columns to group by (a subset of date and keys).
+        :param <string> where: an additional condition.
+        :param <dict> params: the parameters of the additional condition.
+        :param <OrderedDict> expressions: additional expressions to group by, keyed on their (output) name.
+        :param <string> order_by: the ordering of rows (in terms of output names).
+        :param <int> limit: the maximum number of rows.
+        :return: <[RowProxy]> rows of group_by columns (and expressions), the minimum date (as min_date), the sums
+        (named after their columns), and the other columns.
+        """
+        stop_date = end_date + timedelta(days=1)
+        first_month = start_date if start_date.day == 1 else next_month(start_date.replace(day=1))
+        last_month = stop_date.replace(day=1)
+        if first_month >= last_month or "date" in group_by:
+            # no whole months within range (or grouped by date): read daily rollups only
+            first_month = last_month = stop_date
+        expressions = expressions or {}
+        group_by = list(group_by) + list(expressions.keys())
+        columns = [("%s AS %s" % (expressions[k], k)) if k in expressions else k for k in group_by] + \
+            ["min(date) AS min_date"] + \
+            ["sum(%s) AS %s" % (k, k) for k in self.sums] + ["min(%s) AS %s" % (k, k) for k in self.others]
+        q = ("SELECT %(columns)s FROM %(table)s WHERE ("
+             "(granularity = :month AND date >= :first_month AND date < :last_month) OR "
+             "(granularity = :day AND ((date >= :start_date AND date < :first_month) OR "
+             "(date >= :last_month AND date < :stop_date))))%(where)s "
+             "GROUP BY %(group_by)s%(order_by)s%(limit)s") % {
+            "columns": ", ".join(columns),
+            "table": self.name,
+            "where": (" AND (%s)" % where) if where else "",
+            "group_by": ", ".join(group_by),
+            "order_by": (" ORDER BY %s" % order_by) if order_by else "",
+            "limit": (" LIMIT %d" % int(limit)) if limit else "",
+        }
+        q_params = dict(params or {})
+        q_params.update({
+            "day": DAY, "month": MONTH,
+            "start_date": start_date, "stop_date": stop_date,
+            "first_month": first_month, "last_month": last_month,
+        })
+        return session.execute(q, q_params).fetchall()
+
+    def _rollup(self, session, granularity, start_date=None, stop_date=None):
+        if granularity == DAY:
+            source, date_column = self.source, "date"
+        else:
+            source = "SELECT * FROM %s WHERE granularity = '%s'" % (self.name, DAY)
+            date_column = "CAST(date_trunc('month', date) AS date)"
+        params = {"granularity": granularity}
+        where = ""
+        if start_date is not None:
+            where = " WHERE date >= :start_date AND date < :stop_date"
+            params.update({"start_date": start_date, "stop_date": stop_date})
+        session.execute(
+            "DELETE FROM %s WHERE granularity = :granularity%s" % (
+                self.name, where.replace(" WHERE ", " AND ")), params)
+        session.execute(
+            "INSERT INTO %(table)s (granularity, date, %(columns)s) "
+            "SELECT :granularity, %(date)s, %(aggregates)s FROM (%(source)s) AS s%(where)s "
+            "GROUP BY %(group_by)s" % {
+                "table": self.name,
+                "columns": ", ".join(self.keys + self.sums + self.others),
+                "date": date_column,
+                "aggregates": ", ".join(
+                    self.keys + ["sum(%s)" % k for k in self.sums] + ["min(%s)" % k for k in self.others]),
+                "source": source,
+                "where": where,
+                "group_by": ", ".join([date_column] + self.keys),
+            }, params)
+
+
+def next_month(month):
+    """
+    :param <date> month: the first date of a month.
+    :return: <date> the first date of the next month.
+    """
+    return (month + timedelta(days=31)).replace(day=1)
+
+
+service_access = Rollup(
+    "service_access_rollup",
+    "SELECT * FROM service_access",
+    keys=[], sums=["rasdaman", "wcs", "wcps", "wms", "geoserver"])
+
+used_coverages = Rollup(
+    "used_coverages_rollup",
+    "SELECT * FROM used_coverages",
+    keys=["coverage_name"], sums=["access_count"],
+    indexes=[["coverage_name", "granularity", "date"]])
+
+coverage_bands = Rollup(
+    "coverage_bands_rollup",
+    "SELECT * FROM coverage_bands",
+    keys=["coverage_name", "band_name"], sums=["access_count"], others=["color"],
+    indexes=[["coverage_name", "granularity", "date"]])
+
+bbox_access = Rollup(
+    "bbox_access_rollup",
+    "SELECT a.date, b.min_x, b.min_y, b.max_x, b.max_y, a.crs, a.access_count "
+    "FROM bbox_access a JOIN bbox b ON b.id = a.bbox_id",
+    keys=["min_x", "min_y", "max_x", "max_y"], sums=["access_count"], others=["crs"],
+    key_type=Float, box=["min_x", "min_y", "max_x", "max_y"])
+
+all_rollups = [service_access, used_coverages, coverage_bands, bbox_access]
+
+
+def refresh_all(session, day):
+    """
+    Refreshes all rollups for a date (just analyzed).
+    """
+    session.flush()
+    for rollup in all_rollups:
+        rollup.refresh(session, day)
+
+
+def rebuild_all(session):
+    """
+    Rebuilds all rollups from the parsed information.
+    """
+    session.flush()
+    for rollup in all_rollups:
+        rollup.rebuild(session)
@@ -1,6 +1,7 @@
 from ckanext.publicamundi.analytics.controllers.dbservice.dbreader import DbReader
-from ckanext.publicamundi.analytics.controllers.parsers.haparser import HAParser
-from ckan.lib.base import BaseController
+from ckanext.publicamundi.analytics.controllers.response_cache import ResponseCache
+from ckanext.publicamundi.analytics.controllers.util.habbox import HABbox
+from ckan.lib.base import BaseController, request, abort
 
 class HAParserController(BaseController):
     """
@@ -12,37 +13,111 @@ class HAParserController(BaseController):
     /api/analytics/parse/coverages: parses information about the access counts of all coverages/layers
     /api/analytics/parse/bands/{coverage-name}: parses information about the access count on bands for the
     coverage/layer with the passed name
+    /api/analytics/heatmap/{start_date}/{end_date}/{zoom}: computes the access density of bounding boxes, as a
+    grid of cells
+
+    Responses are streamed as json arrays, and cached until logs are analyzed again (see ResponseCache).
     """
     __author__ = "<a href='mailto:merticariu@rasdaman.com'>Vlad Merticariu</a>"
 
+    cache = ResponseCache()
+
     def parse_services_access_count(self, start_date, end_date):
         """
         Parses information about the access counts of the services (rasdaman, geoserver, w*s).
         """
-        return HAParser.print_as_json_array(DbReader.read_service_access_by_date(start_date, end_date))
+        return self.cache.respond(
+            "services", None, start_date, end_date,
+            lambda: DbReader.read_service_access_by_date(start_date, end_date))
 
     def parse_bbox_access_count(self, start_date, end_date):
         """
-        Parses information about the access counts of the accessed bounding boxes.
+        Parses information about the access counts of the accessed bounding boxes (most accessed first).
+        The following request parameters are optional:
+         - within: an extent (min_x,min_y,max_x,max_y in EPSG:3857) that contains the bounding boxes.
+         - limit: the maximum number of bounding boxes.
+        """
+        within = self._get_extent("within")
+        limit = self._get_int("limit", 1)
+        return self.cache.respond(
+            "bbox?within=%s&limit=%s" % (within, limit), None, start_date, end_date,
+            lambda: DbReader.read_bbox_access_totals(start_date, end_date, within, limit))
+
+    def parse_bbox_access_density(self, start_date, end_date, zoom):
+        """
+        Computes the access density of the accessed bounding boxes, as a grid of 2^zoom x 2^zoom cells (a heatmap
+        tile) over an extent: every cell counts the accesses of bounding boxes centered within it.
+        The following request parameters are optional:
+         - extent: the extent (min_x,min_y,max_x,max_y in EPSG:3857) of the grid, e.g. the one of a coverage/layer.
+           The extent of EPSG:3857 if not given.
+        :param <string> zoom: the zoom level of the grid (up to max_zoom).
         """
-        return HAParser.print_as_json_array(DbReader.read_bbox_access_totals(start_date, end_date))
+        try:
+            zoom = int(zoom)
+        except ValueError:
+            zoom = -1
+        if not 0 <= zoom <= self.max_zoom:
+            abort(400, "The zoom level should be an integer within 0..%d" % self.max_zoom)
+        extent = self._get_extent("extent") or list(HABbox.crs_extent)
+        return self.cache.respond(
+            "heatmap/%d?extent=%s" % (zoom, extent), None, start_date, end_date,
+            lambda: DbReader.read_bbox_access_density(start_date, end_date, extent, zoom))
 
     def parse_coverage_access_count(self, coverage_name, start_date, end_date):
         """
         Parses information about the coverage/layer with the passed name.
         :param <string> coverage_name: the coverage/layer name to be analyzed.
         """
-        return HAParser.print_as_json_array(DbReader.read_coverage_access_by_date(coverage_name, start_date, end_date))
+        return self.cache.respond(
+            "coverage", coverage_name, start_date, end_date,
+            lambda: DbReader.read_coverage_access_by_date(coverage_name, start_date, end_date))
 
     def parse_used_coverages_count(self, start_date, end_date):
         """
         Parses information about the access counts of all coverages/layers.
         """
-        return HAParser.print_as_json_array(DbReader.read_used_coverages_totals(start_date, end_date))
+        return self.cache.respond(
+            "coverages", None, start_date, end_date,
+            lambda: DbReader.read_used_coverages_totals(start_date, end_date))
 
     def parse_band_access_count(self, coverage_name, start_date, end_date):
         """
         Parses information about the access count on bands for the coverage/layer with the passed name.
         :param <string> coverage_name: the coverage/layer name to be analyzed.
         """
-        return HAParser.print_as_json_array(DbReader.read_coverage_bands_totals(coverage_name, start_date, end_date))
\ No newline at end of file
+        return self.cache.respond(
+            "bands", coverage_name, start_date, end_date,
+            lambda: DbReader.read_coverage_bands_totals(coverage_name, start_date, end_date))
+
+    def _get_extent(self, name):
+        """
+        Gets an extent (min_x,min_y,max_x,max_y) from the request parameters, None if not given.
+        """
+        value = request.params.get(name)
+        if not value:
+            return None
+        try:
+            extent = [float(c) for c in value.split(",")]
+        except ValueError:
+            extent = []
+        if len(extent) != 4 or extent[0] >= extent[2] or extent[1] >= extent[3]:
+            abort(400, "The %s should be given as min_x,min_y,max_x,max_y" % name)
+        return extent
+
+    def _get_int(self, name, minimum=0):
+        """
+        Gets an integer from the request parameters, None if not given.
+        """
+        value = request.params.get(name)
+        if not value:
+            return None
+        try:
+            value = int(value)
+        except ValueError:
+            value = minimum - 1
+        if value < minimum:
+            abort(400, "The %s should be an integer (at least %d)" % (name, minimum))
+        return value
+
+    # the maximum zoom level of density grids (4^max_zoom cells)
+    max_zoom = 10
@@ -0,0 +1,170 @@
+import glob
+import os
+import json
+import tempfile
+import logging
+from datetime import date, timedelta
+from ckanext.publicamundi.analytics.controllers import configmanager
+from ckanext.publicamundi.analytics.controllers.log_trimmer import LogTrimmer
+from ckanext.publicamundi.analytics.controllers.util import util
+from ckanext.publicamundi.analytics.controllers.util.system import SystemInfo
+
+
+class LogIngestor:
+    def __init__(self, log_pattern, start_date, end_date, file_index=None):
+        """
+        Reads the log files once, and partitions their lines by date (within a range of dates)
+        :param str log_pattern: the path pattern to the log files
+        :param date start_date: the first date of the range
+        :param date end_date: the end date of the range (exclusive)
+        :param LogFileIndex file_index: the index of log files (and their date ranges) already read
+        """
+        self.log_pattern = log_pattern
+        self.start_date = start_date
+        self.end_date = end_date
+        self.file_index = file_index
+        self.logger = logging.getLogger(__name__)
+        self._last_token = None
+        self._last_date = None
+
+    def iter_days(self):
+        """
+        Yields a tuple of (date, lines) for every date in the range, in order.
+        All log files are read (once) before the first tuple is yielded, lines are kept in
+        temporary files (one per date), so that only the lines of a single date are in memory.
+        :rtype: iterator over tuple(date, list[str])
+        """
+        spools = {}
+        try:
+            for logpath in sorted(glob.glob(self.log_pattern)):
+                self.ingest_file(logpath, spools)
+            day = self.start_date
+            while day < self.end_date:
+                lines = []
+                f = spools.pop(day, None)
+                if f is not None:
+                    f.seek(0)
+                    lines = f.readlines()
+                    f.close()
+                self.logger.info('Found %d records within given date %s', len(lines), day)
+                yield day, lines
+                day = day + timedelta(days=1)
+        finally:
+            for f in spools.values():
+                f.close()
+
+    def ingest_file(self, logpath, spools):
+        """
+        Reads a log file line by line, and appends the lines within the range to the
+        temporary file of their date. Skips files known to be out of the range.
+        :param str logpath: the path to the log file
+        :param dict spools: the temporary files, keyed on date
+        """
+        stat = os.stat(logpath)
+        if self.can_skip_file(logpath, stat):
+            self.logger.info('Skipped logfile %s: out of range', logpath)
+            return
+        nl = 0
+        first_date, last_date = None, None
+        with LogTrimmer.file_context(logpath) as f:
+            for line in f:
+                line_date = self.parse_line_date(line)
+                if line_date is None:
+                    # some wrongly formatted line, just skip it
+                    continue
+                if first_date is None or line_date < first_date:
+                    first_date = line_date
+                if last_date is None or line_date > last_date:
+                    last_date = line_date
+                if self.start_date <= line_date < self.end_date:
+                    spool = spools.get(line_date)
+                    if spool is None:
+                        spool = spools[line_date] = tempfile.TemporaryFile()
+                    spool.write(line)
+                    nl += 1
+        if self.file_index is not None and first_date is not None:
+            self.file_index.update(logpath, stat, first_date, last_date)
+        self.logger.info('Processed logfile %s: matched %d records', logpath, nl)
+
+    def can_skip_file(self, logpath, stat):
+        """
+        Checks if a log file cannot contain lines within the range: either it was last modified
+        before the range, or it is unchanged since read and its dates are out of the range.
+        :param str logpath: the path to the log file
+        :param stat: the result of os.stat for the log file
+        :rtype: bool
+        """
+        if date.fromtimestamp(stat.st_mtime) < self.start_date:
+            return True
+        if self.file_index is not None:
+            date_range = self.file_index.get(logpath, stat)
+            if date_range is not None:
+                first_date, last_date = date_range
+                return last_date < self.start_date or first_date >= self.end_date
+        return False
+
+    def parse_line_date(self, line):
+        """
+        Parses the date of a log line, None if the line is wrongly formatted.
+        Consecutive lines mostly share their timestamp, so the last one parsed is reused.
+        :param str line: the log line
+        :rtype: date
+        """
+        parts = line.split(" ", 7)
+        if len(parts) < 7:
+            return None
+        token = parts[6].split(".")[0]
+        if token != self._last_token:
+            try:
+                self._last_date = util.parse_ha_date_from_line(line).date()
+            except:
+                return None
+            self._last_token = token
+        return self._last_date
+
+
+class LogFileIndex:
+    def __init__(self, session):
+        """
+        Keeps the date ranges of log files already read (as system info entries), so that
+        files that have not changed since are only read again if needed.
+        :param session: the database session
+        """
+        self.session = session
+
+    def get(self, logpath, stat):
+        """
+        Returns the (first, last) dates of a log file, None if unknown or changed since read.
+        :param str logpath: the path to the log file
+        :param stat: the result of os.stat for the log file
+        :rtype: tuple(date, date)
+        """
+        info = self.session.query(SystemInfo).get(self.key_prefix + logpath)
+        if info is None:
+            return None
+        try:
+            entry = json.loads(info.value)
+        except ValueError:
+            return None
+        if entry.get('mtime') != stat.st_mtime or entry.get('size') != stat.st_size:
+            return None
+        return (date.fromordinal(entry['first']), date.fromordinal(entry['last']))
+
+    def update(self, logpath, stat, first_date, last_date):
+        """
+        Records the (first, last) dates of a log file, as just read.
+        """
+        key = self.key_prefix + logpath
+        value = json.dumps({
+            'mtime': stat.st_mtime,
+            'size': stat.st_size,
+            'first': first_date.toordinal(),
+            'last': last_date.toordinal(),
+        })
+        info = self.session.query(SystemInfo).get(key)
+        if info is None:
+            self.session.add(SystemInfo(key, value))
+        else:
+            info.value = value
+
+    key_prefix = "logfile:"
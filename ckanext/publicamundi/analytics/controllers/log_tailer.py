@@ -0,0 +1,154 @@
+import glob
+import os
+import json
+import hashlib
+import logging
+from datetime import date
+from ckanext.publicamundi.analytics.controllers.log_ingestor import LogIngestor
+from ckanext.publicamundi.analytics.controllers.log_trimmer import LogTrimmer
+from ckanext.publicamundi.analytics.controllers.util.system import SystemInfo
+
+
+class LogTailer:
+    def __init__(self, log_pattern, positions, start_date=None, batch_size=10000):
+        """
+        Reads the lines appended to the log files since they were last read, in batches.
+
+        Files are identified by a fingerprint of their first line (not by their path), so that a file is followed
+        when renamed (e.g. by logrotate) or compressed (gzip rollover): it is read on from the (uncompressed) offset
+        where it was left. A file truncated in place (copytruncate) gets a new first line, so it is read from start.
+        :param str log_pattern: the path pattern to the log files
+        :param LogPositions positions: the positions (offsets) of log files read so far
+        :param date start_date: for files not read before, the first date of lines to be read (default: today)
+        :param int batch_size: the (maximum) number of lines in a batch
+        """
+        self.log_pattern = log_pattern
+        self.positions = positions
+        self.start_date = start_date or date.today()
+        self.batch_size = batch_size
+        self.logger = logging.getLogger(__name__)
+        # Note The ingestor is only used to parse the dates of lines
+        self._ingestor = LogIngestor(log_pattern, self.start_date, None)
+
+    def iter_batches(self):
+        """
+        Yields the new lines of all log files (oldest files first), in batches partitioned by date, i.e. as
+        dict(date -> list[str]). The positions of the files are updated (in the session of positions) before a batch
+        is yielded, so they should be committed along with the information parsed from the batch.
+        :rtype: iterator over dict(date, list[str])
+        """
+        logpaths = glob.glob(self.log_pattern)
+        logpaths.sort(key=lambda p: os.stat(p).st_mtime)
+        for logpath in logpaths:
+            for batch in self.tail_file(logpath):
+                yield batch
+
+    def tail_file(self, logpath):
+        """
+        Yields the new lines of a log file in batches (see iter_batches).
+        :param str logpath: the path to the log file
+        :rtype: iterator over dict(date, list[str])
+        """
+        stat = os.stat(logpath)
+        compressed = os.path.splitext(logpath)[1] == '.gz'
+        fingerprint = self.fingerprint(logpath)
+        if fingerprint is None:
+            # not even a complete line yet
+            return
+        position = self.positions.get(fingerprint)
+        min_date = None
+        if position is None:
+            if date.fromtimestamp(stat.st_mtime) < self.start_date:
+                # not read before, and nothing new since start date
+                self.positions.update(fingerprint, logpath, stat, stat.st_size, compressed)
+                self.logger.info('Skipped logfile %s: older than %s', logpath, self.start_date)
+                return
+            position = {'offset': 0, 'complete': False}
+            min_date = self.start_date
+        if position['complete']:
+            return
+        offset = position['offset']
+        if not compressed and offset > stat.st_size:
+            self.logger.info('Logfile %s was truncated: reading from start', logpath)
+            offset = 0
+        nl = 0
+        batch, batch_size = {}, 0
+        with LogTrimmer.file_context(logpath) as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith('\n'):
+                    # an incomplete line (still being written), read it next time
+                    break
+                offset += len(line)
+                line_date = self._ingestor.parse_line_date(line)
+                if line_date is None or (min_date is not None and line_date < min_date):
+                    continue
+                batch.setdefault(line_date, []).append(line)
+                batch_size += 1
+                if batch_size >= self.batch_size:
+                    self.positions.update(fingerprint, logpath, stat, offset, False)
+                    nl += batch_size
+                    yield batch
+                    batch, batch_size = {}, 0
+        # Note A compressed file is not appended to, so it is complete when read to its end
+        self.positions.update(fingerprint, logpath, stat, offset, compressed)
+        nl += batch_size
+        if batch:
+            yield batch
+        self.logger.info('Processed logfile %s: read %d new records', logpath, nl)
+
+    @staticmethod
+    def fingerprint(logpath):
+        """
+        Computes the fingerprint of a log file, i.e. a digest of its first line.
+        :param str logpath: the path to the log file
+        :return: <string> the fingerprint, None if the file has no complete line
+        """
+        with LogTrimmer.file_context(logpath) as f:
+            line = f.readline()
+        if not line.endswith('\n'):
+            return None
+        return hashlib.md5(line).hexdigest()
+
+
+class LogPositions:
+    def __init__(self, session):
+        """
+        Keeps the positions of log files read so far (as system info entries), keyed on their fingerprint.
+        :param session: the database session
+        """
+        self.session = session
+
+    def get(self, fingerprint):
+        """
+        Returns the position of a log file, None if not read before.
+        :param str fingerprint: the fingerprint of the log file
+        :return: <dict> the (uncompressed) offset to read on from, and whether the file is completely read
+        """
+        info = self.session.query(SystemInfo).get(self.key_prefix + fingerprint)
+        if info is None:
+            return None
+        try:
+            entry = json.loads(info.value)
+        except ValueError:
+            return None
+        return {'offset': entry['offset'], 'complete': entry.get('complete', False)}
+
+    def update(self, fingerprint, logpath, stat, offset, complete):
+        """
+        Records the position of a log file (along with its current path and inode).
+        """
+        key = self.key_prefix + fingerprint
+        value = json.dumps({
+            'path': logpath,
+            'inode': stat.st_ino,
+            'offset': offset,
+            'complete': complete,
+        })
+        info = self.session.query(SystemInfo).get(key)
+        if info is None:
+            self.session.add(SystemInfo(key, value))
+        else:
+            info.value = value
+
+    key_prefix = "logtail:"
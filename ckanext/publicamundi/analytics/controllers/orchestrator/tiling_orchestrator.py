@@ -1,6 +1,9 @@
+import re
 import json
+from datetime import date, timedelta
 from lxml import etree
 import urllib
+from ckanext.publicamundi.analytics.controllers.util.habbox import to_web_mercator, from_web_mercator
 
 
 class TilingOrchestrator:
@@ -18,13 +21,27 @@ class TilingOrchestrator:
 
     __RETILING_METHOD = "areaofinterest"
 
+    __BBOX_REQUEST = "/bbox/{start}/{end}?within={within}"
+
+    # the period (in days, until today) of bbox accesses considered for retiling
+    __BBOX_PERIOD = 30
+
+    # the codes of crs equivalent to EPSG:3857 (the crs of accessed bboxes)
+    __WEB_MERCATOR_CODES = ("3857", "900913", "3785", "102100")
+
     def __init__(self, analytics_api_endpoint, rasdaman_endpoint):
         self.analytics_api = analytics_api_endpoint
         self.rasdaman_endpoint = rasdaman_endpoint
         self.coverages = None
 
-    def determine_bbox(self):
-        response = urllib.urlopen(self.analytics_api + "/parse/bbox").read()
+    def determine_bbox(self, within):
+        # the bboxes within the given one (in EPSG:3857, as the bboxes of the analytics api) are selected by the
+        # (spatially indexed) analytics api
+        end = date.today()
+        start = end - timedelta(days=self.__BBOX_PERIOD)
+        request = self.analytics_api + self.__BBOX_REQUEST.replace("{start}", start.isoformat()) \
+            .replace("{end}", end.isoformat()).replace("{within}", ",".join(map(repr, within)))
+        response = urllib.urlopen(request).read()
         bboxes = map(lambda x: x['bbox'][0][0] + x['bbox'][0][2], json.loads(response))
         return bboxes
 
@@ -45,12 +62,15 @@ class TilingOrchestrator:
         return json.dumps({"error": error})
 
     def describe_retiling(self, coverage_name):
-        bboxes = self.determine_bbox()
         coverage = self.get_coverage(coverage_name)
+        # Note Accessed bboxes are in EPSG:3857, so they are compared to the (reprojected) coverage bbox, and are
+        # described in the crs of the coverage (as the coverage bbox, and as expected by tiling requests)
+        coverage_bbox = self.to_web_mercator_bbox(coverage, coverage["bbox"])
+        bboxes = self.determine_bbox(coverage_bbox)
         description = {"name": coverage["name"], "coverage_bbox": coverage["bbox"], "bbox": []}
         for bbox in bboxes:
-            if self.bbox_contains(coverage["bbox"], bbox):
-                description["bbox"].append(bbox)
+            if self.bbox_contains(coverage_bbox, bbox):
+                description["bbox"].append(self.from_web_mercator_bbox(coverage, bbox))
         return description
 
     def retile_coverage(self, coverage_name):
@@ -68,6 +88,48 @@ class TilingOrchestrator:
             return True
         return False
 
+    def to_web_mercator_bbox(self, coverage, bbox):
+        """
+        Reprojects a bbox (in the crs and axis order of the coverage) to EPSG:3857.
+        :return: <[float]> the bbox as (min_x, min_y, max_x, max_y).
+        """
+        geographic, lat_first = self.get_crs_axes(coverage)
+        if not geographic:
+            return list(bbox)
+        if lat_first:
+            bbox = [bbox[1], bbox[0], bbox[3], bbox[2]]
+        return list(to_web_mercator(bbox[0], bbox[1]) + to_web_mercator(bbox[2], bbox[3]))
+
+    def from_web_mercator_bbox(self, coverage, bbox):
+        """
+        Reprojects a bbox in EPSG:3857 to the crs (and axis order) of the coverage.
+        """
+        geographic, lat_first = self.get_crs_axes(coverage)
+        if not geographic:
+            return list(bbox)
+        bbox = list(from_web_mercator(bbox[0], bbox[1]) + from_web_mercator(bbox[2], bbox[3]))
+        if lat_first:
+            bbox = [bbox[1], bbox[0], bbox[3], bbox[2]]
+        return bbox
+
+    def get_crs_axes(self, coverage):
+        """
+        Determines the crs of a coverage: either geographic (EPSG:4326, CRS:84) or EPSG:3857 (or an alias).
+        :return: <(boolean, boolean)> whether the crs is geographic, and whether latitude is the first axis.
+        """
+        crs = coverage.get("crs", "")
+        labels = coverage.get("axis_labels", [])
+        lat_first = bool(labels) and labels[0].lower().startswith("lat")
+        if "crs84" in crs.lower():
+            return True, lat_first
+        codes = re.findall(r"epsg(?:/0/|:+)(\d+)", crs.lower())
+        if not codes or codes[0] in self.__WEB_MERCATOR_CODES:
+            return False, False
+        if codes[0] == "4326":
+            # Note EPSG:4326 is defined in latitude, longitude order (unless labelled otherwise)
+            return True, lat_first or not labels
+        raise ValueError("Cannot reproject the bbox of the coverage %s (crs %s)" % (coverage["name"], crs))
+
     def get_coverage(self, name):
         return self.get_coverage_description(name)
 
@@ -88,7 +150,9 @@ class TilingOrchestrator:
         geo_high = map(lambda x: float(x),
                        root.xpath("//gml:Envelope/gml:upperCorner", namespaces=self._get_ns())[0].text.strip().split(
                            " "))[:2]
-        return {"name": coverage, "bbox": geo_low + geo_high}
+        envelope = root.xpath("//gml:Envelope", namespaces=self._get_ns())[0]
+        return {"name": coverage, "bbox": geo_low + geo_high, "crs": envelope.get("srsName", ""),
+                "axis_labels": envelope.get("axisLabels", "").split()}
 
     def execute_tiling_request(self, coverage_id, tiling_strategy, tiling_subset):
         error = False
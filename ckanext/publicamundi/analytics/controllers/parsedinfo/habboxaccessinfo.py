@@ -56,6 +56,13 @@ class HABboxAccessInfo(Base):
             self.access_count + another.access_count, self.crs)
         return ret
 
+    def accumulate(self, another):
+        """
+        Adds the access count of another object to the current one (in place).
+        :param <HABboxAccessInfo> another: an object to be accumulated into the current one.
+        """
+        self.access_count += another.access_count
+
     """
     Keys for exporting to json.
     """
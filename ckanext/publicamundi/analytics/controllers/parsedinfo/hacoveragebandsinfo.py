@@ -57,6 +57,13 @@ class HACoverageBandsInfo(Base):
         ret.color = self.color
         return ret
 
+    def accumulate(self, another):
+        """
+        Adds the access count of another object to the current one (in place).
+        :param <HACoverageInfo> another: an object to be accumulated into the current one.
+        """
+        self.access_count += another.access_count
+
     """
     Keys for exporting to json.
     """
@@ -73,6 +73,17 @@ class HAServiceAccessInfo(Base):
         ret.geoserver = self.geoserver + another.geoserver
         return ret
 
+    def accumulate(self, another):
+        """
+        Adds the access counts of another object to the current one (in place).
+        :param <HAServiceInfo> another: an object to be accumulated into the current one.
+        """
+        self.rasdaman += another.rasdaman
+        self.wcs += another.wcs
+        self.wcps += another.wcps
+        self.wms += another.wms
+        self.geoserver += another.geoserver
+
     """
     Keys for exporting to json.
     """
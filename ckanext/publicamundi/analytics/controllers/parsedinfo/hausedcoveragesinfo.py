@@ -47,6 +47,13 @@ class HAUsedCoveragesInfo(Base):
         ret = HAUsedCoveragesInfo(self.date, self.coverage_name, self.access_count + another.access_count)
         return ret
 
+    def accumulate(self, another):
+        """
+        Adds the access count of another object to the current one (in place).
+        :param <HACoverageInfo> another: an object to be accumulated into the current one.
+        """
+        self.access_count += another.access_count
+
     """
     Keys for exporting to json.
     """
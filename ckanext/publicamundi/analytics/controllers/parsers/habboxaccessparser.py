@@ -1,12 +1,13 @@
 from ckanext.publicamundi.analytics.controllers.util.habbox import HABbox
 from ckanext.publicamundi.analytics.controllers.parsedinfo.habboxaccessinfo import HABboxAccessInfo
-from ckanext.publicamundi.analytics.controllers.parsers.haparser import HAParser
+from ckanext.publicamundi.analytics.controllers.parsers.haparser import HAParser, HAInfoAggregator
 
 
 class HABboxAccessParser(HAParser):
     """
     Specialized HAParser for information about bounding boxes of coverages / layers accessed in the request.
-    Limitations: currently assumes crs ESPG:3857.
+    Bounding boxes are normalized to EPSG:3857 (see HABbox.crs): coordinates given in EPSG:4326 (or CRS:84) are
+    transformed, coordinates in any other crs are assumed to be in EPSG:3857.
     """
     __author__ = "<a href='mailto:merticariu@rasdaman.com'>Vlad Merticariu</a>"
 
@@ -33,7 +34,43 @@ class HABboxAccessParser(HAParser):
         if len(coordinates) <= 4:
             return None
         else:
-            return HABbox(coordinates[0], coordinates[1], coordinates[2], coordinates[3])
+            geographic, lat_first = self.extract_wms_crs(line)
+            return HABbox.from_request(coordinates[:4], geographic, lat_first)
+
+    @staticmethod
+    def extract_wms_crs(line):
+        """
+        Extracts the crs of the bounding box of a wms request.
+        :param <string> line: a log line representing a wms request.
+        :return: <(boolean, boolean)>: whether the crs is geographic, and whether latitude is given first.
+        """
+        for keys, lat_first in ((HABboxAccessParser.wms_crs_keys, True), (HABboxAccessParser.wms_srs_keys, False)):
+            for key in keys:
+                if key in line:
+                    crs = line.split(key)[1].split(HABboxAccessParser.and_key)[0].split(" ")[0]
+                    if crs in HABboxAccessParser.geographic_crs:
+                        # Note CRS:84 is given in longitude, latitude order (as EPSG:4326 of wms < 1.3.0)
+                        return True, lat_first and crs != "crs:84"
+                    return False, False
+        return False, False
+
+    @staticmethod
+    def extract_wcs_crs(line, first_label, second_label):
+        """
+        Extracts the crs of the bounding box of a wcs request, from the subsetting crs or the labels of subsets.
+        :param <string> line: a log line representing a wcs request.
+        :param <string> first_label: the label of the first subset (the axis, possibly followed by a crs).
+        :param <string> second_label: the label of the second subset.
+        :return: <(boolean, boolean)>: whether the crs is geographic, and whether latitude is given first.
+        """
+        axis = first_label.split(HABboxAccessParser.coordinates_separator)[0]
+        geographic = axis in HABboxAccessParser.geographic_axes or \
+            HABboxAccessParser.geographic_crs_uri in first_label or \
+            HABboxAccessParser.geographic_crs_uri in second_label
+        if not geographic and HABboxAccessParser.wcs_crs_key in line:
+            crs = line.split(HABboxAccessParser.wcs_crs_key)[1].split(HABboxAccessParser.and_key)[0]
+            geographic = HABboxAccessParser.geographic_crs_uri in crs
+        return geographic, geographic and axis == "lat"
 
     def extract_wcs_bbox(self, line):
         """
@@ -49,7 +86,10 @@ class HABboxAccessParser(HAParser):
             second_subset = split[2].split("=")[1].split("(")[1].split(")")[0].split(",")
             # check if we got exactly 4 points
             if len(first_subset) == 2 and len(second_subset) == 2:
-                return HABbox(first_subset[0], second_subset[0], first_subset[1], second_subset[1])
+                geographic, lat_first = self.extract_wcs_crs(
+                    line, split[1].split("=")[1].split("(")[0], split[2].split("=")[1].split("(")[0])
+                return HABbox.from_request(
+                    (first_subset[0], second_subset[0], first_subset[1], second_subset[1]), geographic, lat_first)
         # in case we have the wrong number of points
         return None
 
@@ -62,11 +102,11 @@ class HABboxAccessParser(HAParser):
         if self.wcs_bbox_key in line:
             bbox = self.extract_wcs_bbox(line)
             if bbox is not None:
-                return HABboxAccessInfo(HAParser.parse_date(line), bbox, 1)
+                return HABboxAccessInfo(HAParser.parse_date(line), bbox, 1, HABbox.crs)
         if self.wms_bbox_key in line:
             bbox = self.extract_wms_bbox(line)
             if bbox is not None:
-                return HABboxAccessInfo(HAParser.parse_date(line), bbox, 1)
+                return HABboxAccessInfo(HAParser.parse_date(line), bbox, 1, HABbox.crs)
         # in case there is no bbox
         return None
 
@@ -75,13 +115,14 @@ class HABboxAccessParser(HAParser):
         Parses the information about bounding boxes addressed in a log file.
         :return: <[HABoxAccessInfo]>: the list of bounding boxes addressed in the log file.
         """
-        bbox_list = []
+        # merge the results while parsing
+        aggregator = HAInfoAggregator(HABboxAccessInfo.bbox_property_key)
         for line in self.log_lines:
             validated_line = self.validate_line(line)
             bbox = self.parse_line(validated_line)
             if bbox is not None:
-                bbox_list.append(bbox)
-        return self.merge_info_list(bbox_list, HABboxAccessInfo.bbox_property_key)
+                aggregator.add(bbox)
+        return aggregator.results()
 
     """
     Key definitions, to know what to look for in the log file.
@@ -90,3 +131,9 @@ class HABboxAccessParser(HAParser):
     wcs_bbox_key = "&subset"
     and_key = "&"
     coordinates_separator = ","
+    wms_crs_keys = ("&crs=", "?crs=")
+    wms_srs_keys = ("&srs=", "?srs=")
+    wcs_crs_key = "subsettingcrs="
+    geographic_crs = ("epsg:4326", "crs:84")
+    geographic_crs_uri = "/4326"
+    geographic_axes = ("lat", "long", "lon")
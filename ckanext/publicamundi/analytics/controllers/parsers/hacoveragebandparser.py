@@ -1,5 +1,5 @@
 from ckanext.publicamundi.analytics.controllers.parsedinfo.hacoveragebandsinfo import HACoverageBandsInfo
-from ckanext.publicamundi.analytics.controllers.parsers.haparser import HAParser
+from ckanext.publicamundi.analytics.controllers.parsers.haparser import HAParser, HAInfoAggregator
 from ckanext.publicamundi.analytics.controllers.parsers.hausedcoveragesparser import HAUsedCoveragesParser
 
 
@@ -65,12 +65,13 @@ class HACoverageBandParser(HAParser):
         """
         result = []
         for coverage_name in self.coverage_names:
-            band_info_list = []
+            # merge the results while parsing
+            aggregator = HAInfoAggregator(HACoverageBandsInfo.band_property_key)
             for line in self.log_lines:
                 validated_line = self.validate_line(line)
                 if coverage_name.lower() in validated_line:
-                    band_info_list += self.parse_coverage_band_line(coverage_name, validated_line)
-            merged_list = self.merge_info_list(band_info_list, HACoverageBandsInfo.band_property_key)
+                    aggregator.extend(self.parse_coverage_band_line(coverage_name, validated_line))
+            merged_list = aggregator.results()
             self.assign_colors_to_bands(merged_list)
             result += merged_list
         return result
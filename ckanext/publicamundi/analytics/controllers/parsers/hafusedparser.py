@@ -0,0 +1,374 @@
+import re
+import urllib
+import tempfile
+from collections import OrderedDict
+from datetime import datetime, date
+
+from ckanext.publicamundi.analytics.controllers import configmanager
+from ckanext.publicamundi.analytics.controllers.util.habbox import HABbox
+from ckanext.publicamundi.analytics.controllers.parsedinfo.habboxaccessinfo import HABboxAccessInfo
+from ckanext.publicamundi.analytics.controllers.parsedinfo.hacoveragebandsinfo import HACoverageBandsInfo
+from ckanext.publicamundi.analytics.controllers.parsedinfo.haserviceaccessinfo import HAServiceAccessInfo
+from ckanext.publicamundi.analytics.controllers.parsedinfo.hausedcoveragesinfo import HAUsedCoveragesInfo
+from ckanext.publicamundi.analytics.controllers.parsers.haparser import HAParser
+from ckanext.publicamundi.analytics.controllers.parsers.habboxaccessparser import HABboxAccessParser
+from ckanext.publicamundi.analytics.controllers.parsers.hacoveragebandparser import HACoverageBandParser
+from ckanext.publicamundi.analytics.controllers.parsers.haservicesaccessparser import HAServicesAccessParser
+from ckanext.publicamundi.analytics.controllers.parsers.hausedcoveragesparser import HAUsedCoveragesParser
+
+
+class HAFusedParser(HAParser):
+    """
+    Parses the information of all the specialized parsers (used coverages, services, coverage bands and
+    bounding boxes) in a single pass over the log lines.
+
+    Every line is tokenized exactly once (validated, dated, and its request parameters extracted), and the
+    resulting request is dispatched to the extractors of all metrics. The results are the same as the ones
+    of the specialized parsers: request parameters are extracted with the same (substring-based) rules.
+    """
+
+    def __init__(self, log_lines):
+        """
+        Class constructor.
+        :param list[str] log_lines: a list of log lines
+        """
+        HAParser.__init__(self, log_lines)
+        self._dates = {}
+
+    def parse(self):
+        """
+        Parses the log lines, and returns the information of all metrics, in the order of
+        used coverages, services, coverage bands and bounding boxes.
+        :return: <[HA*Info]>: a list of specialized objects describing the parsed information.
+        """
+        metrics = self.parse_metrics()
+        return metrics["coverages"] + metrics["services"] + metrics["bands"] + metrics["bbox"]
+
+    def parse_metrics(self):
+        """
+        Parses the log lines, and returns the information of all metrics.
+        :return: <dict> the lists of HA*Info objects, keyed on metric (coverages, services, bands, bbox).
+        """
+        coverages = CoverageExtractor()
+        extractors = [ServicesExtractor(), BboxExtractor(), coverages]
+        for line in self.log_lines:
+            request = self.tokenize_line(line)
+            if request is not None:
+                for extractor in extractors:
+                    extractor.feed(request)
+        return {
+            "coverages": coverages.used_coverages(),
+            "services": extractors[0].results(),
+            "bands": coverages.bands(),
+            "bbox": extractors[1].results(),
+        }
+
+    def tokenize_line(self, line):
+        """
+        Tokenizes a line of log.
+        :param <string> line: the line to be tokenized.
+        :return: <HARequest> the tokenized request, None if the line is empty or wrongly formatted.
+        """
+        # only consider non-empty lines (see HAParser.validate_line)
+        if len(line) <= 4:
+            return None
+        text = urllib.unquote(self.spaces_pattern.sub(" ", line)).lower()
+        date = self.parse_line_date(text)
+        if date is None:
+            return None
+        return HARequest(line, text, date)
+
+    def parse_line_date(self, text):
+        """
+        Parses the date from a (validated) line of log. Only the date part of the timestamp is parsed
+        (if the time format allows it), and parsed dates are kept for the following lines.
+        :param <string> text: the line to be parsed.
+        :return: <date> the date of the line, None if wrongly formatted.
+        """
+        parts = text.split(" ", 7)
+        if len(parts) < 7:
+            return None
+        token = parts[6].split(".")[0][1:]
+        time_format = configmanager.ha_proxy_time_format
+        date_format = time_format.split(":%H", 1)[0]
+        if date_format != time_format and ":" not in date_format:
+            token = token.split(":", 1)[0]
+        else:
+            date_format = time_format
+        date = self._dates.get(token)
+        if date is None:
+            try:
+                date = datetime.strptime(token, date_format).date()
+            except ValueError:
+                return None
+            self._dates[token] = date
+        return date
+
+    spaces_pattern = re.compile(" {2,}")
+
+
+class HARequest(object):
+    """
+    A tokenized line of log.
+    """
+
+    __slots__ = ("line", "text", "date", "_params")
+
+    def __init__(self, line, text, date):
+        """
+        Class constructor.
+        :param <string> line: the original line.
+        :param <string> text: the validated line (spaces collapsed, unquoted and lower-cased).
+        :param <date> date: the date of the line.
+        """
+        self.line = line
+        self.text = text
+        self.date = date
+        self._params = {}
+
+    def param(self, key):
+        """
+        Returns the value (of the first occurrence) of a request parameter in the validated line, as
+        extracted by the specialized parsers: up to the next "&" (or space, if none follows).
+        :param <string> key: the parameter key, including the "=" sign.
+        :return: <string> the value, None if the key is not present.
+        """
+        try:
+            return self._params[key]
+        except KeyError:
+            value = self._params[key] = extract_value(self.text, key)
+            return value
+
+
+def extract_value(text, key):
+    """
+    Extracts the value following the first occurrence of key in text (see HAParser-based parsers).
+    :return: <string> the value, None if the key is not present.
+    """
+    i = text.find(key)
+    if i < 0:
+        return None
+    rest = text[i + len(key):]
+    j = rest.find(key)
+    if j >= 0:
+        rest = rest[:j]
+    j = rest.find("&")
+    if j >= 0:
+        return rest[:j]
+    j = rest.find(" ")
+    return rest[:j] if j >= 0 else rest
+
+
+class ServicesExtractor(object):
+    """
+    Extracts the access counts of services, by date (see HAServicesAccessParser).
+    """
+
+    def __init__(self):
+        self.by_date = OrderedDict()
+
+    def feed(self, request):
+        info = self.by_date.get(request.date)
+        if info is None:
+            info = self.by_date[request.date] = HAServiceAccessInfo(request.date)
+        text = request.text
+        if HAServicesAccessParser.rasdaman_key in text:
+            info.rasdaman += 1
+        if HAServicesAccessParser.wcs_key in text:
+            info.wcs += 1
+        if HAServicesAccessParser.wcps_key in text:
+            info.wcps += 1
+        if HAServicesAccessParser.wms_key in text:
+            info.wms += 1
+        if HAServicesAccessParser.geoserver_key in text:
+            info.geoserver += 1
+
+    def results(self):
+        return self.by_date.values()
+
+
+class BboxExtractor(object):
+    """
+    Extracts the access counts of bounding boxes (see HABboxAccessParser).
+    """
+
+    def __init__(self):
+        self.by_bbox = OrderedDict()
+        # the bboxes made so far, keyed on the coordinates (and crs) as given in requests
+        self.bboxes = {}
+
+    def feed(self, request):
+        bbox = None
+        text = request.text
+        if HABboxAccessParser.wcs_bbox_key in text:
+            bbox = self.extract_wcs_bbox(text)
+        if bbox is None and HABboxAccessParser.wms_bbox_key in text:
+            bbox = self.extract_wms_bbox(request)
+        if bbox is None:
+            return
+        info = self.by_bbox.get(bbox)
+        if info is None:
+            self.by_bbox[bbox] = HABboxAccessInfo(request.date, bbox, 1, HABbox.crs)
+        else:
+            info.access_count += 1
+
+    def extract_wcs_bbox(self, text):
+        split = text.split(HABboxAccessParser.wcs_bbox_key)
+        if len(split) > 2:
+            try:
+                first_label, first_subset = split[1].split("=")[1].split("(")[:2]
+                second_label, second_subset = split[2].split("=")[1].split("(")[:2]
+            except (IndexError, ValueError):
+                # a malformed subset
+                return None
+            first_subset = first_subset.split(")")[0].split(",")
+            second_subset = second_subset.split(")")[0].split(",")
+            if len(first_subset) == 2 and len(second_subset) == 2:
+                crs = HABboxAccessParser.extract_wcs_crs(text, first_label, second_label)
+                return self.make_bbox(
+                    (first_subset[0], second_subset[0], first_subset[1], second_subset[1]), crs)
+        return None
+
+    def extract_wms_bbox(self, request):
+        coordinates = request.param(HABboxAccessParser.wms_bbox_key).split(
+            HABboxAccessParser.coordinates_separator)
+        # Note Keep the rule of HABboxAccessParser (expects more than 4 coordinates)
+        if len(coordinates) <= 4:
+            return None
+        return self.make_bbox(tuple(coordinates[:4]), HABboxAccessParser.extract_wms_crs(request.text))
+
+    def make_bbox(self, coordinates, crs):
+        key = (coordinates, crs)
+        try:
+            return self.bboxes[key]
+        except KeyError:
+            bbox = self.bboxes[key] = HABbox.from_request(coordinates, *crs)
+            return bbox
+
+    def results(self):
+        return self.by_bbox.values()
+
+
+class CoverageExtractor(object):
+    """
+    Extracts the access counts of coverages/layers and of their bands (see HAUsedCoveragesParser and
+    HACoverageBandParser).
+
+    Coverages are only known after all lines are seen (a line counts for every known coverage it mentions),
+    so every request is kept for a second pass. Note Requests are spooled to a temporary file (only their date
+    and validated line), so that memory does not grow with the number of lines.
+    """
+
+    coverage_keys = (
+        HAUsedCoveragesParser.wcs_coverage_access_key,
+        HAUsedCoveragesParser.wms_layers_access_key,
+        HAUsedCoveragesParser.wms_layer_access_key,
+    )
+
+    def __init__(self):
+        self.coverages = set()
+        self.spool = tempfile.TemporaryFile()
+
+    def feed(self, request):
+        # Note Coverage names are collected from the original line (as HAUsedCoveragesParser does)
+        line = request.line
+        for key in self.coverage_keys:
+            if key in line:
+                for name in self.extract_coverage_names(extract_value(line, key)):
+                    name = name.strip(" \t\n\r")
+                    if name:
+                        self.coverages.add(name)
+        # Note The length of the text is recorded, as an unquoted text may contain newlines
+        text = request.text
+        self.spool.write("%d %d\n" % (request.date.toordinal(), len(text)))
+        self.spool.write(text)
+
+    def iter_requests(self):
+        """
+        Iterates on the spooled requests (with no original line), and discards them.
+        :rtype: iterator over HARequest
+        """
+        spool, self.spool = self.spool, None
+        dates = {}
+        try:
+            spool.seek(0)
+            while True:
+                header = spool.readline()
+                if not header:
+                    break
+                ordinal, length = [int(x) for x in header.split()]
+                request_date = dates.get(ordinal)
+                if request_date is None:
+                    request_date = dates[ordinal] = date.fromordinal(ordinal)
+                yield HARequest(None, spool.read(length), request_date)
+        finally:
+            spool.close()
+
+    def extract_coverage_names(self, container):
+        if HAUsedCoveragesParser.coverage_separator_standard in container:
+            return container.split(HAUsedCoveragesParser.coverage_separator_standard)
+        elif HAUsedCoveragesParser.coverage_separator_geoserver in container:
+            return [container.split(HAUsedCoveragesParser.coverage_separator_geoserver)[1]]
+        else:
+            return [container]
+
+    def extract_bands(self, request):
+        focus = request.param(HACoverageBandParser.range_subset_key)
+        if focus is None:
+            return None
+        if HACoverageBandParser.comma_key in focus:
+            return focus.split(HACoverageBandParser.comma_key)
+        elif HACoverageBandParser.column_key in focus:
+            return focus.split(HACoverageBandParser.column_key)
+        else:
+            return [focus]
+
+    def _count(self):
+        if hasattr(self, "_used"):
+            return
+        names = list(self.coverages)
+        lower_names = [(name, name.lower()) for name in names]
+        self._used = OrderedDict()
+        self._bands = OrderedDict((name, OrderedDict()) for name in names)
+        for request in self.iter_requests():
+            text = request.text
+            matched = [name for name, lower_name in lower_names if lower_name in text]
+            if not matched:
+                continue
+            bands = self.extract_bands(request)
+            for name in matched:
+                info = self._used.get(name)
+                if info is None:
+                    self._used[name] = HAUsedCoveragesInfo(request.date, name, 1)
+                else:
+                    info.access_count += 1
+                for band in bands or []:
+                    band_infos = self._bands[name]
+                    info = band_infos.get(band)
+                    if info is None:
+                        band_infos[band] = HACoverageBandsInfo(request.date, name, band, 1)
+                    else:
+                        info.access_count += 1
+
+    def used_coverages(self):
+        """
+        :return: <[HAUsedCoveragesInfo]> sorted in descending order by number of accesses.
+        """
+        self._count()
+        result = self._used.values()
+        result.sort(key=lambda x: x.access_count, reverse=True)
+        return result
+
+    def bands(self):
+        """
+        :return: <[HACoverageBandsInfo]> the bands accessed, for every coverage.
+        """
+        self._count()
+        result = []
+        for band_infos in self._bands.itervalues():
+            merged_list = band_infos.values()
+            color_list = HACoverageBandParser.color_list
+            for i, band_info in enumerate(merged_list):
+                band_info.color = color_list[i % len(color_list)]
+            result += merged_list
+        return result
@@ -1,4 +1,5 @@
 from abc import abstractmethod
+from collections import OrderedDict
 import urllib
 import re
 
@@ -50,28 +51,13 @@ class HAParser:
         """
         Merges the current list of HA*Info objects by the given key. Objects having the same value for the given unique_key
         create a new object having the access counts added.
-        :param: <[HA*Info]>: the list of objects to be merged.
+        :param: <[HA*Info]>: the list (or any iterable) of objects to be merged.
         :param: <string> unique_key: the key of the property by which the merging is done.
         :return: <[HA*Info]> a list of objects representing the total services access counts for each different date.
         """
-        unique_entries = []
-        ret = []
-        # parse the different dates
-        for i in services_info_list:
-            if getattr(i, unique_key) not in unique_entries:
-                unique_entries.append(getattr(i, unique_key))
-        # go through all dates and, for each unique date merge all the service info objects
-        for i in unique_entries:
-            partial_result = None
-            for j in services_info_list:
-                if i == getattr(j, unique_key):
-                    # initialize partial_result if it is not initialized
-                    if partial_result is None:
-                        partial_result = j
-                    else:
-                        partial_result = partial_result.merge(j)
-            ret.append(partial_result)
-        return ret
+        aggregator = HAInfoAggregator(unique_key)
+        aggregator.extend(services_info_list)
+        return aggregator.results()
 
     @abstractmethod
     def parse(self):
@@ -90,18 +76,71 @@ class HAParser:
         :param <[object]> the list of objects to be printed.
         :return: <string> the list as a json string.
         """
+        return "".join(HAParser.iter_json_array(object_list))
+
+    @staticmethod
+    def iter_json_array(object_list):
+        """
+        Yields the parts of a json array representing the list of objects (see print_as_json_array), so that
+        the array can be streamed (e.g. as a WSGI response) instead of being built in memory.
+        :param <[object]> the list (or any iterable) of objects to be printed.
+        :return: <iterator over string> the opening bracket, every object (preceded by a separator, if not the
+        first one) and the closing bracket.
+        """
+        separator = "["
+        for i in object_list:
+            yield separator + str(i)
+            separator = ","
         # if the list is empty, print empty array
-        if not object_list:
-            return "[]"
+        if separator == "[":
+            yield "["
+        yield "]"
+
+class HAInfoAggregator(object):
+    """
+    Merges HA*Info objects by the given key, as they are added. Objects are kept in a dictionary keyed on the value
+    of their unique_key (which must be hashable), in the order of the first object added for each key.
+
+    The first object of a key is kept as is (it is never modified), and is replaced by a merged object as soon as
+    another object with the same key is added. Later objects are accumulated into the merged object, in place.
+    """
+
+    def __init__(self, unique_key="date"):
+        """
+        Class constructor.
+        :param: <string> unique_key: the key of the property by which the merging is done.
+        """
+        self.unique_key = unique_key
+        self.entries = OrderedDict()
+        self.merged_keys = set()
+
+    def add(self, info):
+        """
+        Adds an object to be merged.
+        :param: <HA*Info> info: the object to be merged.
+        """
+        key = getattr(info, self.unique_key)
+        merged = self.entries.get(key)
+        if merged is None:
+            self.entries[key] = info
+        elif key not in self.merged_keys:
+            self.entries[key] = merged.merge(info)
+            self.merged_keys.add(key)
+        elif hasattr(merged, "accumulate"):
+            merged.accumulate(info)
         else:
-            out = "["
-            for i in object_list[:-1]:
-                out += str(i)
-                # add separator as this is not the last element
-                out += ","
-            # add last element
-            out += str(object_list[-1])
-            out += "]"
-            return out
+            self.entries[key] = merged.merge(info)
 
+    def extend(self, info_list):
+        """
+        Adds all objects of a list (or any iterable) to be merged.
+        :param: <[HA*Info]> info_list: the objects to be merged.
+        """
+        for info in info_list:
+            self.add(info)
 
+    def results(self):
+        """
+        :return: <[HA*Info]> a list of merged objects, one for each different key.
+        """
+        return self.entries.values()
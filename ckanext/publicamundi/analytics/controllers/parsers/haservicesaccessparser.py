@@ -1,4 +1,4 @@
-from ckanext.publicamundi.analytics.controllers.parsers.haparser import HAParser
+from ckanext.publicamundi.analytics.controllers.parsers.haparser import HAParser, HAInfoAggregator
 from ckanext.publicamundi.analytics.controllers.parsedinfo.haserviceaccessinfo import HAServiceAccessInfo
 
 
@@ -41,14 +41,14 @@ class HAServicesAccessParser(HAParser):
         Parses the services access counts from the current log file.
         :return <[HAServiceInfo]> a list of objects representing the total services access counts for each different date.
         """
-        services_info_list = []
+        # merge the results while parsing
+        aggregator = HAInfoAggregator()
         for line in self.log_lines:
             # only consider valid lines.
             validated_line = self.validate_line(line)
             if validated_line:
-                services_info_list.append(self.parse_service_info_line(validated_line))
-        # merge the results and return
-        return self.merge_info_list(services_info_list)
+                aggregator.add(self.parse_service_info_line(validated_line))
+        return aggregator.results()
 
     """
     Key definitions, to know what to look for in the log file.
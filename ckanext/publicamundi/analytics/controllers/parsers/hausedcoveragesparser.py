@@ -1,4 +1,4 @@
-from ckanext.publicamundi.analytics.controllers.parsers.haparser import HAParser
+from ckanext.publicamundi.analytics.controllers.parsers.haparser import HAParser, HAInfoAggregator
 from ckanext.publicamundi.analytics.controllers.parsedinfo.hausedcoveragesinfo import HAUsedCoveragesInfo
 
 
@@ -71,12 +71,13 @@ class HAUsedCoveragesParser(HAParser):
         :return: <[HAUsedCoveragesInfo]> the list of objects describing the coverages that have been accessed, sorted in
         descending order by number of accesses.
         """
-        result = []
+        # merge the results while parsing
+        aggregator = HAInfoAggregator(HAUsedCoveragesInfo.coverage_name_property_key)
         accessed_coverages = self.parse_accessed_coverages()
         for line in self.log_lines:
             validated_line = self.validate_line(line)
-            result += self.parse_line(validated_line, accessed_coverages)
-        result = self.merge_info_list(result, HAUsedCoveragesInfo.coverage_name_property_key)
+            aggregator.extend(self.parse_line(validated_line, accessed_coverages))
+        result = aggregator.results()
         # sort the result by access_count
         result.sort(key=lambda x: x.access_count, reverse=True)
         return result
@@ -0,0 +1,86 @@
+import logging
+from ckanext.publicamundi import cache_manager
+from ckanext.publicamundi.analytics.controllers import configmanager
+from ckanext.publicamundi.analytics.controllers.parsers.haparser import HAParser
+from ckanext.publicamundi.analytics.controllers.util.system import SystemInfo
+
+CACHE_NAME = "analytics-responses"
+
+
+class ResponseCache:
+    """
+    Caches the (json) responses of the analytics API, keyed on (endpoint, coverage, start_date, end_date).
+
+    Every entry is stored along with the state of analysis it was computed for, i.e. the system info entries that
+    analyze-logs updates (the latest date parsed and the time of the last update). An entry is stale as soon as
+    logs are analyzed again (and recomputed on the next request), so all processes serving the API (or sharing a beaker cache) see fresh totals.
+    """
+
+    def __init__(self, name=CACHE_NAME):
+        """
+        Class constructor.
+        :param <string> name: the name of the (beaker) cache.
+        """
+        self.name = name
+        self.logger = logging.getLogger(__name__)
+
+    def respond(self, endpoint, coverage_name, start_date, end_date, read):
+        """
+        Returns the response for a request, either from the cache or by reading the objects and streaming them
+        as a json array (the response is cached when fully streamed).
+        :param <string> endpoint: the name of the endpoint.
+        :param <string> coverage_name: the coverage/layer name requested, None if not applicable.
+        :param <string> start_date: the start date requested.
+        :param <string> end_date: the end date requested.
+        :param read: a callable returning the list of objects to be printed.
+        :return: <string> the cached response, or <iterator over string> the parts of the response.
+        """
+        if not configmanager.cache_responses:
+            return HAParser.iter_json_array(read())
+        key = self.make_key(endpoint, coverage_name, start_date, end_date)
+        state = self.read_state()
+        entry = self._get(key)
+        if entry is not None and entry["state"] == state:
+            return entry["body"]
+        return self._stream_and_put(key, state, read())
+
+    @staticmethod
+    def make_key(endpoint, coverage_name, start_date, end_date):
+        """
+        :return: <string> the cache key of a request.
+        """
+        return "|".join([endpoint, coverage_name or "", start_date, end_date])
+
+    @staticmethod
+    def read_state():
+        """
+        Reads the state of analysis (as updated by analyze-logs) from the system info entries.
+        :return: <string> the state of analysis, as a string.
+        """
+        session = configmanager.session
+        # Note Query plain values (not entities), as the long-lived session would keep returning loaded entities
+        rows = session.query(SystemInfo.key, SystemInfo.value).filter(
+            SystemInfo.key.in_([SystemInfo.LATEST_DATE_KEY, SystemInfo.LATEST_UPDATE_KEY])).all()
+        return "|".join(sorted("%s=%s" % (k, v) for k, v in rows))
+
+    def _stream_and_put(self, key, state, object_list):
+        parts = []
+        for part in HAParser.iter_json_array(object_list):
+            parts.append(part)
+            yield part
+        self._put(key, {"state": state, "body": "".join(parts)})
+
+    def _get(self, key):
+        try:
+            return cache_manager.get_cache(self.name).get(key)
+        except KeyError:
+            return None
+        except Exception as ex:
+            self.logger.warn("Failed to read cached response %s: %s", key, ex)
+            return None
+
+    def _put(self, key, entry):
+        try:
+            cache_manager.get_cache(self.name).put(key, entry)
+        except Exception as ex:
+            self.logger.warn("Failed to cache response %s: %s", key, ex)
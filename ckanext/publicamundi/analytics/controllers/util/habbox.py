@@ -1,7 +1,8 @@
 """
 Class representing a 2D bounding box, as it appears in the HAProxy logs.
 """
-from sqlalchemy import Column, Integer, String, ForeignKey
+import math
+from sqlalchemy import Column, Integer, Float, ForeignKey
 from ckanext.publicamundi.analytics.controllers.configmanager import Base
 
 __author__ = "<a href='mailto:merticariu@rasdaman.com'>Vlad Merticariu</a>"
@@ -12,23 +13,45 @@ class HABbox(Base):
 
     id = Column(Integer, primary_key=True)
     #bbox_access_id = Column(Integer, ForeignKey("bbox_access.id"))
-    min_x = Column(String, nullable=False)
-    min_y = Column(String, nullable=False)
-    max_x = Column(String, nullable=False)
-    max_y = Column(String, nullable=False)
+    min_x = Column(Float, nullable=False)
+    min_y = Column(Float, nullable=False)
+    max_x = Column(Float, nullable=False)
+    max_y = Column(Float, nullable=False)
 
     def __init__(self, min_x, min_y, max_x, max_y):
         """
         Class constructor.
-        @:param <string or int> min_x: minimum on the first axis.
-        @:param <string or int> min_y: minimum on the second axis.
-        @:param <string or int> max_x: maximum on the first axis.
-        @:param <string or int> max_y: maximum on the second axis.
+        @:param <string or number> min_x: minimum on the first axis.
+        @:param <string or number> min_y: minimum on the second axis.
+        @:param <string or number> max_x: maximum on the first axis.
+        @:param <string or number> max_y: maximum on the second axis.
         """
-        self.min_x = str(min_x)
-        self.min_y = str(min_y)
-        self.max_x = str(max_x)
-        self.max_y = str(max_y)
+        self.min_x = float(min_x)
+        self.min_y = float(min_y)
+        self.max_x = float(max_x)
+        self.max_y = float(max_y)
+
+    @staticmethod
+    def from_request(coordinates, geographic=False, lat_first=False):
+        """
+        Makes a bbox from the coordinates given in a request, normalized to the crs of bboxes (see crs).
+        :param <[string]> coordinates: the coordinates as (min_x, min_y, max_x, max_y).
+        :param <boolean> geographic: true if the coordinates are geographic (EPSG:4326), false if already in crs.
+        :param <boolean> lat_first: true if geographic coordinates are given in latitude, longitude order.
+        :return: <HABbox> the bbox, None if the coordinates are not (finite) numbers.
+        """
+        try:
+            min_x, min_y, max_x, max_y = [float(c) for c in coordinates]
+        except ValueError:
+            return None
+        if any(math.isinf(c) or math.isnan(c) for c in (min_x, min_y, max_x, max_y)):
+            return None
+        if geographic:
+            if lat_first:
+                min_x, min_y, max_x, max_y = min_y, min_x, max_y, max_x
+            min_x, min_y = to_web_mercator(min_x, min_y)
+            max_x, max_y = to_web_mercator(max_x, max_y)
+        return HABbox(min_x, min_y, max_x, max_y)
 
     def to_coordinates_str(self):
         """
@@ -36,17 +59,18 @@ class HABbox(Base):
         :return: <string> representation as coordinates.
         """
         # check if all the points are specified
-        if not self.min_x or not self.min_y or not self.max_x or not self.max_y:
+        if self.min_x is None or self.min_y is None or self.max_x is None or self.max_y is None:
             return ""
+        min_x, min_y, max_x, max_y = [format_coordinate(c) for c in (self.min_x, self.min_y, self.max_x, self.max_y)]
         output = "[["
         # lower left
-        output += "[" + self.min_x + "," + self.min_y + "]" + ","
+        output += "[" + min_x + "," + min_y + "]" + ","
         # upper left
-        output += "[" + self.min_x + "," + self.max_y + "]" + ","
+        output += "[" + min_x + "," + max_y + "]" + ","
         # upper right
-        output += "[" + self.max_x + "," + self.max_y + "]" + ","
+        output += "[" + max_x + "," + max_y + "]" + ","
         # lower right
-        output += "[" + self.max_x + "," + self.min_y + "]"
+        output += "[" + max_x + "," + min_y + "]"
         output += "]]"
         return output
 
@@ -57,4 +81,90 @@ class HABbox(Base):
         :return: <boolean> true if the coordinates are equal accordingly in the 2 objects.
         """
         return self.min_x == other.min_x and self.min_y == other.min_y and \
-            self.max_x == other.max_x and self.max_y == other.max_y
\ No newline at end of file
+            self.max_x == other.max_x and self.max_y == other.max_y
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        """
+        Hashing by value (consistent with equality), so that bboxes can be used as dictionary keys.
+        """
+        return hash((self.min_x, self.min_y, self.max_x, self.max_y))
+
+    """
+    The crs of all bboxes (as stored and exported), and its extent.
+    """
+    crs = "EPSG:3857"
+    crs_extent = (-20037508.342789244, -20037508.342789244, 20037508.342789244, 20037508.342789244)
+
+
+class HABboxDensityCell(object):
+    """
+    A cell of an access density grid (heatmap tile), i.e. the access count of bboxes centered within the cell.
+    """
+
+    def __init__(self, x, y, bbox, access_count=0):
+        """
+        Class constructor.
+        :param <int> x: the index of the cell on the first axis (from the minimum of the extent).
+        :param <int> y: the index of the cell on the second axis (from the minimum of the extent).
+        :param <HABbox> bbox: the extent of the cell.
+        :param <int> access_count: the access count of bboxes centered within the cell.
+        """
+        self.x = x
+        self.y = y
+        self.bbox = bbox
+        self.access_count = access_count
+
+    def __str__(self):
+        """
+        Override of __str__.
+        Handles the way the object is printed. The current format is json (the bbox and access count are printed
+        like those of HABboxAccessInfo, so that cells are displayed by the same widgets).
+        """
+        output = "{"
+        output += '"' + self.cell_key + '"' + ":[" + str(self.x) + "," + str(self.y) + "],"
+        output += '"' + self.bbox_key + '"' + ":" + self.bbox.to_coordinates_str() + ","
+        output += '"' + self.access_count_key + '"' + ":" + str(self.access_count) + ","
+        output += '"' + self.crs_key + '"' + ":\"" + HABbox.crs + "\""
+        output += "}"
+        return output
+
+    """
+    Keys for exporting to json.
+    """
+    cell_key = "cell"
+    bbox_key = "bbox"
+    access_count_key = "accessCount"
+    crs_key = "crs"
+
+
+def to_web_mercator(lon, lat):
+    """
+    Transforms geographic (EPSG:4326) coordinates to web mercator (EPSG:3857) ones.
+    :param <float> lon: the longitude.
+    :param <float> lat: the latitude (clipped to the extent of web mercator).
+    :return: <(float, float)> the transformed coordinates.
+    """
+    lat = max(min(lat, 85.0511287798066), -85.0511287798066)
+    x = lon * 20037508.342789244 / 180.0
+    y = math.log(math.tan((90.0 + lat) * math.pi / 360.0)) * 6378137.0
+    return x, y
+
+
+def from_web_mercator(x, y):
+    """
+    Transforms web mercator (EPSG:3857) coordinates to geographic (EPSG:4326) ones (see to_web_mercator).
+    :return: <(float, float)> the longitude and latitude.
+    """
+    lon = x * 180.0 / 20037508.342789244
+    lat = math.atan(math.exp(y / 6378137.0)) * 360.0 / math.pi - 90.0
+    return lon, lat
+
+
+def format_coordinate(c):
+    """
+    Formats a coordinate for json (as an integer, if integral).
+    """
+    return "%.15g" % c
@@ -8,6 +8,7 @@ class SystemInfo(Base):
     key = Column(String, primary_key=True)
     value = Column(String, nullable=False)
     LATEST_DATE_KEY = "latest_date"
+    LATEST_UPDATE_KEY = "latest_update"
 
     def __init__(self, key, value):
         self.key = key
@@ -29,6 +29,8 @@ class AnalyticsPlugin(p.SingletonPlugin):
         /api/analytics/parse/coverages: parses information about the access counts of all coverages/layers
         /api/analytics/parse/bands/{coverage-name}: parses information about the access count on bands for the
         coverage/layer with the passed name
+        /api/analytics/heatmap/{start_date}/{end_date}/{zoom}: computes the access density of bounding boxes, as a
+        grid of cells
         """
         controllers_base = "ckanext.publicamundi.analytics.controllers."
         haparser_controller = controllers_base + "haparsercontroller:HAParserController"
@@ -51,6 +53,10 @@ class AnalyticsPlugin(p.SingletonPlugin):
                     controller=haparser_controller,
                     action='parse_band_access_count', coverage_name='{coverage_name}', start_date='{start_date}',
                     end_date='{end_date}')
+        map.connect("parse-bbox-access-density", "/api/analytics/heatmap/{start_date}/{end_date}/{zoom}",
+                    controller=haparser_controller,
+                    action='parse_bbox_access_density', start_date='{start_date}', end_date='{end_date}',
+                    zoom='{zoom}')
         map.connect("analytics-api-adjust-workers", "/api/analytics/adjust/workers/{number}",
                     controller=analytics_controller, action='adjust_workers', number='{number}')
         map.connect("analytics-api-adjust-tiling", "/api/analytics/tiling/{coverage_name}/adjust",
@@ -72,6 +78,11 @@ class AnalyticsPlugin(p.SingletonPlugin):
         from ckanext.publicamundi.analytics.controllers import configmanager
         configmanager.setup(config)
 
+        # Setup extension-wide cache manager (if not already setup by publicamundi plugin)
+        from ckanext.publicamundi import cache_manager
+        if not cache_manager.is_configured():
+            cache_manager.setup(config)
+
         return
 
     ## IConfigurer interface ##
@@ -12,7 +12,7 @@ var servicesUrl = "/api/analytics/services/{start}/{end}";
 var coverageAccessCountUrl = "/api/analytics/coverage/{coverage_id}/{start}/{end}";
 var bandAccessCount = "/api/analytics/bands/{coverage_id}/{start}/{end}";
 var coveragesUrl = "/api/analytics/coverages/{start}/{end}";
-var boundingBoxesUrl = "/api/analytics/bbox/{start}/{end}";
+var boundingBoxesUrl = "/api/analytics/bbox/{start}/{end}?limit=30";
 
 var adjustForDate = function (url) {
     return url.replace("{start}", Analytics.widget.PeriodPicker.formatDate(Analytics.widget.PeriodPicker.startDate)).replace("{end}", Analytics.widget.PeriodPicker.formatDate(Analytics.widget.PeriodPicker.endDate))
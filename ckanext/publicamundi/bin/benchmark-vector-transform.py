@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+'''Compare building a coordinate transformation per call against the cached
+one, and transforming points one by one against a single batch.
+
+Example:
+
+    benchmark-vector-transform.py -n 20000
+
+'''
+
+import time
+import argparse
+import tempfile
+
+import ckanext.publicamundi.storers.vector as vectorstorer
+
+argp = argparse.ArgumentParser()
+argp.add_argument("-n", "--num-points", dest='num_points', type=int, default=20000);
+argp.add_argument("-t", "--num-transformations", dest='num_transformations', type=int, default=200);
+argp.add_argument("-g", "--gdal-folder", dest='gdal_folder', default='/usr/lib/python2.7/dist-packages');
+args = argp.parse_args()
+
+vectorstorer.setup(args.gdal_folder, tempfile.gettempdir())
+
+from ckanext.publicamundi.storers.vector.lib import transform
+
+ogr = vectorstorer.ogr
+osr = vectorstorer.osr
+
+def build_transformations(n):
+    '''Build a transformation per call'''
+    for i in range(n):
+        source = osr.SpatialReference()
+        source.ImportFromEPSG(2100)
+        target = osr.SpatialReference()
+        target.ImportFromEPSG(4326)
+        osr.CoordinateTransformation(source, target)
+
+def get_transformations(n):
+    '''Get the cached transformation'''
+    for i in range(n):
+        transform.get_transformation(2100, 4326)
+
+def transform_single(points):
+    for x, y in points:
+        geom = ogr.Geometry(ogr.wkbPoint)
+        geom.AddPoint_2D(x, y)
+        transform.transform_geometry(geom, 4326, 2100)
+
+def transform_batch(points):
+    transform.transform_points(points, 4326, 2100)
+
+def timed(f, *a):
+    t0 = time.time()
+    f(*a)
+    return time.time() - t0
+
+n = args.num_transformations
+print 'Building %d transformations: %.4fs (uncached), %.4fs (cached)' % (
+    n, timed(build_transformations, n), timed(get_transformations, n))
+
+points = [(20.0 + i * 1e-4, 38.0 + i * 1e-4) for i in range(args.num_points)]
+print 'Transforming %d points: %.4fs (one by one), %.4fs (batch)' % (
+    len(points), timed(transform_single, points), timed(transform_batch, points))
@@ -12,6 +12,10 @@ def setup(config):
 
     return
 
+def is_configured():
+    '''Check if the module-global CacheManager is setup'''
+    return _cache_manager is not None
+
 def get_cache(name):
     '''Get a configured instance of Cache. 
     '''
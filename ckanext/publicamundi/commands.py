@@ -8,6 +8,7 @@ import optparse
 import zope.interface
 import zope.schema
 import logging
+import time
 from datetime import datetime, timedelta, date
 from dateutil.parser import parse as parse_date
 from optparse import make_option 
@@ -85,10 +86,55 @@ class Command(CommandDispatcher):
         'export-package-translation': (
             make_option('--output', type=str, dest='outfile', default='package_translations.csv'),
         ),
+        'export-catalog': (
+            make_option('--format', type='choice', dest='export_format', default='iso',
+                choices=['iso', 'dcat'], help='Export ISO 19139 (iso) or GeoDCAT-AP (dcat)'),
+            make_option('--output', type=str, dest='outfile', default='catalog.xml',
+                help='Write to this file (a .tar.gz for a tarball of records, else XML)'),
+            make_option('--since', type=str, dest='since',
+                help='Only export datasets modified after this time (ISO 8601)'),
+            make_option('--cursor', type=str, dest='cursor',
+                help='Resume after this position'),
+            make_option('--cursor-file', type=str, dest='cursor_file',
+                help='Read (if exists) and keep the position of the last exported dataset here'),
+            make_option('--limit', type=int, dest='limit', default=None),
+            make_option('--processes', type=int, dest='processes', default=1,
+                help='Serialize records in this many processes'),
+        ),
+        'rebuild-csw': (
+            make_option('--repair', action='store_true', dest='repair', default=False,
+                help='Only rebuild missing or stale records (and delete orphan ones)'),
+            make_option('-n', '--dry-run', action='store_true', dest='dry_run', default=False,
+                help='Only report what would be repaired (with --repair)'),
+            make_option('--processes', type=int, dest='processes', default=1,
+                help='Build records in this many processes'),
+            make_option('--page-size', type=int, dest='page_size', default=500,
+                help='Fetch this many datasets per query'),
+            make_option('--batch-size', type=int, dest='batch_size', default=200,
+                help='Insert this many records per statement'),
+        ),
+        'memoizer-info': (
+            make_option('--tag', type=str, dest='tag', 
+                help='Only report caches with this tag (e.g. schemata)'),
+            make_option('--clear', action='store_true', dest='clear', default=False,
+                help='Clear caches after reporting'),
+            make_option('--url', type=str, dest='url', 
+                help='Report on a running CKAN site (e.g. http://localhost:5000) instead'),
+            make_option('--api-key', type=str, dest='api_key', 
+                help='A sysadmin API key for --url'),
+        ),
         'analyze-logs': (
             make_option('--create', action='store_true', dest='create_tables', default=False),
             make_option('--from', type=str, dest='from_date'),
             make_option('--to', type=str, dest='to_date'),
+            make_option('--rebuild-rollups', action='store_true', dest='rebuild_rollups', default=False,
+                help='Rebuild the rollup tables (daily and monthly totals) from all analyzed data'),
+            make_option('--tail', action='store_true', dest='tail', default=False,
+                help='Analyze only the lines appended to log files since last read (for today, if not --from)'),
+            make_option('--interval', type=int, dest='interval', default=0,
+                help='When tailing, keep running and read new lines every INTERVAL seconds'),
+            make_option('--batch-size', type=int, dest='batch_size', default=10000,
+                help='When tailing, the (maximum) number of lines analyzed (and committed) at once'),
         ),
     }
     
@@ -493,6 +539,135 @@ class Command(CommandDispatcher):
         session.commit()
         return
 
+    @subcommand('export-catalog', options=options_config['export-catalog'])
+    def export_catalog(self, opts, *args):
+        '''Export the metadata of all public datasets into a single XML document or tarball.
+        
+        An interrupted export can be resumed with --cursor-file (or --cursor), 
+        and --since can be used to only export recently modified datasets. 
+        '''
+        from ckanext.publicamundi.lib import catalog_export
+
+        outfile = opts.outfile
+        if os.path.isfile(outfile):
+            raise ValueError('The output (%s) allready exists' % outfile)
+        
+        since = parse_date(opts.since) if opts.since else None
+        
+        cursor = opts.cursor
+        if not cursor and opts.cursor_file and os.path.isfile(opts.cursor_file):
+            with open(opts.cursor_file, 'r') as ifp:
+                cursor = ifp.read().strip() or None
+        if cursor:
+            self.logger.info('Resuming export after %s', cursor)
+        
+        # Provide a request context for templating to function
+        self._fake_request_context()
+        
+        packages = catalog_export.list_packages(since, cursor, opts.limit)
+        self.logger.info('Exporting %d datasets', len(packages))
+        
+        stats = {'exported': 0, 'failed': 0}
+        t0 = datetime.now()
+        
+        def records():
+            results = catalog_export.export_packages(
+                packages, opts.export_format, opts.processes)
+            for r in results:
+                if 'error' in r:
+                    stats['failed'] += 1
+                    self.logger.warn('Skipped dataset %s: %s', r['id'], r['error'])
+                else:
+                    stats['exported'] += 1
+                    yield r
+                if opts.cursor_file:
+                    with open(opts.cursor_file, 'w') as ofp:
+                        ofp.write(r['cursor'])
+                n = stats['exported'] + stats['failed']
+                if n % 1000 == 0:
+                    self.logger.info('Processed %d of %d datasets', n, len(packages))
+        
+        if outfile.endswith('.tar.gz') or outfile.endswith('.tgz'):
+            chunks = catalog_export.iter_tarball(records())
+        else:
+            chunks = catalog_export.iter_document(records(), opts.export_format)
+        with open(outfile, 'w') as ofp:
+            for data in chunks:
+                ofp.write(data)
+        
+        dt = (datetime.now() - t0).total_seconds()
+        self.logger.info(
+            'Exported %d datasets (%d failed) to %s in %.1fs (%.1f datasets/s)',
+            stats['exported'], stats['failed'], outfile, dt, 
+            (stats['exported'] / dt) if dt > 0 else 0.0)
+        return
+
+    @subcommand('rebuild-csw', options=options_config['rebuild-csw'])
+    def rebuild_csw(self, opts, *args):
+        '''Rebuild all CSW records (into a staging table, swapped in when complete).
+
+        With --repair, only rebuild records that are missing or older than their 
+        dataset, and delete orphan records.
+        '''
+        from ckanext.publicamundi.lib import pycsw_rebuild
+        
+        # Provide a request context for templating to function
+        self._fake_request_context()
+        
+        progress = pycsw_rebuild.Progress(logger=self.logger)
+        if opts.repair:
+            pycsw_rebuild.repair(
+                opts.processes, opts.batch_size, opts.dry_run, progress=progress)
+        else:
+            progress.total = pycsw_rebuild.count_packages()
+            self.logger.info('Rebuilding CSW records for %d datasets', progress.total)
+            pycsw_rebuild.rebuild(
+                opts.processes, opts.page_size, opts.batch_size, progress=progress)
+        
+        self.logger.info(
+            'Loaded %d CSW records (%d failed) in %.1fs (%.1f records/s)',
+            progress.loaded, progress.failed, progress.elapsed, progress.rate)
+        return
+
+    @subcommand('memoizer-info', options=options_config['memoizer-info'])
+    def print_memoizer_info(self, opts, *args):
+        '''Print statistics for memoized functions (and optionally clear them).
+        
+        Note that, unless --url is given, the statistics are of this command's
+        own process (e.g. after loading schemata), not of a running web server.
+        '''
+        
+        from ckanext.publicamundi.lib import memoizer
+        
+        if opts.url:
+            import requests
+            
+            def call_action(name, data_dict):
+                url = opts.url.rstrip('/') + '/api/3/action/' + name
+                headers = {'Authorization': opts.api_key} if opts.api_key else {}
+                res = requests.post(url, json=data_dict, headers=headers)
+                res.raise_for_status()
+                return res.json()['result']
+            
+            result = call_action('memoizer_info', {'tag': opts.tag})
+            if opts.clear:
+                call_action('memoizer_clear', {'tag': opts.tag})
+        else:
+            result = memoizer.info(tag=opts.tag)
+            if opts.clear:
+                memoizer.clear(tag=opts.tag)
+        
+        fmt = '%-70s %7s %7s %9s %9s %9s'
+        print fmt % ('name', 'size', 'max', 'hits', 'misses', 'evictions')
+        for r in result:
+            print fmt % (
+                r['name'], r['size'], r['max_size'] or '-', 
+                r['hits'], r['misses'], r['evictions'])
+        if opts.clear:
+            print
+            print 'Cleared %d caches' % (len(result))
+        return
+
     @subcommand('analyze-logs', options=options_config['analyze-logs'])
     def analyze_logs(self, opts, *args):
         '''Analyze access logs from HAProxy backends
@@ -500,14 +675,14 @@ class Command(CommandDispatcher):
        
         from sqlalchemy.orm.exc import NoResultFound
         from ckanext.publicamundi.analytics.controllers import configmanager
-        from ckanext.publicamundi.analytics.controllers.dbservice import (DbReader, DbManager)
+        from ckanext.publicamundi.analytics.controllers.dbservice import (DbReader, DbManager, DbWriter)
+        from ckanext.publicamundi.analytics.controllers.dbservice import rollups
         from ckanext.publicamundi.analytics.controllers.util.system import SystemInfo
-        from ckanext.publicamundi.analytics.controllers.log_trimmer import LogTrimmer
-        from ckanext.publicamundi.analytics.controllers.parsers.habboxaccessparser import HABboxAccessParser
-        from ckanext.publicamundi.analytics.controllers.parsers.hacoveragebandparser import HACoverageBandParser
-        from ckanext.publicamundi.analytics.controllers.parsers.hausedcoveragesparser import HAUsedCoveragesParser
-        from ckanext.publicamundi.analytics.controllers.parsers.haparser import HAParser
-        from ckanext.publicamundi.analytics.controllers.parsers.haservicesaccessparser import HAServicesAccessParser
+        from ckanext.publicamundi.analytics.controllers.log_ingestor import (
+            LogIngestor, LogFileIndex)
+        from ckanext.publicamundi.analytics.controllers.log_tailer import (
+            LogTailer, LogPositions)
+        from ckanext.publicamundi.analytics.controllers.parsers.hafusedparser import HAFusedParser
 
         session = configmanager.session
 
@@ -530,23 +705,64 @@ class Command(CommandDispatcher):
                 info = SystemInfo(SystemInfo.LATEST_DATE_KEY, str(latest_date))
                 session.add(info)
             return
+
+        def update_latest_update_time():
+            # Mark analyzed data as updated (cached API responses are stale from now on)
+            value = datetime.now().isoformat()
+            info = session.query(SystemInfo).get(SystemInfo.LATEST_UPDATE_KEY)
+            if info is None:
+                session.add(SystemInfo(SystemInfo.LATEST_UPDATE_KEY, value))
+            else:
+                info.value = value
+            return
         
         def parse_all(log_lines):
-            for parser in [
-                    HAUsedCoveragesParser, HAServicesAccessParser, 
-                    HACoverageBandParser, HABboxAccessParser]:
-                persist_info_list(parser(log_lines).parse())
+            # Extract all metrics in a single pass over log lines
+            persist_info_list(HAFusedParser(log_lines).parse())
 
         def persist_info_list(info_list):
             for info in info_list:
                 session.add(info)
 
+        def tail_all(tailer):
+            # Accumulate the new lines of every batch into the information of their date
+            latest_date = get_latest_parse_date().date()
+            for batch in tailer.iter_batches():
+                for day in sorted(batch.keys()):
+                    self.logger.info("Parsing %d new records for %s", len(batch[day]), day)
+                    DbWriter.accumulate_info_list(HAFusedParser(batch[day]).parse(), session)
+                    rollups.refresh_all(session, day)
+                    if day > latest_date:
+                        latest_date = day
+                        update_latest_parse_date(day)
+                update_latest_update_time()
+                session.commit()
+
         # (Re)create database
         
         if opts.create_tables:
             DbManager.drop_all_tables()
         DbManager.create_schema()
         
+        if opts.rebuild_rollups:
+            rollups.rebuild_all(session)
+            update_latest_update_time()
+            session.commit()
+            self.logger.info("Rebuilt rollup tables")
+        
+        # Tail logs: analyze new lines (in batches), and repeat every interval (if given)
+
+        if opts.tail:
+            start_date = parse_date(opts.from_date).date() if opts.from_date else None
+            tailer = LogTailer(configmanager.logfile_pattern, LogPositions(session),
+                start_date=start_date, batch_size=opts.batch_size)
+            while True:
+                tail_all(tailer)
+                if not opts.interval:
+                    break
+                time.sleep(opts.interval)
+            return
+        
         # Parse requested range
         
         start_date, end_date = None, None
@@ -563,16 +779,18 @@ class Command(CommandDispatcher):
         current_date = start_date.date()
         finish_date = end_date.date()
         
-        # Analyze and store logs
+        # Analyze and store logs: read log files once (skipping those already read
+        # and known to be out of range), then parse the lines of each day
 
-        while current_date < finish_date:
-            self.logger.info("Parsing from {0}".format(current_date))
-            trimmer = LogTrimmer(configmanager.logfile_pattern, current_date)
-            log_lines = trimmer.trim()
-            update_latest_parse_date(current_date)
+        ingestor = LogIngestor(configmanager.logfile_pattern,
+            current_date, finish_date, file_index=LogFileIndex(session))
+        for day, log_lines in ingestor.iter_days():
+            self.logger.info("Parsing from {0}".format(day))
+            update_latest_parse_date(day)
             parse_all(log_lines)
-            current_date = current_date + timedelta(days=1)
+            rollups.refresh_all(session, day)
 
+        update_latest_update_time()
         session.commit()
         return
 
@@ -39,4 +39,6 @@ class Invalid(toolkit.ValidationError):
 from . import package
 from . import autocomplete
 from . import group
+from . import cache
+from . import csw
 
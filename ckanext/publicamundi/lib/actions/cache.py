@@ -0,0 +1,55 @@
+import logging
+
+import ckan.logic as logic
+import ckan.plugins.toolkit as toolkit
+
+from ckanext.publicamundi.lib import memoizer
+
+log = logging.getLogger(__name__)
+
+_ = toolkit._
+_check_access = toolkit.check_access
+
+@logic.side_effect_free
+def memoizer_info(context, data_dict):
+    '''Return statistics (size, hits, misses, evictions) for the memoized
+    functions of the serving process. Only for sysadmins.
+
+    :param tag: only report caches with this tag (e.g. `schemata`), optional
+    :type tag: string
+
+    :rtype: list of dicts
+    '''
+
+    _check_access('memoizer_info', context, data_dict)
+
+    return memoizer.info(tag=data_dict.get('tag'))
+
+def memoizer_clear(context, data_dict):
+    '''Clear the caches of memoized functions of the serving process. Only
+    for sysadmins.
+
+    :param names: the names of caches to clear (optional, default: all)
+    :type names: list of strings
+    :param tag: only clear caches with this tag (e.g. `schemata`), optional
+    :type tag: string
+
+    :returns: the names of cleared caches
+    :rtype: list of strings
+    '''
+
+    _check_access('memoizer_clear', context, data_dict)
+
+    names = data_dict.get('names')
+    if isinstance(names, basestring):
+        names = [names]
+    cleared = memoizer.clear(names=names, tag=data_dict.get('tag'))
+    log.info('Cleared memoizer caches: %s', ', '.join(cleared))
+    return cleared
+
+def memoizer_info_check_authorized(context, data_dict):
+    # Only sysadmins (who bypass authorization checks) are allowed
+    return {'success': False, 'msg': _('Only sysadmins can inspect caches')}
+
+def memoizer_clear_check_authorized(context, data_dict):
+    return {'success': False, 'msg': _('Only sysadmins can clear caches')}
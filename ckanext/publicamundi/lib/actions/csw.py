@@ -0,0 +1,31 @@
+import logging
+
+import ckan.logic as logic
+import ckan.plugins.toolkit as toolkit
+
+from ckanext.publicamundi.lib import pycsw_queue
+
+log = logging.getLogger(__name__)
+
+_ = toolkit._
+_check_access = toolkit.check_access
+
+@logic.side_effect_free
+def pycsw_sync_status(context, data_dict):
+    '''Return the status of the queue of datasets to be synchronized with CSW
+    records, for the serving process. Only for sysadmins.
+
+    The result reports the depth of the queue, its lag (i.e. the age of the oldest
+    queued change, in seconds) and counters of applied, coalesced, retried and 
+    failed changes.
+
+    :rtype: dict
+    '''
+
+    _check_access('pycsw_sync_status', context, data_dict)
+
+    return pycsw_queue.get_stats()
+
+def pycsw_sync_status_check_authorized(context, data_dict):
+    # Only sysadmins (who bypass authorization checks) are allowed
+    return {'success': False, 'msg': _('Only sysadmins can inspect the CSW sync queue')}
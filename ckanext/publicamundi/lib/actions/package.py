@@ -102,6 +102,73 @@ def dataset_export_dcat(context, data_dict):
 
     return result
 
+@logic.side_effect_free
+def dataset_export_catalog(context, data_dict):
+    '''Export the metadata of all public datasets, one page at a time.
+
+    Datasets are exported in the order they were last modified, so that a 
+    client can page through the whole catalog by passing back the returned 
+    cursor, and later only fetch datasets modified since its last visit.
+
+    :param format: the export format, `iso` (ISO 19139, default) or `dcat` (GeoDCAT-AP)
+    :type format: string
+    :param since: only export datasets modified after this time (ISO 8601), optional
+    :type since: string
+    :param cursor: resume from this position (as returned by a previous call), optional
+    :type cursor: string
+    :param limit: the maximum number of datasets to return (default 100, at most 1000)
+    :type limit: int
+
+    rtype: dict
+    '''
+    from ckanext.publicamundi.lib import catalog_export
+    from dateutil.parser import parse as parse_date
+    
+    _check_access('package_list', context, data_dict)
+
+    export_format = data_dict.get('format') or 'iso'
+    if not export_format in catalog_export.EXPORT_FORMATS:
+        raise Invalid({'format': _('Expected one of: %s') % (
+            ', '.join(catalog_export.EXPORT_FORMATS))})
+
+    since = data_dict.get('since')
+    if since:
+        try:
+            since = parse_date(since)
+        except ValueError:
+            raise Invalid({'since': _('Expected an ISO 8601 timestamp')})
+
+    cursor = data_dict.get('cursor')
+    if cursor:
+        try:
+            catalog_export.parse_cursor(cursor)
+        except ValueError:
+            raise Invalid({'cursor': _('Malformed cursor')})
+
+    try:
+        limit = int(data_dict.get('limit') or 100)
+    except ValueError:
+        raise Invalid({'limit': _('Expected an integer')})
+    limit = max(1, min(limit, 1000))
+    
+    packages = catalog_export.list_packages(since, cursor, limit)
+    results, errors = [], []
+    for r in catalog_export.export_packages(packages, export_format):
+        cursor = r['cursor']
+        if 'error' in r:
+            errors.append(r)
+        else:
+            results.append(r)
+    
+    return {
+        'format': export_format,
+        'count': len(results),
+        'results': results,
+        'errors': errors,
+        'cursor': cursor,
+        'has_more': len(packages) == limit,
+    }
+
 def dataset_import(context, data_dict):
     '''Import a dataset from a given XML source.
 
@@ -531,15 +598,5 @@ def _find_a_package_name(context, basename, max_num_probes=12):
     return name if found else None
 
 def _transform_dcat(xml_dom):
-    from lxml import etree
-
-    xsl_file = reference_data.get_path('xsl/iso-19139-to-dcat-ap.xsl')
-    result = None
-    with open(xsl_file, 'r') as fp:
-        # Transform using XSLT
-        dcat_xslt = etree.parse(fp)
-        dcat_transform = etree.XSLT(dcat_xslt)
-        result = dcat_transform(xml_dom)
-        result = unicode(result).encode('utf-8')
-
-    return result
+    from ckanext.publicamundi.lib import dcat
+    return dcat.transform(xml_dom)
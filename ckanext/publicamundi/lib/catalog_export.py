@@ -0,0 +1,224 @@
+'''Export the metadata of the whole catalog (ISO 19139 or GeoDCAT-AP).
+
+Datasets are visited in (metadata_modified, id) order, so that an export
+can be resumed from a cursor (the position of the last exported dataset)
+and can be limited to datasets modified (i.e. with a new revision) since
+a given time.
+
+Records are serialized either in this process or, for bulk exports, in a
+pool of worker processes. Exported XML is kept in the `metadata` cache,
+under the same keys as dataset_export and dataset_export_dcat use.
+'''
+
+import logging
+import tarfile
+import datetime
+import multiprocessing
+from cStringIO import StringIO
+from xml.sax.saxutils import quoteattr
+
+import pylons
+from sqlalchemy import and_, or_
+from dateutil.parser import parse as parse_date
+
+import ckan.model as model
+import ckan.plugins.toolkit as toolkit
+
+from ckanext.publicamundi.cache_manager import get_cache
+from ckanext.publicamundi.lib.metadata import xml_serializer_for
+
+log = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ('iso', 'dcat')
+
+# Number of datasets handed to a worker process at a time
+CHUNK_SIZE = 4
+
+_get_action = toolkit.get_action
+
+## Cursors ##
+
+def make_cursor(metadata_modified, package_id):
+    return '%s,%s' % (metadata_modified.isoformat(), package_id)
+
+def parse_cursor(cursor):
+    '''Parse a cursor into a (metadata_modified, package id) pair'''
+    try:
+        modified, package_id = cursor.split(',', 1)
+        return parse_date(modified), package_id
+    except (ValueError, AttributeError):
+        raise ValueError('Malformed cursor: %r' % (cursor))
+
+## Listing ##
+
+def list_packages(since=None, cursor=None, limit=None):
+    '''List the (id, metadata_modified) pairs of the active public datasets
+    that follow cursor (if given) and were modified after since (a datetime,
+    if given).
+    '''
+    Package = model.Package
+    q = model.Session.query(Package.id, Package.metadata_modified).filter(
+        Package.state == 'active', Package.private == False)
+    if since:
+        q = q.filter(Package.metadata_modified > since)
+    if cursor:
+        modified, package_id = parse_cursor(cursor)
+        q = q.filter(or_(
+            Package.metadata_modified > modified,
+            and_(Package.metadata_modified == modified, Package.id > package_id)))
+    q = q.order_by(Package.metadata_modified, Package.id)
+    if limit:
+        q = q.limit(limit)
+    return q.all()
+
+## Serialization ##
+
+def export_package(package_id, export_format='iso'):
+    '''Export a dataset as an XML record.
+
+    Returns a dict with the id, name, revision_id, metadata_modified and the
+    (serialized) xml of the record, or None if the dataset has no metadata.
+    '''
+    context = {
+        'model': model,
+        'session': model.Session,
+        'ignore_auth': True,
+        'api_version': '3',
+    }
+    pkg = _get_action('package_show')(context, {'id': package_id})
+
+    dtype = pkg.get('dataset_type')
+    obj = pkg.get(dtype) if dtype else None
+    if not obj:
+        return None
+
+    xser = xml_serializer_for(obj)
+    xser.target_namespace = pylons.config.get('ckan.site_url')
+
+    cached_metadata = get_cache('metadata')
+    if export_format == 'dcat':
+        from ckanext.publicamundi.lib import dcat
+        name = '%(name)s@%(revision_id)s.dcat' % (pkg)
+        xml = cached_metadata.get(
+            name, createfunc=lambda: dcat.transform(xser.to_xml()))
+    else:
+        name = '%(name)s@%(revision_id)s' % (pkg)
+        xml = cached_metadata.get(name, createfunc=xser.dumps)
+
+    return {
+        'id': pkg['id'],
+        'name': pkg['name'],
+        'revision_id': pkg['revision_id'],
+        'metadata_modified': pkg['metadata_modified'],
+        'xml': xml,
+    }
+
+def export_packages(packages, export_format='iso', processes=1):
+    '''Export a list of (id, metadata_modified) datasets, as returned by
+    list_packages(), in the same order.
+
+    If processes > 1, records are serialized in a pool of processes. Yields
+    the exported records (along with their cursor), or dicts with the id,
+    cursor and error of datasets that failed to be exported.
+    '''
+    tasks = [(package_id, make_cursor(modified, package_id), export_format)
+        for package_id, modified in packages]
+
+    if processes <= 1:
+        for task in tasks:
+            yield _export_task(task)
+        return
+
+    # Do not let workers inherit (and share) open database connections
+    model.Session.remove()
+    model.meta.engine.dispose()
+
+    pool = multiprocessing.Pool(processes, initializer=_init_worker)
+    try:
+        for result in pool.imap(_export_worker, tasks, CHUNK_SIZE):
+            yield result
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+## Output ##
+
+def iter_document(records, export_format='iso'):
+    '''Wrap records into a single XML document, yielding it in chunks.'''
+    yield '<?xml version="1.0" encoding="utf-8"?>\n'
+    yield '<datasets format=%s exported=%s>\n' % (
+        quoteattr(export_format),
+        quoteattr(datetime.datetime.utcnow().isoformat()))
+    for r in records:
+        yield '<dataset id=%s name=%s revision-id=%s metadata-modified=%s>\n' % (
+            quoteattr(r['id']), quoteattr(r['name']), quoteattr(r['revision_id']),
+            quoteattr(r['metadata_modified']))
+        yield _strip_xml_declaration(r['xml'])
+        yield '\n</dataset>\n'
+    yield '</datasets>\n'
+
+def iter_tarball(records):
+    '''Pack records (as <name>.xml members) in a gzipped tarball, yielding
+    it in chunks.'''
+    buf = _ChunkBuffer()
+    archive = tarfile.open(mode='w|gz', fileobj=buf)
+    for r in records:
+        info = tarfile.TarInfo('%s.xml' % (r['name']))
+        info.size = len(r['xml'])
+        info.mtime = _to_timestamp(parse_date(r['metadata_modified']))
+        archive.addfile(info, StringIO(r['xml']))
+        data = buf.pop()
+        if data:
+            yield data
+    archive.close()
+    yield buf.pop()
+
+#
+# Helpers
+#
+
+def _export_task(task):
+    package_id, cursor, export_format = task
+    try:
+        result = export_package(package_id, export_format)
+    except Exception as ex:
+        log.exception('Failed to export dataset %s' % (package_id))
+        return {'id': package_id, 'cursor': cursor, 'error': str(ex)}
+    if result is None:
+        return {'id': package_id, 'cursor': cursor, 'error': 'No metadata to export'}
+    result['cursor'] = cursor
+    return result
+
+def _export_worker(task):
+    try:
+        return _export_task(task)
+    finally:
+        model.Session.remove()
+
+def _init_worker():
+    model.meta.engine.dispose()
+
+def _strip_xml_declaration(xml):
+    if xml.startswith('<?xml'):
+        xml = xml[xml.index('?>') + 2:].lstrip()
+    return xml
+
+def _to_timestamp(dt):
+    return int((dt - datetime.datetime(1970, 1, 1)).total_seconds())
+
+class _ChunkBuffer(object):
+    '''A write-only file object, whose contents are collected with pop()'''
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(data)
+
+    def pop(self):
+        data = ''.join(self._chunks)
+        self._chunks = []
+        return data
@@ -0,0 +1,45 @@
+'''Transform ISO 19139 metadata to GeoDCAT-AP (RDF/XML).
+
+The XSLT stylesheet is compiled once per thread (compiled stylesheets are
+not shared among threads) and is re-compiled only if the file changes.
+
+Bulk (whole-catalog) exports are transformed in a pool of worker processes
+by catalog_export, each worker keeping its own compiled stylesheet.
+'''
+
+import os
+import threading
+from lxml import etree
+
+from ckanext.publicamundi import reference_data
+
+XSL_FILE = 'xsl/iso-19139-to-dcat-ap.xsl'
+
+
+class _TransformCache(threading.local):
+
+    def __init__(self):
+        self.transforms = {}
+
+    def get(self, path):
+        mtime = os.path.getmtime(path)
+        entry = self.transforms.get(path)
+        if entry is None or entry[0] != mtime:
+            with open(path, 'r') as fp:
+                transform = etree.XSLT(etree.parse(fp))
+            entry = self.transforms[path] = (mtime, transform)
+        return entry[1]
+
+_cache = _TransformCache()
+
+def get_transform():
+    '''Returns the (compiled) etree.XSLT for ISO 19139 to GeoDCAT-AP'''
+    return _cache.get(reference_data.get_path(XSL_FILE))
+
+def transform(xml_dom):
+    '''Transform an ISO 19139 document (an lxml tree or element).
+
+    Returns the resulting RDF/XML as a UTF-8 encoded string.
+    '''
+    result = get_transform()(xml_dom)
+    return unicode(result).encode('utf-8')
@@ -1,20 +1,222 @@
+'''Memoize (pure) functions into bounded, thread-safe and instrumented caches.
+
+Every memoized function gets a cache of its own, registered under the
+function's dotted name. A cache may be bounded in size (least recently
+used entries are evicted) and/or in time (entries expire after ttl
+seconds), and keeps counters of hits, misses and evictions.
+
+Caches may also be tagged (e.g. as `schemata`), so that a group of them
+can be cleared at once.
+
+    @memoize(max_size=128, tags=['schemata'])
+    def get_something(x, y=None):
+        pass
+
+    get_something.cache.info()
+    clear(tag='schemata')
+'''
+
+import time
+import threading
 from functools import wraps
+from collections import OrderedDict
+
+# Default maximum number of entries kept per memoized function
+DEFAULT_MAX_SIZE = 1024
+
+_caches = OrderedDict()
+
+_caches_lock = threading.Lock()
+
+
+class Cache(object):
+    '''A thread-safe LRU cache with optional expiration of entries.
+
+    Concurrent requests for the same missing key are collapsed: the value
+    is computed by the first caller, while the others wait for it.
+    '''
+
+    def __init__(self, name, max_size=DEFAULT_MAX_SIZE, ttl=None, tags=()):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self.tags = frozenset(tags)
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._pending = {}
+        self._reset_counters()
+
+    def get(self, key, compute):
+        '''Get the value for key, calling compute() to create it if missing'''
+        while True:
+            with self._lock:
+                entry = self._entries.pop(key, None)
+                if entry is not None:
+                    value, expires = entry
+                    if expires is None or expires > time.time():
+                        # Re-insert, so that the key is marked as most recently used
+                        self._entries[key] = entry
+                        self.hits += 1
+                        return value
+                    self.expirations += 1
+                pending = self._pending.get(key)
+                if pending is None or pending.owner == _current_thread():
+                    # Compute it here (this is also the case of a recursive call
+                    # for a key being computed by this thread)
+                    pending = self._pending[key] = _Pending()
+                    self.misses += 1
+                    break
+            # Wait for another thread to compute it, then retry
+            pending.event.wait()
+
+        try:
+            value = compute()
+        except:
+            with self._lock:
+                self._pending.pop(key, None)
+            pending.event.set()
+            raise
+
+        with self._lock:
+            expires = (time.time() + self.ttl) if self.ttl else None
+            self._entries[key] = (value, expires)
+            while self.max_size and len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self._pending.pop(key, None)
+        pending.event.set()
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._reset_counters()
+
+    def info(self):
+        with self._lock:
+            return {
+                'name': self.name,
+                'tags': sorted(self.tags),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+    def _reset_counters(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+
+def memoize(fn=None, max_size=DEFAULT_MAX_SIZE, ttl=None, tags=()):
+    '''Memoize a function, either as `@memoize` or as `@memoize(max_size=..)`.
+
+    Calls are keyed on both positional and keyword arguments. Unhashable
+    arguments (lists, dicts, sets) are keyed on their contents. Calls with
+    other unhashable arguments are not cached at all (the function is called
+    directly), as such arguments have no key that identifies them by value.
+    '''
+    def decorate(fn):
+        name = '%s.%s' % (fn.__module__, fn.__name__)
+        cache = _register(Cache(name, max_size, ttl, tags))
+        @wraps(fn)
+        def wrapped(*args, **kwargs):
+            key = make_key(args, kwargs)
+            if key is None:
+                return fn(*args, **kwargs)
+            return cache.get(key, lambda: fn(*args, **kwargs))
+        wrapped.cache = cache
+        return wrapped
+
+    if fn is not None:
+        return decorate(fn)
+    return decorate
+
+def make_key(args, kwargs=None):
+    '''Make a (hashable) cache key out of call arguments, or return None if
+    the arguments cannot be keyed by value.
+    '''
+    key = (args, tuple(sorted(kwargs.items()))) if kwargs else args
+    try:
+        hash(key)
+    except TypeError:
+        try:
+            key = _freeze(key)
+        except _Unkeyable:
+            key = None
+    return key
+
+def get_caches(tag=None):
+    '''List registered caches (only those tagged as tag, if given)'''
+    with _caches_lock:
+        caches = _caches.values()
+    if tag:
+        caches = [c for c in caches if tag in c.tags]
+    return caches
+
+def get_cache(name):
+    with _caches_lock:
+        return _caches[name]
+
+def info(tag=None):
+    '''Return info (size, counters) for registered caches'''
+    return [c.info() for c in get_caches(tag)]
+
+def clear(names=None, tag=None):
+    '''Clear the caches named in names (or all of them, if not given) and
+    tagged as tag (if given). Returns the names of cleared caches.
+    '''
+    cleared = []
+    for c in get_caches(tag):
+        if names is None or c.name in names:
+            c.clear()
+            cleared.append(c.name)
+    return cleared
+
+#
+# Helpers
+#
+
+_current_thread = threading.current_thread
+
+class _Unkeyable(Exception):
+    pass
+
+class _Pending(object):
+
+    __slots__ = ('owner', 'event')
+
+    def __init__(self):
+        self.owner = _current_thread()
+        self.event = threading.Event()
 
-# Note Not sure if _cache is thread-safe. 
-# At least for CPython, it is supposed to be safe as of GIL, see:
-# https://docs.python.org/2/glossary.html#term-global-interpreter-lock
-# If not, it should be replaced by a threading.local instance.
-_cache = dict()
-
-def memoize(fn):
-    cached_results = _cache[fn] = dict()
-    @wraps(fn)
-    def wrapped(*args):
-        cid = args
-        if cid in cached_results:
-            res = cached_results[cid]
-        else:
-            res = cached_results[cid] = fn(*args)
-        return res
-    return wrapped
+def _register(cache):
+    with _caches_lock:
+        # Keep names unique (e.g. for same-named methods of several classes)
+        name, n = cache.name, 1
+        while cache.name in _caches:
+            n += 1
+            cache.name = '%s-%d' % (name, n)
+        _caches[cache.name] = cache
+    return cache
 
+def _freeze(value):
+    if isinstance(value, (list, tuple)):
+        return (type(value).__name__,) + tuple(_freeze(v) for v in value)
+    if isinstance(value, dict):
+        return ('dict',) + tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (set, frozenset)):
+        return ('set', frozenset(_freeze(v) for v in value))
+    try:
+        hash(value)
+    except TypeError:
+        # Neither hashable nor a known container. Note: keying on identity is
+        # not safe, as the id of a collected object may be reused by another
+        raise _Unkeyable(type(value).__name__)
+    return value
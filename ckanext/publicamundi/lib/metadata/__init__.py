@@ -52,7 +52,7 @@ from .types import (
     factory_for_metadata,
     class_for_metadata)
 
-from .i18n import translator_for
+from .i18n import (translator_for, translations_for_packages)
 
 # Provide aliases for common functions
 
@@ -97,7 +97,7 @@ class Object(object):
     ## interface IObject ##
 
     @classmethod
-    @memoize
+    @memoize(tags=['schemata'])
     def get_schema(cls):
         '''Get (i.e. introspect) the underlying zope schema for this class.
         '''
@@ -428,7 +428,7 @@ class Object(object):
         return cls._get_field_factory(key, field)
 
     @classmethod
-    @memoize
+    @memoize(max_size=4096, tags=['schemata'])
     def _get_field_factory(cls, key, field):
         '''Find a factory for a field. 
         
@@ -821,6 +821,10 @@ class Object(object):
         __slots__ = ('obj', 'opts', 'max_depth')
         
         max_depth = 16
+        
+        # Use plans compiled per class (see _DictizePlan), instead of walking 
+        # the schema on every call
+        compiled = True
 
         def __init__(self, obj, opts={}):
             '''Create a dictizer for an object.
@@ -836,6 +840,12 @@ class Object(object):
             max_depth = self.opts.get('max-depth', self.max_depth) 
             assert max_depth > 0
             
+            if self.compiled:
+                plans = _get_dictize_plans(
+                    self.opts.get('serialize-values', False), 
+                    self.opts.get('format-values', False))
+                return plans.get(type(obj)).dictize(obj, max_depth)
+
             res = {}
             for k, field in obj.iter_fields(exclude_properties=False):
                 f = field.get(obj)
@@ -936,6 +946,14 @@ class Object(object):
 
             max_depth = self.opts.get('max-depth', self.max_depth) 
             assert max_depth > 0
+            
+            if self.compiled:
+                plans = _get_dictize_plans(
+                    self.opts.get('serialize-values', False), 
+                    self.opts.get('format-values', False))
+                res = {}
+                plans.get(type(obj)).flatten(res, (), obj, max_depth)
+                return res
 
             res = {}
             for k, field in obj.iter_fields(exclude_properties=True):
@@ -985,6 +1003,9 @@ class Object(object):
     class Loader(object):
         
         __slots__ = ('obj', 'opts', 'recurse_opts')
+        
+        # Use plans compiled per class (see _LoadPlan) to reload objects
+        compiled = True
 
         def __init__(self, obj, opts={}):
             '''Create a loader for an object.
@@ -1008,6 +1029,12 @@ class Object(object):
                 res = self._update(data)
             elif update == 'deep':
                 res = self._update_r(data)
+            elif self.compiled:
+                plans = _get_load_plans(
+                    self.opts.get('unserialize-values', False),
+                    self.opts.get('use-defaults', True))
+                plans.get(type(self.obj)).reload(self.obj, data)
+                res = self
             else:
                 res = self._reload(data)
             
@@ -1255,12 +1282,12 @@ def object_null_adapter(name=''):
         return cls
     return decorate
 
-@memoize
+@memoize(tags=['schemata'])
 def _get_factory_for_object(schema, name):
     factory = Object.Factory(schema, name)
     return factory.default_factory
 
-@memoize
+@memoize(tags=['schemata'])
 def _get_class_for_object(schema, name):
     factory = Object.Factory(schema, name)
     return factory.default_class
@@ -1271,6 +1298,279 @@ def factory_for_object(schema, name=''):
 def class_for_object(schema, name=''):
     return _get_class_for_object(schema, name)
 
+#
+# Compiled plans
+#
+
+# A plan is compiled once per Object class (and per set of options), by walking 
+# its schema: for every field, it holds a specialized function to dictize, flatten 
+# or load a value of it (along with any serializer/formatter needed for leaves). 
+# The plans for the same options are kept together, in a collection keyed on class. 
+
+class _Plans(object):
+    
+    plan_cls = None
+
+    def __init__(self, *args):
+        self.args = args
+        self.plans = {}
+
+    def get(self, cls):
+        plan = self.plans.get(cls)
+        if plan is None:
+            # Note A race here may only compile a plan twice
+            plan = self.plans[cls] = self.plan_cls(cls, self, *self.args)
+        return plan
+
+class _DictizePlan(object):
+    '''A plan to dictize/flatten instances of an Object class.
+    
+    This must behave exactly as Object.Dictizer does (with compiled unset).
+    '''
+
+    def __init__(self, cls, plans, serializer_name, format_spec):
+        self.plans = plans
+        self.serializer_name = serializer_name
+        self.format_spec = format_spec
+        
+        self.dictize_fields = []
+        self.flatten_fields = []
+        for k, field in cls.iter_fields(exclude_properties=False):
+            self.dictize_fields.append(
+                (k, field.get, self._compile_dictize(field)))
+        for k, field in cls.iter_fields(exclude_properties=True):
+            self.flatten_fields.append(
+                (k, field.get, self._compile_flatten(field)))
+
+    def dictize(self, obj, max_depth):
+        depth = max_depth - 1
+        return { k: fn(getter(obj), depth)
+            for k, getter, fn in self.dictize_fields }
+
+    def flatten(self, res, prefix, obj, max_depth):
+        depth = max_depth - 1
+        for k, getter, fn in self.flatten_fields:
+            fn(res, prefix + (k,), getter(obj), depth)
+    
+    def _compile_dictize(self, field):
+        leaf = self._compile_leaf(field)
+        
+        if not self._is_accessible(field):
+            return lambda f, depth: None if f is None else leaf(f)
+        
+        get_plan = self.plans.get
+        
+        if isinstance(field, zope.schema.Object):
+            def dictize_field(f, depth):
+                if f is None:
+                    return None
+                if depth == 0:
+                    return leaf(f)
+                if isinstance(f, Object):
+                    return get_plan(type(f)).dictize(f, depth)
+                return None # unknown structure
+        elif isinstance(field, (zope.schema.List, zope.schema.Tuple)):
+            dictize_item = self._compile_dictize(field.value_type)
+            def dictize_field(f, depth):
+                if f is None:
+                    return None
+                if depth == 0:
+                    return leaf(f)
+                return [dictize_item(y, depth - 1) for y in f]
+        elif isinstance(field, zope.schema.Dict):
+            dictize_item = self._compile_dictize(field.value_type)
+            def dictize_field(f, depth):
+                if f is None:
+                    return None
+                if depth == 0:
+                    return leaf(f)
+                return {k: dictize_item(y, depth - 1) for k, y in f.items()}
+        else:
+            dictize_field = lambda f, depth: None if f is None else leaf(f)
+        
+        return dictize_field
+    
+    def _compile_flatten(self, field):
+        leaf = self._compile_leaf(field)
+        
+        if not self._is_accessible(field):
+            def flatten_field(res, k, f, depth):
+                res[k] = None if f is None else leaf(f)
+            return flatten_field
+        
+        get_plan = self.plans.get
+        
+        if isinstance(field, zope.schema.Object):
+            def flatten_field(res, k, f, depth):
+                if f is None:
+                    res[k] = None
+                elif depth == 0:
+                    res[k] = leaf(f)
+                elif isinstance(f, Object):
+                    get_plan(type(f)).flatten(res, k, f, depth)
+                else:
+                    res[k] = None # unknown structure
+        elif isinstance(field, (zope.schema.List, zope.schema.Tuple, zope.schema.Dict)):
+            flatten_item = self._compile_flatten(field.value_type)
+            is_dict = isinstance(field, zope.schema.Dict)
+            def flatten_field(res, k, f, depth):
+                if f is None:
+                    res[k] = None
+                elif depth == 0:
+                    res[k] = leaf(f)
+                else:
+                    items = f.iteritems() if is_dict else enumerate(f)
+                    for i, y in items:
+                        flatten_item(res, k + (i,), y, depth - 1)
+        else:
+            def flatten_field(res, k, f, depth):
+                res[k] = None if f is None else leaf(f)
+        
+        return flatten_field
+
+    def _is_accessible(self, field):
+        format_spec = self.format_spec
+        if format_spec:
+            fo_conf = formatters.config_for_field(field, format_spec.name)
+            return fo_conf.get('descend-if-dictized', True) if fo_conf else True
+        return True
+    
+    def _compile_leaf(self, field):
+        '''Compile a function to serialize or format a leaf value'''
+        
+        if self.serializer_name:
+            ser = serializer_for_field(field, self.serializer_name)
+            if not ser:
+                return _identity
+            def serialize(v):
+                try:
+                    return ser.dumps(v)
+                except Exception as ex:
+                    logger.warn(
+                        'Failed to serialize value %r for field %r (%s): %s' % (
+                            v, field.__name__, field.__class__.__name__, ex))
+                    return None
+            return serialize
+        
+        format_spec = self.format_spec
+        if format_spec:
+            fo = formatter_for_field(field, format_spec.name)
+            if not fo:
+                return _identity
+            fo_opts = format_spec.opts
+            fo_conf = formatters.config_for_field(field, format_spec.name)
+            if fo_conf and 'extra-opts' in fo_conf:
+                fo_opts = copy.copy(fo_opts)
+                fo_opts.update(fo_conf.get('extra-opts'))
+            def format(v):
+                try:
+                    return fo.format(v, opts=fo_opts)
+                except Exception as ex:
+                    logger.warn(
+                        'Failed to format value %r for field %r (%s): %s' % (
+                            v, field.__name__, field.__class__.__name__, ex))
+                    return None
+            return format
+        
+        return _identity
+
+class _DictizePlans(_Plans):
+    plan_cls = _DictizePlan
+
+class _LoadPlan(object):
+    '''A plan to (fully) reload instances of an Object class from a dict.
+
+    This must behave exactly as Object.Loader._reload does (with compiled unset).
+    '''
+    
+    def __init__(self, cls, plans, serializer_name, use_defaults):
+        self.cls = cls
+        self.plans = plans
+        self.serializer_name = serializer_name
+        self.use_defaults = use_defaults
+        
+        self.fields = []
+        for k, field in cls.iter_fields(exclude_properties=True):
+            factory = cls.get_field_factory(k, field)
+            self.fields.append((k, field, factory, self._compile_create(field)))
+
+    def reload(self, obj, data):
+        use_defaults = self.use_defaults
+        for k, field, factory, create_field in self.fields:
+            v = data.get(k)
+            if v is None:
+                if use_defaults:
+                    f = factory() if factory else field.default
+                else:
+                    f = None
+            else:
+                f = create_field(v, factory)
+            setattr(obj, k, f)
+
+    def _compile_create(self, field):
+        if isinstance(field, zope.schema.Object):
+            get_plan = self.plans.get
+            cls = self.cls
+            default_factory = []
+            def create_field(v, factory=None):
+                if not isinstance(v, dict):
+                    # The supplied value is not a dict, cannot load from it
+                    return v
+                if not factory:
+                    if not default_factory:
+                        default_factory.append(cls.get_field_factory(field=field))
+                    factory = default_factory[0]
+                f = factory()
+                if isinstance(f, Object):
+                    get_plan(type(f)).reload(f, v)
+                return f
+        elif isinstance(field, (zope.schema.List, zope.schema.Tuple)):
+            create_item = self._compile_create(field.value_type)
+            def create_field(v, factory=None):
+                if isinstance(v, (list, tuple)):
+                    iv = v
+                elif isinstance(v, dict):
+                    iv = (y for i, y in dictization.enumerated(
+                        v, key_order=int, missing_value=None))
+                else:
+                    iv = ()
+                return [create_item(y) for y in iv]
+        elif isinstance(field, zope.schema.Dict):
+            create_item = self._compile_create(field.value_type)
+            def create_field(v, factory=None):
+                return {k: create_item(y) for k, y in v.iteritems()}
+        else:
+            ser = None
+            if self.serializer_name:
+                ser = serializer_for_field(field, self.serializer_name)
+            def create_field(v, factory=None):
+                f = None
+                if ser:
+                    try:
+                        f = ser.loads(v)
+                    except:
+                        logger.warn(
+                            'Failed to unserialize value %r for field %r' %(v, field))
+                if f is None:
+                    f = copy.copy(v)
+                return f
+        
+        return create_field
+
+class _LoadPlans(_Plans):
+    plan_cls = _LoadPlan
+
+@memoize(max_size=64, tags=['schemata'])
+def _get_dictize_plans(serializer_name, format_spec):
+    return _DictizePlans(serializer_name, format_spec)
+
+@memoize(max_size=64, tags=['schemata'])
+def _get_load_plans(serializer_name, use_defaults):
+    return _LoadPlans(serializer_name, use_defaults)
+
+def _identity(v):
+    return v
+
 #
 # Serializers
 #
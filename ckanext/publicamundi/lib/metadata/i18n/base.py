@@ -64,6 +64,21 @@ def translator_for_field(field, source_language, field_translation):
         [field, Language(source_language), field_translation], ITranslator, name)
     return translator
 
+def translations_for_packages(packages, keys, language):
+    '''Lookup translations for the same keys of several packages at once.
+    
+    This is a bulk alternative to building a translator per package (e.g. for 
+    search results), for keys that are translated in the scope of a package (see
+    package_translation.FieldTranslation).
+
+    The `packages` parameter is a sequence of package dicts (providing `id` and
+    `language`, i.e. the source language). Return a dict mapping a package id to
+    a dict of translated values (keyed on dotted key paths).
+    '''
+    
+    pairs = [(pkg['id'], pkg.get('language')) for pkg in packages]
+    return package_translation.FieldTranslation.get_many(pairs, keys, language)
+
 ## Base 
 
 @translate_adapter()
@@ -152,6 +167,13 @@ class MetadataTranslator(object):
         
         source_language = self.source_language
         key_prefix = getattr(self.md, '_dataset_type_', '')
+        
+        # Load translations at once (where supported), instead of per field
+        
+        for translation in self._translations:
+            preload = getattr(translation, 'preload', None)
+            if preload:
+                preload(language)
 
         # Lookup all available translations 
         
@@ -6,11 +6,14 @@ from zope.interface.verify import verifyObject
 import sqlalchemy
 import sqlalchemy.orm as orm
 import logging
+import uuid
 import pylons
 
 import ckan.model as model
 
 import ckanext.publicamundi.model as ext_model
+import ckanext.publicamundi.lib.metadata_cache as metadata_cache
+from ckanext.publicamundi.cache_manager import get_cache
 from ckanext.publicamundi.lib.util import check_uuid
 from ckanext.publicamundi.lib.metadata.fields import Field, IField, TextField
 from ckanext.publicamundi.lib.metadata.base import FieldContext, IFieldContext
@@ -22,6 +25,9 @@ __all__ = []
 
 log1 = logging.getLogger(__name__)
 
+# The beaker cache for preloaded translations (see FieldTranslation.preload)
+CACHE_NAME = 'package-translations'
+
 @zope.interface.implementer(IKeyBasedFieldTranslation)
 class FieldTranslation(object):
     '''Provide a key-based field translation mechanism in the scope of a package.
@@ -52,6 +58,9 @@ class FieldTranslation(object):
         self._source_language = check_language(source_language)
         
         self._defer_commit = False
+        
+        # Translations preloaded per (language, state), as maps of key to value
+        self._preloaded = {}
 
     def __str__(self):
         return '<FieldTranslation ns=%s source=%s>' % (
@@ -61,8 +70,10 @@ class FieldTranslation(object):
     def _key(cls, field):
         '''Return a string regarded as a key for a (bound) field.
         '''
+        return cls._key_of_path(field.context.key)
 
-        key = field.context.key
+    @classmethod
+    def _key_of_path(cls, key):
         if isinstance(key, tuple):
             key = '.'.join(map(str, key))
         else:
@@ -72,6 +83,49 @@ class FieldTranslation(object):
             raise ValueError('field: Expected non-empty key path at context.key')
         return key
     
+    @classmethod
+    def get_many(cls, packages, keys, language, state='active'):
+        '''Return translations for the given keys of several packages (in one query).
+
+        The `packages` parameter is a sequence of (package-id, source-language) pairs,
+        and `keys` a sequence of key paths (either tuples or dotted strings).
+
+        Return a dict mapping a package id to a dict of translated values, keyed on
+        (dotted) key paths. Packages without any translation are not included.
+        '''
+        
+        sources = {}
+        for package_id, source_language in packages:
+            package_id = check_uuid(str(package_id))
+            if package_id and source_language:
+                sources[package_id] = check_language(source_language)
+        if not sources:
+            return {}
+
+        keys = set(cls._key_of_path(k) for k in keys)
+        language = check_language(language)
+        
+        # Lookup for translations on all (package, key) pairs
+        
+        PackageTranslation = ext_model.PackageTranslation
+        q = model.Session.query(
+                PackageTranslation.package_id, 
+                PackageTranslation.source_language, 
+                PackageTranslation.key, 
+                PackageTranslation.value)
+        q = q.filter(
+            PackageTranslation.package_id.in_(sources.keys()),
+            PackageTranslation.language == language,
+            PackageTranslation.key.in_(keys))
+        if state and (state != '*'):
+            q = q.filter(PackageTranslation.state == state)
+        
+        result = {}
+        for package_id, source_language, key, value in q:
+            if value and (sources.get(package_id) == source_language):
+                result.setdefault(package_id, {})[key] = value
+        return result
+    
     ## IFieldTranslation interface ## 
     
     @property
@@ -90,9 +144,16 @@ class FieldTranslation(object):
 
         key = type(self)._key(field)
         language = check_language(language)
-
-        # Lookup for a translation on this key
         
+        # Lookup for a translation on this key (first, on preloaded translations)
+        
+        preloaded = self._preloaded.get((language, state))
+        if preloaded is not None:
+            value = preloaded.get(key)
+            if value:
+                return field.bind(FieldContext(key=field.context.key, value=value))
+            return None
+
         cond = dict(
             package_id = self._package_id,
             source_language = self._source_language,
@@ -147,6 +208,7 @@ class FieldTranslation(object):
         
         if not self._defer_commit:
             model.Session.commit()
+        self._invalidate()
         
         return field.bind(FieldContext(key=field.context.key, value=value))
 
@@ -174,6 +236,7 @@ class FieldTranslation(object):
 
         if not self._defer_commit:
             model.Session.commit()
+        self._invalidate()
         return n
 
     ## IKeyBasedFieldTranslation interface ##
@@ -183,6 +246,55 @@ class FieldTranslation(object):
         return self._package_id
     
     ## Helpers ##
+    
+    def preload(self, language, state='active', use_cache=True):
+        '''Load all translations (for a language) at once, so that subsequent
+        lookups (see get()) are served from memory instead of querying per key.
+        
+        If use_cache, the loaded translations are also kept in the (beaker) cache
+        of package translations, until a translation for this package changes (cached
+        entries are tagged with a per-package generation, renewed on every change).
+
+        Return the map of keys to translated values.
+        '''
+        
+        language = check_language(language)
+        
+        load = lambda: dict(
+            (f.context.key, f.context.value) for _, f in self.iter_fields(language, state))
+        
+        values = None
+        if use_cache:
+            try:
+                cache = get_cache(CACHE_NAME)
+                generation = cache.get(
+                    self._package_id, createfunc=lambda: uuid.uuid4().hex)
+                cache_key = '%s@%s:%s:%s:%s' % (
+                    self._package_id, generation, self._source_language, language, state)
+                values = cache.get(cache_key, createfunc=load)
+            except Exception as ex:
+                log1.warn('Failed to use cached translations for package %s: %s', 
+                    self._package_id, ex)
+        if values is None:
+            values = load()
+        
+        self._preloaded[(language, state)] = values
+        return values
+    
+    def _invalidate(self):
+        '''Discard preloaded (and cached) translations, after a change.'''
+        
+        self._preloaded.clear()
+        
+        # Drop current generation, so that cached entries are no longer reachable
+        try:
+            get_cache(CACHE_NAME).remove_value(self._package_id)
+        except Exception as ex:
+            log1.warn('Failed to discard cached translations for %s: %s', 
+                self._package_id, ex)
+        
+        # Translated views of this package (see metadata_cache) are also stale 
+        metadata_cache.invalidate(self._package_id)
 
     def iter_fields(self, language, state='active'):
         '''Iterate on field translations for a given language.
@@ -0,0 +1,65 @@
+'''Cache metadata objects, as built for a certain revision of a package.
+
+Every package has a single cache entry, holding the variants of its metadata
+built so far (e.g. translated views, or their json-friendly form). All variants
+are built for the same revision: the entry is replaced as soon as another
+revision is shown, and is discarded when the package is updated or deleted.
+
+Cached values are shared among requests, so they should be treated as read-only.
+'''
+
+import logging
+
+from ckanext.publicamundi.cache_manager import get_cache
+
+log = logging.getLogger(__name__)
+
+CACHE_NAME = 'metadata-objects'
+
+def get(pkg_dict, variant):
+    '''Get a cached variant of a package's metadata, or None if missing.'''
+    pkg_id, revision_id = pkg_dict.get('id'), pkg_dict.get('revision_id')
+    if not (pkg_id and revision_id):
+        return None
+    entry = _get_entry(pkg_id)
+    if entry and entry['revision_id'] == revision_id:
+        return entry['variants'].get(variant)
+    return None
+
+def put(pkg_dict, variant, value):
+    '''Cache a variant of a package's metadata, built for its current revision.'''
+    pkg_id, revision_id = pkg_dict.get('id'), pkg_dict.get('revision_id')
+    if not (pkg_id and revision_id) or value is None:
+        return
+    entry = _get_entry(pkg_id)
+    variants = {}
+    if entry and entry['revision_id'] == revision_id:
+        variants.update(entry['variants'])
+    variants[variant] = value
+    try:
+        get_cache(CACHE_NAME).put(pkg_id, {
+            'revision_id': revision_id, 'variants': variants})
+    except Exception as ex:
+        log.warn('Failed to cache metadata for package %s: %s', pkg_id, ex)
+
+def invalidate(pkg_id):
+    '''Discard all cached variants of a package's metadata.'''
+    try:
+        get_cache(CACHE_NAME).remove_value(pkg_id)
+    except KeyError:
+        pass
+    except Exception as ex:
+        log.warn('Failed to discard cached metadata for package %s: %s', pkg_id, ex)
+
+#
+# Helpers
+#
+
+def _get_entry(pkg_id):
+    try:
+        return get_cache(CACHE_NAME).get(pkg_id)
+    except KeyError:
+        return None
+    except Exception as ex:
+        log.warn('Failed to read cached metadata for package %s: %s', pkg_id, ex)
+        return None
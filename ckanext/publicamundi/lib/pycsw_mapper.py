@@ -0,0 +1,299 @@
+'''Map metadata objects directly to pyCSW records.
+
+The generic way to build a CSW record (see pycsw_sync.make_record) is to render
+an XML document for a metadata object, and then let pyCSW parse it back (into
+the queryable columns of a record). For dataset types that provide a mapper,
+the columns are computed straight from the metadata object, mimicking the way
+pyCSW would extract them from its XML (i.e. pycsw.metadata._parse_iso).
+
+The XML document is still needed for the `xml` column, but it is only rendered
+(as a string, never parsed) when this column is populated.
+'''
+
+import re
+import zope.interface
+
+from pycsw import util as pycsw_util
+
+from ckanext.publicamundi.lib.util import raise_for_stub_method
+from ckanext.publicamundi.lib.metadata import (
+    adapter_registry, IObject, xml_serializer_for)
+from ckanext.publicamundi.lib.metadata.schemata import IInspireMetadata
+
+__all__ = [
+    'IRecordMapper',
+    'record_mapper',
+    'mapper_for',
+]
+
+class IRecordMapper(zope.interface.Interface):
+
+    def get_values():
+        '''Return a dict of values keyed on pyCSW queryables (e.g. pycsw:Title).
+
+        The values for pycsw:XML and pycsw:InsertDate are not included.
+        '''
+
+    def get_xml(target_namespace=None):
+        '''Render the XML document (as a string) for the `xml` column.
+        '''
+
+# Decorators for adaptation
+
+def record_mapper(required_iface):
+    assert required_iface.isOrExtends(IObject)
+    def decorate(cls):
+        adapter_registry.register(
+            [required_iface], IRecordMapper, 'map-pycsw-record', cls)
+        return cls
+    return decorate
+
+# Utilities
+
+def mapper_for(obj):
+    '''Get a record mapper for an IObject object (or None, if not mapped directly).
+    '''
+    assert IObject.providedBy(obj)
+    mapper = adapter_registry.queryMultiAdapter(
+        [obj], IRecordMapper, 'map-pycsw-record')
+    return mapper
+
+# Mappers
+
+class BaseRecordMapper(object):
+
+    zope.interface.implements(IRecordMapper)
+
+    def __init__(self, obj):
+        self.obj = obj
+
+    def get_values(self):
+        raise_for_stub_method()
+
+    def get_xml(self, target_namespace=None):
+        xser = xml_serializer_for(self.obj)
+        xser.target_namespace = target_namespace
+        s = xser.dumps()
+        # Note Keep the root element only (as pyCSW does when parsing)
+        return _xml_declaration_pattern.sub('', s, count=1)
+
+    def populate(self, record, context, target_namespace=None):
+        '''Populate record (an instance of repository's dataset) with values
+        mapped to the columns configured in (pyCSW's) context.
+        '''
+        mappings = context.md_core_model['mappings']
+        for name, value in self.get_values().iteritems():
+            setattr(record, mappings[name], value)
+        setattr(record, mappings['pycsw:InsertDate'], pycsw_util.get_today_and_now())
+        setattr(record, mappings['pycsw:XML'], self.get_xml(target_namespace))
+        return record
+
+@record_mapper(IInspireMetadata)
+class InspireRecordMapper(BaseRecordMapper):
+    '''Map an InspireMetadata object, as pyCSW would map the XML document
+    rendered for it (see template package/inspire_iso.xml).
+    '''
+
+    def get_values(self):
+        obj = self.obj
+        res = {
+            'pycsw:Identifier': _text(obj.identifier),
+            'pycsw:Typename': 'gmd:MD_Metadata',
+            'pycsw:Schema': 'http://www.isotc211.org/2005/gmd',
+            'pycsw:MdSource': 'local',
+            'pycsw:Language': _text(obj.languagecode),
+            'pycsw:Type': 'dataset',
+            'pycsw:Date': _text(obj.datestamp),
+            'pycsw:Modified': _text(obj.datestamp),
+            'pycsw:Title': _text(obj.title),
+            'pycsw:Abstract': _text(obj.abstract),
+            'pycsw:Lineage': _text(obj.lineage) if obj.lineage else None,
+        }
+
+        if obj.reference_system:
+            res['pycsw:CRS'] = 'urn:ogc:def:crs:EPSG:6.11:%s' % (
+                obj.reference_system.code)
+
+        # Identification
+
+        extents = [te for te in (obj.temporal_extent or []) if te.start or te.end]
+        res['pycsw:TempExtent_begin'] = _first(_text(te.start) for te in extents if te.start)
+        res['pycsw:TempExtent_end'] = _first(_text(te.end) for te in extents if te.end)
+
+        res['pycsw:TopicCategory'] = _first(obj.topic_category)
+        res['pycsw:ResourceLanguage'] = _first(obj.resource_language)
+
+        keywords = self._get_keywords()
+        if keywords:
+            res['pycsw:Keywords'] = ','.join(filter(None, keywords))
+            res['pycsw:KeywordType'] = None
+
+        parties = obj.responsible_party or []
+        for name, roles in (
+                ('pycsw:Creator', ('originator',)),
+                ('pycsw:Publisher', ('publisher',)),
+                ('pycsw:Contributor', ('author',)),
+                ('pycsw:OrganizationName', None)):
+            orgs = [_text(p.organization) for p in parties if not roles or p.role in roles]
+            if orgs:
+                res[name] = ';'.join(set(orgs))
+
+        res['pycsw:AccessConstraints'] = (
+            'otherRestrictions' if obj.limitations else None)
+        res['pycsw:OtherConstraints'] = _first(_text(v) for v in obj.limitations or [])
+        res['pycsw:ConditionApplyingToAccessAndUse'] = _first(
+            _text(v) for v in obj.access_constraints or [])
+
+        for name, value in (
+                ('pycsw:CreationDate', obj.creation_date),
+                ('pycsw:PublicationDate', obj.publication_date),
+                ('pycsw:RevisionDate', obj.revision_date)):
+            if value:
+                res[name] = _text(value)
+
+        resolutions = obj.spatial_resolution or []
+        distances = [s for s in resolutions if s.distance]
+        res['pycsw:DistanceValue'] = _first(_text(s.distance) for s in distances)
+        res['pycsw:DistanceUOM'] = _first(_text(s.uom) for s in distances)
+        res['pycsw:Denominator'] = _first(
+            _text(s.denominator) for s in resolutions if not s.distance and s.denominator)
+
+        bbox = _first(obj.bounding_box)
+        if bbox is not None:
+            try:
+                res['pycsw:BoundingBox'] = pycsw_util.bbox2wktpolygon('%s,%s,%s,%s' % (
+                    bbox.wblng, bbox.sblat, bbox.eblng, bbox.nblat))
+            except:
+                res['pycsw:BoundingBox'] = None
+        else:
+            res['pycsw:BoundingBox'] = None
+
+        # Data quality
+
+        conformity = _first(obj.conformity)
+        if conformity:
+            res['pycsw:Degree'] = {
+                'conformant': 'true', 'not-conformant': 'false'}.get(conformity.degree)
+            res['pycsw:SpecificationTitle'] = _text(conformity.title)
+            res['pycsw:SpecificationDate'] = _text(conformity.date)
+            res['pycsw:SpecificationDateType'] = _text(conformity.date_type)
+
+        # Contact, distribution
+
+        contact = _first(obj.contact)
+        if contact:
+            res['pycsw:ResponsiblePartyRole'] = _text(contact.role)
+
+        links = ['None,None,None,%s' % (_text(url)) for url in obj.locator or []]
+        if links:
+            res['pycsw:Links'] = '^'.join(links)
+
+        res['pycsw:AnyText'] = ' '.join(filter(None, self._iter_text()))
+
+        return res
+
+    def _get_keywords(self):
+        keywords = []
+        for terms in (self.obj.keywords or {}).itervalues():
+            keywords.extend(_text(t.title) for t in terms if t is not None)
+        for k in self.obj.free_keywords or []:
+            keywords.append(_text(k.value))
+        return keywords
+
+    def _iter_text(self):
+        '''Iterate on text values, in the order they appear in rendered XML.
+
+        Note This must be kept in sync with template package/inspire_iso.xml.
+        '''
+        obj = self.obj
+        yield _text(obj.identifier)
+        yield _text(obj.languagecode)
+        yield 'dataset'
+        for co in obj.contact or []:
+            yield _text(co.organization)
+            yield _text(co.email)
+            yield _text(co.role)
+        yield _text(obj.datestamp)
+        yield 'ISO 19115'
+        yield '2003/Cor.1:2006'
+        rs = obj.reference_system
+        if rs:
+            yield _text(rs.code)
+            yield _text(rs.code_space) if rs.code_space else None
+            yield _text(rs.version) if rs.version else None
+        yield _text(obj.title)
+        for value, date_type in (
+                (obj.creation_date, 'creation'),
+                (obj.publication_date, 'publication'),
+                (obj.revision_date, None)):
+            if value:
+                yield _text(value)
+                yield date_type or _text(value)
+        yield _text(obj.identifier)
+        yield _text(obj.abstract)
+        for co in obj.responsible_party or []:
+            yield _text(co.organization)
+            yield _text(co.email)
+            yield _text(co.role)
+        for terms in (obj.keywords or {}).itervalues():
+            for t in terms:
+                yield _text(t.title) if t is not None else None
+            yield _text(terms.thesaurus.title)
+            yield _text(terms.thesaurus.reference_date)
+            yield _text(terms.thesaurus.date_type)
+        for k in obj.free_keywords or []:
+            yield _text(k.value)
+            if k.originating_vocabulary:
+                yield _text(k.originating_vocabulary)
+                yield _text(k.reference_date)
+                yield _text(k.date_type)
+        for v in obj.access_constraints or []:
+            yield _text(v)
+        for v in obj.limitations or []:
+            yield 'otherRestrictions'
+            yield _text(v)
+        for s in obj.spatial_resolution or []:
+            if s.distance:
+                yield _text(s.distance)
+            elif s.denominator:
+                yield _text(s.denominator)
+        for v in obj.resource_language or []:
+            yield _text(v)
+        for v in obj.topic_category or []:
+            yield _text(v)
+        for bbox in obj.bounding_box or []:
+            for v in (bbox.wblng, bbox.eblng, bbox.sblat, bbox.nblat):
+                yield _text(v)
+        for te in obj.temporal_extent or []:
+            yield _text(te.start) if te.start else None
+            yield _text(te.end) if te.end else None
+        for v in obj.locator or []:
+            yield _text(v)
+        yield 'dataset'
+        for con in obj.conformity or []:
+            yield 'Conformity'
+            yield 'INSPIRE'
+            yield _text(con.title)
+            yield _text(con.date)
+            yield _text(con.date_type)
+            yield 'See the referenced specification'
+            yield {'conformant': 'true', 'not-conformant': 'false'}.get(con.degree)
+        if obj.lineage:
+            yield _text(obj.lineage)
+
+#
+# Helpers
+#
+
+_xml_declaration_pattern = re.compile(r'^\s*<\?xml[^>]*\?>\s*')
+
+def _text(value):
+    '''Convert to text, the way a value is rendered by the XML template'''
+    if isinstance(value, unicode):
+        return value
+    return unicode(value)
+
+def _first(values):
+    for value in values or []:
+        return value
+    return None
@@ -0,0 +1,297 @@
+'''Synchronize datasets with pyCSW records in the background.
+
+Changes to datasets are queued (instead of being applied on the request path)
+and are applied by a worker thread, in batches of records per transaction.
+Repeated changes to the same dataset (while still queued) are coalesced, so
+that only the last one is applied. Failed changes are retried a few times.
+
+Every process keeps a queue of its own (started lazily, so that it is safe
+to fork before using it).
+
+The worker thread registers a (fake) Pylons request context of its own, as
+building a record may need to render templates (e.g. the XML document of an
+INSPIRE record), see commands.py `_fake_request_context`.
+'''
+
+import os
+import time
+import copy
+import atexit
+import logging
+import threading
+from collections import OrderedDict
+
+import ckan.model as model
+
+from ckanext.publicamundi.lib import pycsw_sync
+
+log1 = logging.getLogger(__name__)
+
+# Maximum number of records applied in a single transaction
+DEFAULT_BATCH_SIZE = 50
+
+# Seconds to wait for more changes (on the same dataset) before applying one
+DEFAULT_DELAY = 1.0
+
+# Retry a failed change up to MAX_ATTEMPTS times, waiting a multiple of
+# RETRY_DELAY seconds between attempts
+MAX_ATTEMPTS = 3
+RETRY_DELAY = 10.0
+
+# Seconds to wait for queued changes to be applied, when exiting
+EXIT_TIMEOUT = 30.0
+
+
+class SyncQueue(object):
+    '''A queue of changes (updates or deletes) on datasets to be synchronized
+    with pyCSW records.
+    '''
+
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE, delay=DEFAULT_DELAY,
+            max_attempts=MAX_ATTEMPTS, retry_delay=RETRY_DELAY):
+        self.batch_size = batch_size
+        self.delay = delay
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._reset()
+
+    def put_update(self, pkg_dict):
+        '''Queue a create/update of the record for a dataset'''
+        # Take a snapshot, the caller is free to modify pkg_dict afterwards
+        self._put('update', pkg_dict['id'], copy.deepcopy(pkg_dict))
+
+    def put_delete(self, pkg_id):
+        '''Queue a delete of the record for a dataset'''
+        self._put('delete', pkg_id)
+
+    def flush(self, timeout=None):
+        '''Apply queued changes now, and wait for them to complete.
+
+        Return True if the queue was drained (before timeout, if given).
+        '''
+        deadline = (time.time() + timeout) if timeout else None
+        with self._cond:
+            for change in self._pending.itervalues():
+                change.due = min(change.due, time.time())
+            self._cond.notify_all()
+            while self._pending or self._in_flight:
+                if not self._worker or not self._worker.is_alive():
+                    break
+                remaining = (deadline - time.time()) if deadline else None
+                if remaining is not None and remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return not (self._pending or self._in_flight)
+
+    def get_stats(self):
+        '''Return the depth, lag (age of oldest queued change, in seconds) and
+        counters of this queue.
+        '''
+        now = time.time()
+        with self._cond:
+            queued = self._pending.values() + self._in_flight
+            return {
+                'depth': len(queued),
+                'lag': max([now - c.since for c in queued] or [0.0]),
+                'applied': self._applied,
+                'coalesced': self._coalesced,
+                'retried': self._retried,
+                'failed': self._failed,
+                'batches': self._batches,
+                'last_batch_at': self._last_batch_at,
+                'worker_alive': bool(self._worker and self._worker.is_alive()),
+            }
+
+    ## Helpers ##
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._cond = threading.Condition()
+        self._pending = OrderedDict() # changes, keyed on dataset id
+        self._in_flight = [] # changes currently applied by the worker
+        self._worker = None
+        self._applied = 0
+        self._coalesced = 0
+        self._retried = 0
+        self._failed = 0
+        self._batches = 0
+        self._last_batch_at = None
+
+    def _put(self, op, pkg_id, pkg_dict=None):
+        if self._pid != os.getpid():
+            # Forked: do not inherit the queue (or the worker) of the parent
+            self._reset()
+        now = time.time()
+        with self._cond:
+            prev = self._pending.pop(pkg_id, None)
+            if prev:
+                self._coalesced += 1
+            since = prev.since if prev else now
+            self._pending[pkg_id] = _Change(op, pkg_id, pkg_dict, since, now + self.delay)
+            if not self._worker or not self._worker.is_alive():
+                self._worker = threading.Thread(
+                    target=self._run, name='pycsw-sync-%d' % (self._pid))
+                self._worker.daemon = True
+                self._worker.start()
+            self._cond.notify_all()
+
+    def _run(self):
+        try:
+            registry = _fake_request_context()
+        except Exception as ex:
+            log1.exception('Cannot create a request context for syncing CSW records')
+        while True:
+            batch = self._take_batch()
+            try:
+                self._apply_batch(batch)
+            except Exception as ex:
+                log1.exception('Unexpected error while syncing CSW records')
+            finally:
+                with self._cond:
+                    self._in_flight = []
+                    self._cond.notify_all()
+
+    def _take_batch(self):
+        '''Wait for (and remove from queue) a batch of changes that are due'''
+        with self._cond:
+            while True:
+                now = time.time()
+                batch, next_due = [], None
+                for pkg_id, change in self._pending.iteritems():
+                    if change.due <= now:
+                        batch.append(change)
+                        if len(batch) == self.batch_size:
+                            break
+                    elif next_due is None or change.due < next_due:
+                        next_due = change.due
+                if batch:
+                    for change in batch:
+                        del self._pending[change.pkg_id]
+                    self._in_flight = batch
+                    return batch
+                self._cond.wait((next_due - now) if next_due else None)
+
+    def _apply_batch(self, batch):
+        session = model.Session
+        try:
+            try:
+                results = [self._apply(session, change) for change in batch]
+                session.commit()
+            except Exception as ex:
+                session.rollback()
+                if len(batch) == 1:
+                    self._retry(batch[0], ex)
+                    return
+                # Apply one by one, so that a failing change does not hold back the rest
+                log1.warn('Failed to sync a batch of %d CSW records, retrying one by one: %s',
+                    len(batch), ex)
+                for change in batch:
+                    try:
+                        result = self._apply(session, change)
+                        session.commit()
+                    except Exception as ex:
+                        session.rollback()
+                        self._retry(change, ex)
+                    else:
+                        self._count_applied([result])
+            else:
+                self._count_applied(results)
+        finally:
+            session.remove()
+
+        log1.debug('Synced a batch of %d CSW records', len(batch))
+
+    def _apply(self, session, change):
+        '''Apply a change, return False if a record could not be built for it'''
+        if change.op == 'delete':
+            pycsw_sync.delete_record(session, {'id': change.pkg_id}, commit=False)
+        else:
+            record = pycsw_sync.create_or_update_record(
+                session, change.pkg_dict, commit=False)
+            if not record:
+                # Cannot be fixed by retrying (the dataset must change)
+                log1.error('Failed to build CSW record for dataset %s', change.pkg_id)
+                return False
+        return True
+
+    def _retry(self, change, ex):
+        change.attempts += 1
+        with self._cond:
+            if change.attempts >= self.max_attempts:
+                self._failed += 1
+                log1.error('Failed to sync CSW record for dataset %s (gave up after %d attempts): %s',
+                    change.pkg_id, change.attempts, ex)
+            elif change.pkg_id in self._pending:
+                pass # superseded by a newer change
+            else:
+                self._retried += 1
+                change.due = time.time() + self.retry_delay * change.attempts
+                self._pending[change.pkg_id] = change
+                log1.warn('Failed to sync CSW record for dataset %s (attempt %d): %s',
+                    change.pkg_id, change.attempts, ex)
+
+    def _count_applied(self, results):
+        '''Count the results of changes (see _apply) committed in a batch'''
+        n = results.count(True)
+        with self._cond:
+            self._applied += n
+            self._failed += len(results) - n
+            self._batches += 1
+            self._last_batch_at = time.time()
+
+class _Change(object):
+
+    __slots__ = ('op', 'pkg_id', 'pkg_dict', 'since', 'due', 'attempts')
+
+    def __init__(self, op, pkg_id, pkg_dict, since, due):
+        self.op = op
+        self.pkg_id = pkg_id
+        self.pkg_dict = pkg_dict
+        self.since = since
+        self.due = due
+        self.attempts = 0
+
+def _fake_request_context():
+    '''Register a minimal (fake) Pylons request context for the current thread,
+    so that toolkit.render() works (see commands.py `_fake_request_context`).
+    '''
+
+    import pylons
+    from pylons.util import AttribSafeContextObj
+    from paste.registry import Registry
+    from ckan.lib.cli import MockTranslator
+
+    registry = Registry()
+    registry.prepare()
+    registry.register(pylons.translator, MockTranslator())
+    for proxy in (pylons.request, pylons.response, pylons.session, pylons.url,
+            pylons.tmpl_context):
+        registry.register(proxy, AttribSafeContextObj())
+    pylons.request.environ = dict()
+    pylons.request.params = dict()
+    pylons.response.headers = dict()
+    return registry
+
+_queue = SyncQueue()
+
+def setup(batch_size=DEFAULT_BATCH_SIZE, delay=DEFAULT_DELAY):
+    '''Configure the (process-wide) queue'''
+    _queue.batch_size = batch_size
+    _queue.delay = delay
+
+def get_queue():
+    return _queue
+
+def put_update(pkg_dict):
+    _queue.put_update(pkg_dict)
+
+def put_delete(pkg_id):
+    _queue.put_delete(pkg_id)
+
+def get_stats():
+    return _queue.get_stats()
+
+@atexit.register
+def _flush_on_exit():
+    if _queue._pid == os.getpid() and not _queue.flush(EXIT_TIMEOUT):
+        log1.warn('Exiting with %d unsynced CSW records', _queue.get_stats()['depth'])
@@ -0,0 +1,386 @@
+'''Rebuild (or repair) the whole pyCSW repository from CKAN datasets.
+
+A full rebuild streams the ids of active datasets in pages, builds their CSW
+records (see pycsw_sync.make_record) in a pool of processes, and bulk-loads
+them into a staging table (a copy of the records table, along with its indexes,
+triggers and foreign keys). The staging table is swapped in atomically, so the
+CSW service keeps serving the old records until the new ones are complete.
+
+A repair compares records to datasets, and only rebuilds records that are
+missing or older than their dataset (and deletes orphan records).
+'''
+
+import time
+import datetime
+import logging
+import multiprocessing
+from dateutil.parser import parse as parse_date
+from dateutil.tz import tzutc
+from sqlalchemy import sql
+
+import ckan.model as model
+import ckan.plugins.toolkit as toolkit
+
+from ckanext.publicamundi.model import CswRecord
+from ckanext.publicamundi.lib import pycsw_sync
+
+log1 = logging.getLogger(__name__)
+
+# Number of dataset ids fetched per query
+PAGE_SIZE = 500
+
+# Number of records inserted per statement
+BATCH_SIZE = 200
+
+# Number of datasets handed to a worker process at a time
+CHUNK_SIZE = 8
+
+STAGING_SUFFIX = '_staging'
+
+_get_action = toolkit.get_action
+
+
+class Progress(object):
+    '''Count processed records, and report (log) throughput periodically'''
+
+    def __init__(self, total=None, interval=10.0, logger=log1):
+        self.total = total
+        self.interval = interval
+        self.logger = logger
+        self.loaded = 0
+        self.failed = 0
+        self.started_at = time.time()
+        self._reported_at = self.started_at
+
+    @property
+    def elapsed(self):
+        return time.time() - self.started_at
+
+    @property
+    def rate(self):
+        '''Throughput (records/sec)'''
+        dt = self.elapsed
+        return (self.loaded / dt) if dt > 0 else 0.0
+
+    def update(self, loaded=0, failed=0):
+        self.loaded += loaded
+        self.failed += failed
+        now = time.time()
+        if now - self._reported_at >= self.interval:
+            self._reported_at = now
+            self.report()
+
+    def report(self):
+        n = self.loaded + self.failed
+        self.logger.info('Processed %d%s records (%d failed) in %.1fs: %.1f records/s',
+            n, (' of %d' % self.total) if self.total is not None else '',
+            self.failed, self.elapsed, self.rate)
+
+## Datasets ##
+
+def count_packages():
+    return model.Session.query(model.Package.id).filter(
+        model.Package.state == 'active').count()
+
+def iter_package_ids(page_size=PAGE_SIZE, since=None):
+    '''Iterate on the ids of active datasets (modified after since, if given),
+    fetching them in pages.
+    '''
+    Package = model.Package
+    last_id = None
+    while True:
+        q = model.Session.query(Package.id).filter(Package.state == 'active')
+        if since:
+            q = q.filter(Package.metadata_modified > since)
+        if last_id:
+            q = q.filter(Package.id > last_id)
+        ids = [r[0] for r in q.order_by(Package.id).limit(page_size)]
+        model.Session.remove()
+        for pkg_id in ids:
+            yield pkg_id
+        if len(ids) < page_size:
+            break
+        last_id = ids[-1]
+
+## Records ##
+
+def build_records(package_ids, processes=1):
+    '''Build the CSW records for datasets, in a pool of processes if processes > 1.
+
+    Yields tuples of (package id, values, error), where values is a dict of
+    column values for a record (or None if it failed to build).
+    '''
+    if processes <= 1:
+        for pkg_id in package_ids:
+            yield _build_record(pkg_id)
+        return
+
+    # Do not let workers inherit (and share) open database connections
+    model.Session.remove()
+    model.meta.engine.dispose()
+
+    pool = multiprocessing.Pool(processes, initializer=_init_worker)
+    try:
+        for result in pool.imap(_build_record_worker, package_ids, CHUNK_SIZE):
+            yield result
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+## Rebuild ##
+
+def rebuild(processes=1, page_size=PAGE_SIZE, batch_size=BATCH_SIZE, progress=None):
+    '''Rebuild all records into a staging table, and swap it in.
+
+    Return a Progress object with the counts of loaded and failed records.
+    '''
+
+    table_name = pycsw_sync.pycsw_table_name
+    staging_name = table_name + STAGING_SUFFIX
+    if not progress:
+        progress = Progress(count_packages())
+
+    # Note CKAN keeps metadata_modified in UTC
+    started_at = datetime.datetime.utcnow()
+
+    engine = model.meta.engine
+    conn = engine.connect()
+    try:
+        _create_staging_table(conn, table_name, staging_name)
+
+        loaded_ids = set()
+        def load(package_ids):
+            results = build_records(package_ids, processes)
+            for batch in _batches(results, batch_size):
+                rows = []
+                for pkg_id, values, error in batch:
+                    if values is None:
+                        log1.warn('Skipped CSW record for dataset %s: %s', pkg_id, error)
+                    else:
+                        rows.append(values)
+                        loaded_ids.add(pkg_id)
+                _insert_rows(conn, staging_name, rows)
+                progress.update(loaded=len(rows), failed=(len(batch) - len(rows)))
+
+        load(iter_package_ids(page_size))
+
+        # Catch up with datasets changed while loading (were loaded, or not,
+        # with their previous version)
+
+        changed_ids = list(iter_package_ids(page_size, since=started_at))
+        if changed_ids:
+            log1.info('Reloading %d datasets changed during rebuild', len(changed_ids))
+            _delete_rows(conn, staging_name, changed_ids)
+            progress.loaded -= len(loaded_ids.intersection(changed_ids))
+            load(changed_ids)
+
+        _swap_tables(conn, table_name, staging_name)
+    except:
+        conn.execute('DROP TABLE IF EXISTS "%s"' % (staging_name))
+        raise
+    finally:
+        conn.close()
+
+    progress.report()
+    return progress
+
+## Repair ##
+
+def diff():
+    '''Compare records to datasets.
+
+    Return a tuple of (missing, stale, orphan) lists of dataset ids: missing
+    records, records older than their datasets, and records for datasets that
+    are no longer active.
+    '''
+
+    Package = model.Package
+    # Note CKAN keeps metadata_modified in UTC (see _parse_insert_date)
+    modified = dict(model.Session.query(Package.id, Package.metadata_modified).filter(
+        Package.state == 'active'))
+    inserted = dict(model.Session.query(CswRecord.identifier, CswRecord.insert_date))
+    model.Session.remove()
+
+    missing, stale = [], []
+    for pkg_id, metadata_modified in modified.iteritems():
+        insert_date = inserted.get(pkg_id)
+        if not insert_date:
+            missing.append(pkg_id)
+        elif _parse_insert_date(insert_date) < metadata_modified.replace(microsecond=0):
+            stale.append(pkg_id)
+    orphan = [pkg_id for pkg_id in inserted if not pkg_id in modified]
+
+    return sorted(missing), sorted(stale), sorted(orphan)
+
+def repair(processes=1, batch_size=BATCH_SIZE, dry_run=False, progress=None):
+    '''Rebuild missing or stale records, delete orphan records.
+
+    Return a Progress object with the counts of loaded and failed records.
+    '''
+
+    table_name = pycsw_sync.pycsw_table_name
+
+    missing, stale, orphan = diff()
+    log1.info('Found %d missing, %d stale and %d orphan CSW records',
+        len(missing), len(stale), len(orphan))
+    if not progress:
+        progress = Progress()
+    progress.total = len(missing) + len(stale)
+    if dry_run:
+        return progress
+
+    conn = model.meta.engine.connect()
+    try:
+        if orphan:
+            with conn.begin():
+                _delete_rows(conn, table_name, orphan)
+        results = build_records(missing + stale, processes)
+        for batch in _batches(results, batch_size):
+            rows = [values for pkg_id, values, error in batch if values is not None]
+            with conn.begin():
+                _delete_rows(conn, table_name, [r['identifier'] for r in rows])
+                _insert_rows(conn, table_name, rows)
+            progress.update(loaded=len(rows), failed=(len(batch) - len(rows)))
+    finally:
+        conn.close()
+
+    progress.report()
+    return progress
+
+#
+# Helpers
+#
+
+def _build_record(pkg_id):
+    context = {
+        'model': model,
+        'session': model.Session,
+        'ignore_auth': True,
+        'api_version': '3',
+    }
+    try:
+        pkg_dict = _get_action('package_show')(context, {'id': pkg_id})
+        record = pycsw_sync.make_record(pkg_dict)
+    except Exception as ex:
+        return (pkg_id, None, str(ex))
+    if not record:
+        return (pkg_id, None, 'Cannot extract a CSW record')
+    values = {c.name: getattr(record, c.key, None) for c in CswRecord.__table__.columns}
+    return (pkg_id, values, None)
+
+def _build_record_worker(pkg_id):
+    try:
+        return _build_record(pkg_id)
+    finally:
+        model.Session.remove()
+
+def _init_worker():
+    model.meta.engine.dispose()
+
+def _batches(iterable, n):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == n:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _parse_insert_date(value):
+    '''Parse the insert_date of a record as a naive UTC datetime (as CKAN keeps
+    metadata_modified).
+
+    pyCSW (see pycsw.util.get_today_and_now) writes the local time of the server,
+    although with a 'Z' suffix. So, a date in 'Z' (or without an offset) is taken
+    as local time, while a date with an explicit offset is converted by it.
+    '''
+    dt = parse_date(value)
+    if dt.tzinfo and not value.strip().upper().endswith('Z'):
+        return dt.astimezone(tzutc()).replace(tzinfo=None)
+    dt = dt.replace(tzinfo=None)
+    return datetime.datetime.utcfromtimestamp(time.mktime(dt.timetuple()))
+
+def _create_staging_table(conn, table_name, staging_name):
+    '''Create a staging table as a copy of table_name (along with its indexes and
+    triggers). Foreign keys are added after the staging table is loaded.
+    '''
+
+    conn.execute('DROP TABLE IF EXISTS "%s"' % (staging_name))
+    conn.execute('CREATE TABLE "%s" (LIKE "%s" INCLUDING ALL)' % (staging_name, table_name))
+
+    q = 'SELECT pg_get_triggerdef(oid) FROM pg_trigger ' \
+        'WHERE tgrelid = %s::regclass AND NOT tgisinternal'
+    for (trigger_def,) in conn.execute(q, (table_name,)).fetchall():
+        conn.execute(trigger_def.replace(
+            ' ON %s ' % (table_name), ' ON "%s" ' % (staging_name), 1))
+
+    log1.info('Created staging table %s', staging_name)
+
+def _swap_tables(conn, table_name, staging_name):
+    '''Replace table_name with staging_name, in a single transaction.
+
+    The indexes of the staging table (named after it) are renamed to the names
+    of the respective indexes of table_name.
+    '''
+
+    q = 'SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint ' \
+        'WHERE conrelid = %s::regclass AND contype = %s'
+    foreign_keys = conn.execute(q, (table_name, 'f')).fetchall()
+
+    index_names = _map_index_names(conn, staging_name, table_name)
+
+    with conn.begin():
+        # Drop records of datasets deleted while loading
+        conn.execute(
+            'DELETE FROM "%s" WHERE identifier NOT IN '
+                '(SELECT id FROM package WHERE state = \'active\')' % (staging_name))
+        for name, constraint_def in foreign_keys:
+            conn.execute('ALTER TABLE "%s" ADD CONSTRAINT "%s" %s' % (
+                staging_name, name, constraint_def))
+        conn.execute('LOCK TABLE "%s" IN ACCESS EXCLUSIVE MODE' % (table_name))
+        conn.execute('DROP TABLE "%s"' % (table_name))
+        conn.execute('ALTER TABLE "%s" RENAME TO "%s"' % (staging_name, table_name))
+        for name, new_name in index_names:
+            conn.execute('ALTER INDEX "%s" RENAME TO "%s"' % (name, new_name))
+
+    log1.info('Swapped staging table %s in as %s', staging_name, table_name)
+
+def _map_index_names(conn, source_name, target_name):
+    '''Pair the indexes of source_name to the (identically defined) indexes of
+    target_name. Return a list of (source index name, target index name).
+    '''
+
+    q = 'SELECT c.relname, pg_get_indexdef(i.indexrelid) FROM pg_index i ' \
+        'JOIN pg_class c ON c.oid = i.indexrelid ' \
+        'WHERE i.indrelid = %s::regclass ORDER BY c.relname'
+    def index_key(index_def):
+        # Compare the part following the table name, e.g. "USING btree (title)"
+        head, tail = index_def.split(' USING ', 1)
+        return (head.startswith('CREATE UNIQUE '), tail)
+
+    target_names = {}
+    for name, index_def in conn.execute(q, (target_name,)).fetchall():
+        target_names.setdefault(index_key(index_def), []).append(name)
+
+    result = []
+    for name, index_def in conn.execute(q, (source_name,)).fetchall():
+        names = target_names.get(index_key(index_def))
+        if names:
+            result.append((name, names.pop(0)))
+    return result
+
+def _insert_rows(conn, table_name, rows):
+    if not rows:
+        return
+    columns = [sql.column(k) for k in rows[0].keys()]
+    conn.execute(sql.table(table_name, *columns).insert(), rows)
+
+def _delete_rows(conn, table_name, identifiers):
+    if not identifiers:
+        return
+    t = sql.table(table_name, sql.column('identifier'))
+    conn.execute(t.delete().where(t.c.identifier.in_(identifiers)))
@@ -13,6 +13,7 @@ import ckan.plugins.toolkit as toolkit
 
 from ckanext.publicamundi.lib.metadata import (
     make_metadata, xml_serializer_for)
+from ckanext.publicamundi.lib import pycsw_mapper
 
 log1 = logging.getLogger(__name__)
 
@@ -26,9 +27,13 @@ pycsw_context = None
 pycsw_database = None
 pycsw_table_name = None
 
+# Map metadata objects directly to records (if a mapper exists for their type),
+# instead of parsing their XML dump (see pycsw_mapper)
+direct_mapping = True
+
 _repo = None
 
-def setup(ckan_site_url, pycsw_config_file):
+def setup(ckan_site_url, pycsw_config_file, use_direct_mapping=True):
     '''Setup module when Pylons config is available
     '''
     
@@ -43,6 +48,10 @@ def setup(ckan_site_url, pycsw_config_file):
     pycsw_database = pycsw_config.get('repository', 'database')
     pycsw_table_name = pycsw_config.get('repository', 'table')
     
+    global direct_mapping
+
+    direct_mapping = use_direct_mapping
+
     log1.info('Initialized module globals from Pylons config')
     
     return
@@ -59,8 +68,10 @@ def get_repo():
 
     return _repo
 
-def delete_record(session, pkg_dict):
+def delete_record(session, pkg_dict, commit=True):
     '''Delete the corresponding CSW record (if exists)
+    
+    If commit is false, the caller is responsible to commit the session.
     '''
     
     repo = get_repo()
@@ -68,12 +79,15 @@ def delete_record(session, pkg_dict):
     existing_record = session.query(repo.dataset).get(pkg_dict['id'])
     if existing_record:
         session.delete(existing_record)
-        session.commit()
+        if commit:
+            session.commit()
     
     return existing_record
 
-def create_or_update_record(session, pkg_dict):
+def create_or_update_record(session, pkg_dict, commit=True):
     '''Create or update a CSW record to sync with a newly updated dataset
+    
+    If commit is false, the caller is responsible to commit the session.
     '''
     
     repo = get_repo()
@@ -96,41 +110,65 @@ def create_or_update_record(session, pkg_dict):
                 continue
             setattr(existing_record, key, getattr(record, key, None))
     
-    session.commit()
+    if commit:
+        session.commit()
     return record
 
-def make_record(pkg_dict, repo=None):
-    '''Build and return a metadata record from a dataset's XML dump.
+def make_record(pkg_dict, repo=None, direct=None):
+    '''Build and return a metadata record from a dataset's metadata.
     
     Returns None on failure, or a loaded metadata record on success.
     '''
     
-    global pycsw_context
-
-    if not repo:
-        repo = get_repo()
-
     # Load pkg-dict into a metadata object
 
     pkg_id = pkg_dict['id']
     pkg_dtype = pkg_dict.get('dataset_type')
     obj = make_metadata(pkg_dtype, pkg_dict)
     
-    # Generate an XML dump for current pkg-dict
+    return make_record_for_metadata(pkg_id, obj, repo, direct)
+
+def make_record_for_metadata(pkg_id, obj, repo=None, direct=None):
+    '''Build and return a metadata record from a metadata object.
 
-    xser = xml_serializer_for(obj)
-    xser.target_namespace = site_url 
-    xmldata = xser.to_xml()
+    If direct is true (default: module's direct_mapping), the record is mapped
+    straight from the object (if a mapper exists for its type). Otherwise, it
+    is parsed (by pyCSW) from the object's XML dump.
+    
+    Returns None on failure, or a loaded metadata record on success.
+    '''
     
-    # Parse XML dump into a pyCSW metadata record
+    global pycsw_context
+
+    if not repo:
+        repo = get_repo()
+
+    if direct is None:
+        direct = direct_mapping
+    mapper = pycsw_mapper.mapper_for(obj) if direct else None
 
     record = None
-    try:
-        record = pycsw.metadata.parse_record(pycsw_context, xmldata, repo)[0]
-    except Exception as err:
-        log1.error('Cannot extract metadata for %s: %s' % (pkg_id, err))
+    if mapper:
+        # Map metadata object into a pyCSW metadata record
+        try:
+            record = mapper.populate(repo.dataset(), pycsw_context, site_url)
+        except Exception as err:
+            log1.error('Cannot map metadata for %s: %s' % (pkg_id, err))
+        else:
+            log1.debug('Mapped metadata for dataset %s' % (pkg_id))
     else:
-        log1.debug('Extracted metadata for dataset %s' % (pkg_id))
+        # Generate an XML dump for current pkg-dict
+        xser = xml_serializer_for(obj)
+        xser.target_namespace = site_url 
+        xmldata = xser.to_xml()
+        
+        # Parse XML dump into a pyCSW metadata record
+        try:
+            record = pycsw.metadata.parse_record(pycsw_context, xmldata, repo)[0]
+        except Exception as err:
+            log1.error('Cannot extract metadata for %s: %s' % (pkg_id, err))
+        else:
+            log1.debug('Extracted metadata for dataset %s' % (pkg_id))
 
     # Note The following should always hold true when #13 is resolved, and
     # identifier is linked to package.id at validation phase.
@@ -8,9 +8,11 @@ from .csw_record import post_setup as csw_post_setup
 from .csw_record import pre_cleanup as csw_pre_cleanup
 from .resource_ingest import ResourceIngest
 from .package_translation import PackageTranslation
+from .package_translation import post_setup as package_translation_post_setup
 
 def post_setup(engine):
     csw_post_setup(engine)
+    package_translation_post_setup(engine)
 
 def pre_cleanup(engine):
     csw_pre_cleanup(engine)
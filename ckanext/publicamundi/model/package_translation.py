@@ -1,3 +1,4 @@
+import logging
 from sqlalchemy import Table, Column
 from sqlalchemy import types 
 from sqlalchemy import ForeignKey, UniqueConstraint, Index
@@ -7,6 +8,8 @@ from ckanext.publicamundi.model import Base
 
 from ckanext.publicamundi.lib import languages
 
+log1 = logging.getLogger(__name__)
+
 language_codes = languages.get_all('iso-639-1').keys()
 Language = types.Enum(*language_codes, name='language_code')
 
@@ -23,6 +26,7 @@ class PackageTranslation(Base):
         Column('value', types.UnicodeText()),
         Column('state', TranslationState, default='active'),
         Index('ix_package_translation_package_key', 'package_id', 'key'),
+        Index('ix_package_translation_package_language_key_state', 'package_id', 'language', 'key', 'state'),
         UniqueConstraint('package_id', 'source_language', 'language', 'key'),
     )
 
@@ -37,4 +41,20 @@ class PackageTranslation(Base):
     def __repr__(self):
         return '<PackageTranslation package=%s key=%s language=%s>' % (
             self.package_id, self.key, self.language)
-        
+
+def post_setup(engine):
+    '''Create indexes missing from an existing table (create_all only creates 
+    indexes along with new tables).
+    '''
+    from sqlalchemy.engine.reflection import Inspector
+    
+    table = PackageTranslation.__table__
+    
+    inspector = Inspector.from_engine(engine)
+    if not table.name in inspector.get_table_names():
+        return
+    existing_names = set(ix['name'] for ix in inspector.get_indexes(table.name))
+    for index in table.indexes:
+        if not index.name in existing_names:
+            index.create(bind=engine)
+            log1.info('Created index %s on %s', index.name, table.name)
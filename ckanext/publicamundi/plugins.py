@@ -20,6 +20,8 @@ import ckanext.publicamundi.lib.actions as ext_actions
 import ckanext.publicamundi.lib.template_helpers as ext_template_helpers
 import ckanext.publicamundi.lib.languages as ext_languages
 import ckanext.publicamundi.lib.pycsw_sync as ext_pycsw_sync
+import ckanext.publicamundi.lib.pycsw_queue as ext_pycsw_queue
+import ckanext.publicamundi.lib.metadata_cache as ext_metadata_cache
 
 from ckanext.publicamundi.lib.metadata import class_for_metadata
 from ckanext.publicamundi.lib.util import (to_json, random_name)
@@ -52,6 +54,8 @@ class DatasetForm(p.SingletonPlugin, toolkit.DefaultDatasetForm):
 
     _extra_fields = None
     
+    _cache_metadata = True
+    
     ## Define helper methods ## 
 
     @classmethod
@@ -131,6 +135,11 @@ class DatasetForm(p.SingletonPlugin, toolkit.DefaultDatasetForm):
 
         cls._extra_fields = aslist(config.get('ckanext.publicamundi.extra_fields', ''))
 
+        # Decide if metadata objects (built for a package revision) are cached
+        
+        cls._cache_metadata = asbool(
+            config.get('ckanext.publicamundi.cache_metadata_objects', True))
+
         # Modify the pattern for valid names for {package, groups, organizations}
         
         if asbool(config.get('ckanext.publicamundi.validation.relax_name_pattern')):
@@ -257,6 +266,9 @@ class DatasetForm(p.SingletonPlugin, toolkit.DefaultDatasetForm):
             'dataset_export': ext_actions.package.dataset_export,
             'dataset_import': ext_actions.package.dataset_import,
             'dataset_export_dcat': ext_actions.package.dataset_export_dcat,
+            'dataset_export_catalog': ext_actions.package.dataset_export_catalog,
+            'memoizer_info': ext_actions.cache.memoizer_info,
+            'memoizer_clear': ext_actions.cache.memoizer_clear,
             'group_list_authz': ext_actions.group.group_list_authz,
         }
     
@@ -269,6 +281,8 @@ class DatasetForm(p.SingletonPlugin, toolkit.DefaultDatasetForm):
             # Relax the required conditions for adding to (thematic) groups    
             'member_create': ext_actions.group.member_create_check_authorized,
             'member_delete': ext_actions.group.member_delete_check_authorized,
+            'memoizer_info': ext_actions.cache.memoizer_info_check_authorized,
+            'memoizer_clear': ext_actions.cache.memoizer_clear_check_authorized,
         }
         return funcs
 
@@ -453,6 +467,12 @@ class DatasetForm(p.SingletonPlugin, toolkit.DefaultDatasetForm):
 
     def after_update(self, context, pkg_dict):
         log1.debug('after_update: Package %s is updated', pkg_dict.get('name'))
+        ext_metadata_cache.invalidate(pkg_dict['id'])
+        pass
+    
+    def after_delete(self, context, pkg_dict):
+        log1.debug('after_delete: Package %s is deleted', pkg_dict.get('id'))
+        ext_metadata_cache.invalidate(pkg_dict['id'])
         pass
 
     def after_show(self, context, pkg_dict, view=None):
@@ -496,19 +516,23 @@ class DatasetForm(p.SingletonPlugin, toolkit.DefaultDatasetForm):
         # Note Do not attempt to pop() flat keys here (e.g. to replace them by a 
         # nested structure), because resource forms will clear all extra fields !!
 
-        # Turn to an object
+        # Provide a different view, if not editing
         
-        md = class_for_metadata(dtype).from_converted_data(pkg_dict)
+        if for_edit or not callable(view):
+            view = None
 
-        # Provide a different view, if not editing
+        # Reuse metadata built for this revision (if cached), or build it.
+        # Note Cached objects are shared among requests, so a package prepared
+        # for edit always gets an object of its own (never cached)
         
-        if (not for_edit) and view and callable(view):
-            try:
-                md = view(md)
-            except Exception as ex:
-                log1.warn('Cannot build view %r for package %r: %s',
-                    view, pkg_dict.get('name'), str(ex))
-                pass # noop: keep the original view
+        variant = None if for_edit else self._metadata_cache_variant(view, return_json)
+        md = ext_metadata_cache.get(pkg_dict, variant) if variant else None
+        if md is None:
+            md, is_complete = self._build_metadata(pkg_dict, view, return_json)
+            if variant and is_complete:
+                ext_metadata_cache.put(pkg_dict, variant, md)
+        elif view:
+            view.restore(pkg_dict)
         
         pkg_dict[key_prefix] = md
         
@@ -519,10 +543,52 @@ class DatasetForm(p.SingletonPlugin, toolkit.DefaultDatasetForm):
             key_prefix_1 = key_prefix + '.'
             for k in (y for y in pkg_dict.keys() if y.startswith(key_prefix_1)):
                 pkg_dict.pop(k)
-            pkg_dict[key_prefix] = md.to_json(return_string=False)
          
         return pkg_dict
     
+    def _build_metadata(self, pkg_dict, view=None, return_json=False):
+        '''Build the metadata object for a package (or its json-friendly dict).
+        
+        Return a pair of (result, is-complete), where is-complete indicates if
+        the requested view was successfully applied.
+        '''
+        
+        dtype = pkg_dict['dataset_type']
+        md = class_for_metadata(dtype).from_converted_data(pkg_dict)
+        
+        is_complete = True
+        if view:
+            try:
+                md = view(md)
+            except Exception as ex:
+                log1.warn('Cannot build view %r for package %r: %s',
+                    view, pkg_dict.get('name'), str(ex))
+                is_complete = False # noop: keep the original view
+        
+        if return_json:
+            md = md.to_json(return_string=False)
+        
+        return md, is_complete
+
+    def _metadata_cache_variant(self, view=None, return_json=False):
+        '''Name the variant of metadata to be cached (None if not cacheable).
+        
+        A view is cacheable only if it names itself (a `cache_key` attribute), and 
+        can be restored (a `restore` method) when its result is taken from cache.
+        '''
+        
+        if not self._cache_metadata:
+            return None
+        
+        if view:
+            variant = getattr(view, 'cache_key', None)
+            if not (variant and hasattr(view, 'restore')):
+                return None
+        else:
+            variant = 'object'
+        
+        return (variant + '.json') if return_json else variant
+
     after_show._api_show_actions = {
         'package_show', 'dataset_show', 'user_show'
     }
@@ -630,6 +696,8 @@ class PackageController(p.SingletonPlugin):
 
     p.implements(p.IConfigurable, inherit=True)
     p.implements(p.IPackageController, inherit=True)
+    p.implements(p.IActions, inherit=True)
+    p.implements(p.IAuthFunctions, inherit=True)
     
     csw_output_schemata = {
         'dc': 'http://www.opengis.net/cat/csw/2.0.2',
@@ -641,6 +709,7 @@ class PackageController(p.SingletonPlugin):
    
     _pycsw_config_file = None
     _pycsw_service_endpoint = None
+    _pycsw_sync_async = True
 
     ## IConfigurable interface ##
 
@@ -658,10 +727,38 @@ class PackageController(p.SingletonPlugin):
             'ckanext.publicamundi.pycsw.service_endpoint', 
             '%s/csw' % (site_url.rstrip('/')))
         
-        ext_pycsw_sync.setup(site_url, self._pycsw_config_file)
+        ext_pycsw_sync.setup(site_url, self._pycsw_config_file,
+            use_direct_mapping=asbool(config.get(
+                'ckanext.publicamundi.pycsw.direct_mapping', True)))
+        
+        # Decide if CSW records are synced in the background (see pycsw_queue)
+
+        cls._pycsw_sync_async = asbool(
+            config.get('ckanext.publicamundi.pycsw.sync_async', True))
+        ext_pycsw_queue.setup(
+            batch_size=int(config.get(
+                'ckanext.publicamundi.pycsw.sync_batch_size', 
+                ext_pycsw_queue.DEFAULT_BATCH_SIZE)),
+            delay=float(config.get(
+                'ckanext.publicamundi.pycsw.sync_delay', 
+                ext_pycsw_queue.DEFAULT_DELAY)))
 
         return
 
+    ## IActions interface ##
+
+    def get_actions(self):
+        return {
+            'pycsw_sync_status': ext_actions.csw.pycsw_sync_status,
+        }
+    
+    ## IAuthFunctions interface ##
+    
+    def get_auth_functions(self):
+        return {
+            'pycsw_sync_status': ext_actions.csw.pycsw_sync_status_check_authorized,
+        }
+
     ## IPackageController interface ##
 
     def after_create(self, context, pkg_dict):
@@ -850,6 +947,11 @@ class PackageController(p.SingletonPlugin):
             log1.info(
                 'Skipped sync of non-active dataset %s to CSW record' % (pkg_id))
             return
+        
+        if self._pycsw_sync_async:
+            ext_pycsw_queue.put_update(pkg_dict)
+            log1.debug('Queued sync of dataset %s to CSW record', pkg_id)
+            return
 
         record = ext_pycsw_sync.create_or_update_record(session, pkg_dict)
         if record: 
@@ -861,6 +963,12 @@ class PackageController(p.SingletonPlugin):
 
     def _delete_csw_record(self, session, pkg_dict):
         '''Delete CSW record'''
+        
+        if self._pycsw_sync_async:
+            ext_pycsw_queue.put_delete(pkg_dict['id'])
+            log1.debug('Queued delete of CSW record for dataset %s', pkg_dict['id'])
+            return
+
         record = ext_pycsw_sync.delete_record(session, pkg_dict)
         if record:
             log1.info('Deleted CswRecord for dataset %s', pkg_dict['id'])  
@@ -957,39 +1065,40 @@ class MultilingualDatasetForm(DatasetForm):
         '''Try to replace displayed fields with their translations (if any).
         '''
         
-        from ckanext.publicamundi.lib.metadata import fields, bound_field
-        from ckanext.publicamundi.lib.metadata import class_for_metadata, translator_for
+        from ckanext.publicamundi.lib.metadata import translations_for_packages
         
-        uf = fields.TextField()
         lang = self.target_language()
+        keys = ('title', 'notes')
 
-        for pkg in search_results['results']:
-            source_lang = pkg.get('language')
-            if not source_lang or (source_lang == lang):
-                continue # no need to translate
-            dtype = pkg['dataset_type']
-            md = class_for_metadata(dtype)(identifier=pkg['id']) 
-            translator = translator_for(md, source_lang)
-            # Lookup translations in the context of this package
-            translated = False
-            for k in ('title', 'notes'):
-                tr = translator.get_field_translator(bound_field(uf, (k,), pkg[k]))
-                yf = tr.get(lang) if tr else None
-                if yf:
-                    pkg[k] = yf.context.value
-                    translated = True
-            # If at least one translation was found, mark as translated
-            if translated:
-                pkg['translated_to_language'] = lang
+        pkgs = [pkg for pkg in search_results['results']
+            if pkg.get('language') and (pkg['language'] != lang)]
+        if not pkgs:
+            return search_results # no need to translate
+        
+        # Lookup translations for all packages (in the context of each package)
+        
+        translations = translations_for_packages(pkgs, keys, lang)
+        
+        for pkg in pkgs:
+            translated = translations.get(pkg['id'])
+            if not translated:
+                continue
+            for k in keys:
+                if translated.get(k):
+                    pkg[k] = translated[k]
+            # At least one translation was found, mark as translated
+            pkg['translated_to_language'] = lang
         
         return search_results
 
     def after_update(self, context, pkg_dict):
+        super(MultilingualDatasetForm, self).after_update(context, pkg_dict)
         log1.info('Discard translations for modified keys of package %s', pkg_dict['name'])
         # Todo: Discard translations for modified keys 
         pass
     
     def after_delete(self, context, pkg_dict):
+        super(MultilingualDatasetForm, self).after_delete(context, pkg_dict)
         log1.info('Cleaning up translations for package %s', pkg_dict['id'])
         # Todo: Cleanup translations
         pass
@@ -1122,6 +1231,10 @@ class MultilingualDatasetForm(DatasetForm):
             self.language = language
             self.translator = None
             
+        @property
+        def cache_key(self):
+            return 'translated:%s:%s' % (self.source_language, self.language)
+
         def __call__(self, md):
             assert self.translator is None, 'Expected to be called once!'
             self.translator = ext_metadata.translator_for(md, self.source_language)
@@ -1131,6 +1244,12 @@ class MultilingualDatasetForm(DatasetForm):
                 self.translator = False # is unusable
                 raise
             return result
+        
+        def restore(self, pkg_dict):
+            '''Prepare a translator, when the translated result is taken from cache'''
+            assert self.translator is None, 'Expected to be called once!'
+            md = class_for_metadata(pkg_dict['dataset_type'])(identifier=pkg_dict['id'])
+            self.translator = ext_metadata.translator_for(md, self.source_language)
     
     def target_language(self):
         '''Determine the target language for metadata.
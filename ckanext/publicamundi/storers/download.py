@@ -0,0 +1,318 @@
+'''A download stage shared by the vector and raster storers.
+
+Resources are streamed to disk in fixed-size chunks, so that a download
+never needs memory proportional to the size of a resource. A download is
+first written to a partial (.part) file which is kept if the transfer is
+interrupted, so that a retried task (even on a restarted worker) resumes
+it with an HTTP Range request. The validator (ETag or Last-Modified) of the
+first response is kept next to the partial file and sent as If-Range, so
+that a resource updated in the meantime is downloaded anew (rather than
+appended to the stale bytes).
+
+A completed download is verified against the size and the hash (if any)
+recorded for the resource. These are only enforced for uploads (whose size
+is recorded by CKAN itself); for links, a mismatch is logged as a warning,
+as the recorded values may be stale or entered by hand.
+
+Uploaded resources are read straight from CKAN's storage folder (when it
+is reachable from the worker), instead of being fetched over HTTP.
+'''
+
+import os
+import errno
+import shutil
+import socket
+import hashlib
+import httplib
+import urllib2
+import logging
+
+log = logging.getLogger(__name__)
+
+# Size of chunks read from the network (or from the storage folder)
+CHUNK_SIZE = 1024 * 1024
+
+# Number of attempts to complete an interrupted download
+MAX_ATTEMPTS = 3
+
+# Hash algorithms recognized in a resource's hash (and their digest sizes)
+HASH_ALGORITHMS = {
+    'md5': 32,
+    'sha1': 40,
+    'sha256': 64,
+    'sha512': 128,
+}
+
+PARTIAL_SUFFIX = '.part'
+
+VALIDATOR_SUFFIX = '.validator'
+
+
+class DownloadError(RuntimeError):
+    pass
+
+
+def download_resource(resource_dict, path, api_key=None, storage_path=None):
+    '''Download (or copy) the file of a resource into path.
+
+    If the resource is an upload, and storage_path (i.e. ckan.storage_path)
+    is given and holds the uploaded file, the file is copied from there.
+    Otherwise, the file is downloaded from the resource URL (authenticated
+    with api_key, for uploads).
+
+    Raises DownloadError if the file cannot be retrieved or if it fails
+    to be verified.
+    '''
+    is_upload = resource_dict.get('url_type', '') == 'upload'
+    expected_size = _get_expected_size(resource_dict)
+    expected_hash = _parse_hash(resource_dict.get('hash'))
+
+    _makedirs(os.path.dirname(path))
+
+    if is_upload and storage_path:
+        upload_path = get_upload_path(storage_path, resource_dict['id'])
+        if os.path.isfile(upload_path):
+            log.info('Copying resource %s from %s' % (
+                resource_dict['id'], upload_path))
+            _copy_file(upload_path, path)
+            _verify(path, expected_size, expected_hash)
+            return path
+
+    resource_url = urllib2.unquote(resource_dict['url'])
+    headers = {}
+    if is_upload and api_key:
+        headers['Authorization'] = api_key
+
+    download_file(
+        resource_url, path, headers, expected_size, expected_hash,
+        strict=is_upload)
+    return path
+
+
+def download_file(
+        url, path, headers=None, expected_size=None, expected_hash=None,
+        strict=True):
+    '''Download url into path, resuming a previous partial download (if any).
+
+    The expected_hash (if given) is an (algorithm, hexdigest) pair. If strict
+    is false, a size or hash mismatch is only logged (see _verify).
+    '''
+    partial_path = path + PARTIAL_SUFFIX
+
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            completed = _fetch(url, partial_path, headers or {})
+        except urllib2.HTTPError as ex:
+            if ex.code == httplib.REQUESTED_RANGE_NOT_SATISFIABLE and \
+                    os.path.exists(partial_path):
+                # The partial file is stale (or complete): start over
+                _remove_partial(partial_path)
+                continue
+            try:
+                detail = ex.read(128)
+            except IOError:
+                detail = 'n/a'
+            _remove_partial(partial_path)
+            raise DownloadError(
+                'Failed to download %s: %s: %s' % (url, ex, detail))
+        except (urllib2.URLError, httplib.HTTPException, socket.error) as ex:
+            # Keep the partial file, so that a later attempt resumes from it
+            if attempt >= MAX_ATTEMPTS:
+                raise DownloadError(
+                    'Failed to download %s: %s' % (url, ex))
+            log.warning('Download of %s was interrupted (%s), resuming' % (
+                url, ex))
+            continue
+        if completed:
+            break
+        if attempt >= MAX_ATTEMPTS:
+            raise DownloadError(
+                'Failed to download %s: transfer was incomplete' % (url))
+
+    try:
+        _verify(partial_path, expected_size, expected_hash, strict)
+    except DownloadError:
+        _remove_partial(partial_path)
+        raise
+    os.rename(partial_path, path)
+    _remove_quietly(partial_path + VALIDATOR_SUFFIX)
+
+
+def get_upload_path(storage_path, resource_id):
+    '''Returns the path of an uploaded resource under CKAN's storage folder
+    (as laid out by ckan.lib.uploader.ResourceUpload).'''
+    return os.path.join(
+        storage_path, 'resources',
+        resource_id[0:3], resource_id[3:6], resource_id[6:])
+
+#
+# Helpers
+#
+
+def _fetch(url, partial_path, headers):
+    '''Fetch (the rest of) url into partial_path. Returns True if the transfer
+    completed, i.e. the advertised length was received.'''
+    offset = 0
+    validator = None
+    if os.path.exists(partial_path):
+        offset = os.path.getsize(partial_path)
+        validator = _read_validator(partial_path)
+        if offset > 0 and not validator:
+            # Cannot tell if the partial file is still current: start over
+            log.info('Cannot resume download of %s: no validator' % (url))
+            offset = 0
+
+    request = urllib2.Request(url)
+    for name, value in headers.items():
+        request.add_header(name, value)
+    if offset > 0:
+        request.add_header('Range', 'bytes=%d-' % (offset))
+        request.add_header('If-Range', validator)
+
+    response = urllib2.urlopen(request)
+    try:
+        if offset > 0 and response.getcode() == httplib.PARTIAL_CONTENT:
+            if _get_validator(response.info()) not in (None, validator):
+                # The server ignored If-Range, and the resource has changed
+                log.info('Resource %s has changed, restarting download' % (
+                    url))
+                response.close()
+                _remove_partial(partial_path)
+                return _fetch(url, partial_path, headers)
+            mode = 'ab'
+            log.info('Resuming download of %s at byte %d' % (url, offset))
+        else:
+            # The server ignored the range (or the resource has changed,
+            # see If-Range): start over
+            mode = 'wb'
+            offset = 0
+            _write_validator(partial_path, _get_validator(response.info()))
+
+        content_length = response.info().getheader('Content-Length')
+        expected_length = int(content_length) if content_length else None
+
+        received = 0
+        with open(partial_path, mode) as ofp:
+            data = response.read(CHUNK_SIZE)
+            while data:
+                ofp.write(data)
+                received += len(data)
+                data = response.read(CHUNK_SIZE)
+    finally:
+        response.close()
+
+    return expected_length is None or received >= expected_length
+
+def _verify(path, expected_size, expected_hash, strict=True):
+    '''Verify the size and hash of a downloaded file. A mismatch raises
+    DownloadError if strict, otherwise it is logged as a warning.'''
+    size = os.path.getsize(path)
+    if expected_size is not None and size != expected_size:
+        _mismatch(strict,
+            'Size mismatch for %s: expected %d bytes, got %d' % (
+                path, expected_size, size))
+
+    if expected_hash:
+        algorithm, expected_digest = expected_hash
+        h = hashlib.new(algorithm)
+        with open(path, 'rb') as ifp:
+            data = ifp.read(CHUNK_SIZE)
+            while data:
+                h.update(data)
+                data = ifp.read(CHUNK_SIZE)
+        if h.hexdigest() != expected_digest:
+            _mismatch(strict,
+                'Checksum mismatch for %s: expected %s %s, got %s' % (
+                    path, algorithm, expected_digest, h.hexdigest()))
+
+def _mismatch(strict, message):
+    if strict:
+        raise DownloadError(message)
+    log.warning(message)
+
+def _get_validator(headers):
+    '''Returns the validator of a response, i.e. its ETag (if strong) or else
+    its Last-Modified date, as accepted by If-Range. Returns None if missing.
+    '''
+    etag = headers.getheader('ETag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return headers.getheader('Last-Modified') or None
+
+def _read_validator(partial_path):
+    try:
+        with open(partial_path + VALIDATOR_SUFFIX, 'r') as ifp:
+            return ifp.read().strip() or None
+    except IOError:
+        return None
+
+def _write_validator(partial_path, validator):
+    validator_path = partial_path + VALIDATOR_SUFFIX
+    if validator:
+        with open(validator_path, 'w') as ofp:
+            ofp.write(validator)
+    else:
+        _remove_quietly(validator_path)
+
+def _get_expected_size(resource_dict):
+    try:
+        size = int(resource_dict.get('size'))
+    except (TypeError, ValueError):
+        return None
+    return size if size > 0 else None
+
+def _parse_hash(value):
+    '''Parse a resource hash, either as "<algorithm>:<hexdigest>" or as a bare
+    hex digest (whose algorithm is guessed from its length).
+
+    Returns an (algorithm, hexdigest) pair, or None if not recognized.
+    '''
+    if not value or not isinstance(value, basestring):
+        return None
+    value = value.strip().lower()
+    if ':' in value:
+        algorithm, digest = value.split(':', 1)
+        algorithm = algorithm.replace('-', '')
+    else:
+        digest = value
+        algorithm = None
+        for name, digest_size in HASH_ALGORITHMS.items():
+            if len(digest) == digest_size:
+                algorithm = name
+    if HASH_ALGORITHMS.get(algorithm) != len(digest):
+        return None
+    try:
+        int(digest, 16)
+    except ValueError:
+        return None
+    return algorithm, digest
+
+def _copy_file(source, target):
+    # Prefer a hard link (no copy at all), fall back to a chunked copy
+    _remove_quietly(target)
+    try:
+        os.link(source, target)
+        return
+    except OSError:
+        pass
+    with open(source, 'rb') as ifp, open(target, 'wb') as ofp:
+        shutil.copyfileobj(ifp, ofp, CHUNK_SIZE)
+
+def _remove_partial(partial_path):
+    _remove_quietly(partial_path)
+    _remove_quietly(partial_path + VALIDATOR_SUFFIX)
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def _makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError as ex:
+        if ex.errno != errno.EEXIST:
+            raise
@@ -16,6 +16,8 @@ import wcst
 
 from gdal_to_gml import GDALToGmlConverter
 
+from ckanext.publicamundi.storers import download
+
 
 log = logging.getLogger(__name__)
 
@@ -36,6 +38,7 @@ class RasterUtil:
         self.resource_dict = context['resource_dict']
         self.api_key = context['user_api_key'].strip(' \t\n\r')
         self.site_url = context['site_url'].strip(' \t\n\r')
+        self.storage_path = context.get('storage_path')
         self.coverage_id = self.resource_id_to_coverage_id()
         self.resource_temp_folder, self.resource_path, self.url_component = self.get_path_to_resource_files()
         self.gml_path = self.get_path_to_gml_file()
@@ -54,34 +57,12 @@ class RasterUtil:
                                                                                             self.resource_dict['url'],
                                                                                             self.resource_path))
 
-        resource_url = urllib2.unquote(self.resource_dict['url'])
-        is_upload = self.resource_dict.get('url_type', '') == 'upload'
-        # Prepare download request
-
-        download_request = urllib2.Request(resource_url)
-        if is_upload:
-            download_request.add_header('Authorization', self.api_key)
-
-        # Perform request, handle errors
         try:
-            download_response = urllib2.urlopen(download_request)
-        except urllib2.HTTPError as ex:
+            download.download_resource(
+                self.resource_dict, self.resource_path, self.api_key, self.storage_path)
+        except download.DownloadError as ex:
             self.delete_temp()
-            try:
-                detail = ex.read(128)
-            except IOError as ex:
-                detail = 'n/a'
-            raise CannotDownload(
-                'Failed to download %s: %s: %s' % (resource_url, ex, detail))
-        except urllib2.URLError as ex:
-            self.delete_temp()
-            raise CannotDownload(
-                'Failed to download %s: %s' % (resource_url, ex))
-
-        # Save downloaded resource in a local file
-        with open(self.resource_path, 'wb') as ofp:
-            ofp.write(download_response.read())
-            ofp.close()
+            raise CannotDownload(str(ex))
         self.log.info("[Raster_DownloadResource] Success!")
 
     def delete_temp(self):
@@ -51,7 +51,9 @@ def _make_default_context():
         'wms_base_url': config.get("ckanext.publicamundi.rasterstorer.wms_base_url", ""),
         'wcst_import_url': config.get("ckanext.publicamundi.rasterstorer.wcst_import_url", ""),
         'wcst_base_url': config.get("ckanext.publicamundi.rasterstorer.wcst_base_url", ""),
-        'gdal_folder': config.get("ckanext.publicamundi.rasterstorer.gdal_folder", "")
+        'gdal_folder': config.get("ckanext.publicamundi.rasterstorer.gdal_folder", ""),
+        # Storage of uploaded resources (if reachable from workers)
+        'storage_path': config.get('ckan.storage_path')
         }
 
 
@@ -1,10 +1,11 @@
 import os
-import zipfile
 import uuid
 import json
 import urlparse
 import shutil
 import urllib2
+import threading
+import logging
 from pylons import config, Response
 
 from ckan.lib.base import (
@@ -13,7 +14,12 @@ import ckan.model as model
 import ckan.plugins.toolkit as toolkit
 
 from ckanext.publicamundi.storers.vector import ogr, osr
+from ckanext.publicamundi.storers.vector.db_helpers import DB
 from ckanext.publicamundi.storers.vector.resources import DBTableResource
+from ckanext.publicamundi.storers.vector.lib import (
+    streaming, export_cache, transform)
+
+log = logging.getLogger(__name__)
 
 _ = toolkit._
 _check_access = toolkit.check_access
@@ -25,6 +31,21 @@ class NotVectorStorerDB(Exception):
     pass
 
 
+class _OGRConnections(threading.local):
+    '''OGR PostgreSQL datasources kept open (per thread) among requests.
+
+    OGR caches the definitions of the layers it has opened, so the OID of
+    each table is recorded and the datasource is re-opened if a table has
+    been re-created since.
+    '''
+
+    def __init__(self):
+        self.datasource = None
+        self.table_oids = {}
+
+_ogr_connections = _OGRConnections()
+
+
 class ExportController(BaseController):
 
     def export(self, id, resource_id, operation):
@@ -44,50 +65,104 @@ class ExportController(BaseController):
         if export_format:
             export_format = export_format.lower()
             export_projection = int(export_projection_param)
-
-            return self._init_export(
-                resource_id,
-                export_format,
-                export_projection)
+            gml_version = request.params.get('gml_version')
+            csv_geometry = request.params.get('csv_geom')
+
+            resource_name = self._get_resource_name(resource_id)
+            if DBTableResource.name_suffix in resource_name:
+                resource_name = resource_name.replace(DBTableResource.name_suffix, '')
+
+            if streaming.is_streamable(export_format, gml_version, csv_geometry):
+                filename = u'%s.%s' % (resource_name, export_format)
+                content_type = streaming.STREAMING_FORMATS[export_format]
+                make_body = lambda: self._stream_export(
+                    resource_id,
+                    resource_name,
+                    export_format,
+                    export_projection)
+            else:
+                filename = u'%s.zip' % (resource_name)
+                content_type = 'application/zip'
+                make_body = lambda: self._init_export(
+                    resource_id,
+                    resource_name,
+                    export_format,
+                    export_projection)
+
+            cache = _get_export_cache()
+            if cache:
+                marker = self._get_table_marker(resource_id)
+                if marker is None:
+                    abort(404, _('Resource not found'))
+                key = (resource_id, marker, export_format, export_projection, 
+                    gml_version, csv_geometry)
+                body = cache.get(resource_id, key, make_body)
+            else:
+                body = make_body()
+            
+            if body is None:
+                abort(404, _('Resource not found'))
+
+            response.headers['Content-Type'] = content_type
+            response.headers['Content-Disposition'] = (
+                'attachment; filename="%s"' % (filename.encode('utf-8')))
+            if 'Content-Length' in response.headers:
+                del response.headers['Content-Length']
+            return body
         else:
             abort(400, _('No Export Format was defined !'))
 
-    def _init_export(self, resource_id, export_format, export_projection):
+    def _get_table_marker(self, resource_id):
+        db = DB(config.get('ckan.datastore.read_url'))
+        try:
+            return db.get_table_marker(str(resource_id.lower()))
+        finally:
+            db.commit_and_close()
+
+    def _stream_export(
+            self, resource_id, resource_name, export_format, export_projection):
+        '''Stream features straight from the database, encoded in one of the 
+        formats supported by lib.streaming.
+        '''
+        
+        db = DB(config.get('ckan.datastore.read_url'))
+        table_name = str(resource_id.lower())
+        if not db.check_if_table_exists(table_name):
+            db.commit_and_close()
+            return None
+        
+        stream = streaming.FeatureStream(
+            db,
+            table_name,
+            resource_name,
+            export_format,
+            export_projection,
+            gml_version=request.params.get('gml_version'),
+            csv_geometry=request.params.get('csv_geom'))
+        return iter(stream)
+
+    def _init_export(
+            self, resource_id, resource_name, export_format, export_projection):
 
-        postgis_layer, connection = self._get_layer(resource_id)
+        postgis_layer = self._get_layer(resource_id)
 
         if postgis_layer is None:
             return None
+        # The layer may have been read by a previous export
+        postgis_layer.ResetReading()
 
         # Set up the export GDAL driver
 
         tmp_folder = self._create_temp_export_folder()
 
-        resource_name = self._get_resource_name(resource_id)
-        if DBTableResource.name_suffix in resource_name:
-            resource_name = resource_name.replace(DBTableResource.name_suffix, '')
-
         export_datasource, export_layer = self._create_export_datasource(
             tmp_folder, resource_name, export_format, export_projection,
             postgis_layer.GetGeomType())
 
         postgis_srs = self._get_SRS(postgis_layer)
 
-        coordTrans = None
-
-        if not export_projection == postgis_srs:
-            # input SpatialReference
-            inSpatialRef = osr.SpatialReference()
-            inSpatialRef.ImportFromEPSG(postgis_srs)
-
-            # output SpatialReference
-            outSpatialRef = osr.SpatialReference()
-            outSpatialRef.ImportFromEPSG(export_projection)
-
-            # create the CoordinateTransformation
-            coordTrans = osr.CoordinateTransformation(
-                inSpatialRef,
-                outSpatialRef)
+        coordTrans = transform.get_transformation(
+            postgis_srs, export_projection)
 
         postgislyrDefn = postgis_layer.GetLayerDefn()
 
@@ -130,16 +205,7 @@ class ExportController(BaseController):
 
         export_datasource.Destroy()
 
-        file_path = self._create_zip(tmp_folder)
-
-        connection.Destroy()
-
-        shutil.rmtree(tmp_folder)
-
-        resp = self._send_file_response(file_path, resource_name)
-        #os.remove(file_path) Needs Fix to delete files
-
-        return resp
+        return self._zip_folder(tmp_folder)
 
     def _get_SRS(self, layer):
         default_epsg = 4326
@@ -158,23 +224,56 @@ class ExportController(BaseController):
             return default_epsg
 
     def _get_layer(self, resource_id):
-
-        datastore_config = urlparse.urlparse(
-            config.get('ckan.datastore.read_url'))
-        databaseServer = datastore_config.hostname
-        databaseName = datastore_config.path[1:]
-        databaseUser = datastore_config.username
-        databasePW = datastore_config.password
-        connString = "PG: host=%s dbname=%s user=%s password=%s" % (
-            databaseServer, databaseName, databaseUser, databasePW)
-
         layer_name = str(resource_id.lower())
+        
+        db = DB(config.get('ckan.datastore.read_url'))
+        try:
+            table_oid = db.get_table_oid(layer_name)
+        finally:
+            db.commit_and_close()
+        if table_oid is None:
+            return None
 
-        conn = ogr.Open(connString)
-
-        layer = conn.GetLayer(layer_name)
-
-        return layer, conn
+        conn = _ogr_connections.datasource
+        known_oid = _ogr_connections.table_oids.get(layer_name)
+        if conn is not None and known_oid not in (None, table_oid):
+            conn = None
+        if conn is not None and not self._check_ogr_connection(conn):
+            conn = None
+        
+        if conn is None:
+            datastore_config = urlparse.urlparse(
+                config.get('ckan.datastore.read_url'))
+            databaseServer = datastore_config.hostname
+            databaseName = datastore_config.path[1:]
+            databaseUser = datastore_config.username
+            databasePW = datastore_config.password
+            connString = "PG: host=%s dbname=%s user=%s password=%s" % (
+                databaseServer, databaseName, databaseUser, databasePW)
+            if datastore_config.port:
+                connString += " port=%s" % (datastore_config.port)
+            
+            old_conn = _ogr_connections.datasource
+            _ogr_connections.datasource = None
+            _ogr_connections.table_oids = {}
+            if old_conn is not None:
+                old_conn.Destroy()
+            conn = ogr.Open(connString)
+            _ogr_connections.datasource = conn
+
+        _ogr_connections.table_oids[layer_name] = table_oid
+        return conn.GetLayerByName(layer_name)
+
+    def _check_ogr_connection(self, conn):
+        try:
+            result = conn.ExecuteSQL('SELECT 1')
+        except RuntimeError as ex:
+            log.warning('Discarding broken OGR connection: %s' % (ex))
+            return False
+        if result is None:
+            return False
+        conn.ReleaseResultSet(result)
+        return True
 
     def _create_temp_export_folder(self):
         random_folder_name = str(uuid.uuid4())
@@ -206,8 +305,7 @@ class ExportController(BaseController):
             options=datasource_options)
 
         # Create the spatial reference
-        srs = osr.SpatialReference()
-        srs.ImportFromEPSG(export_projection)
+        srs = transform.get_srs(export_projection)
 
         # Create the layer
         layer_options = self._get_layer_options(GDAL_Driver)
@@ -218,20 +316,6 @@ class ExportController(BaseController):
             options=layer_options)
         return data_source, layer
 
-    def _create_zip(self, src):
-        zip_path = "%s.zip" % (src)
-        zf = zipfile.ZipFile(zip_path, "w")
-
-        abs_src = os.path.abspath(src)
-
-        for files in os.listdir(src):
-            absname = os.path.abspath(os.path.join(abs_src, files))
-            arcname = absname[len(abs_src) + 1:]
-
-            zf.write(absname, arcname)
-        zf.close()
-        return zip_path
-
     def _get_GDAL_Driver_by_export_format(self, export_format):
 
         if export_format == "shp":
@@ -270,25 +354,19 @@ class ExportController(BaseController):
         else:
             return []
 
-    def _send_file_response(self, filepath, resource_name):
-        user_filename = '_'.join(filepath.split('/')[-2:])
-        file_size = os.path.getsize(filepath)
-
-        headers = [
-            ('Content-Disposition',
-             'attachment; filename=\"'+str(resource_name)+'.zip\"'),
-            ('Content-Type',
-             'text/html'),
-            ('Content-Length',
-             str(file_size))]
+    def _zip_folder(self, src):
+        '''Zip the files under folder src, while being sent. The folder is 
+        removed once the zip archive is complete.
+        '''
+        abs_src = os.path.abspath(src)
+        files = []
+        for name in sorted(os.listdir(abs_src)):
+            files.append((os.path.join(abs_src, name), name))
 
-        from paste.fileapp import FileApp
+        def cleanup():
+            shutil.rmtree(abs_src, ignore_errors=True)
 
-        fapp = FileApp(filepath, headers=headers)
-        status, headers, app_it = request.call_application(fapp)
-        response.headers = headers
-        response.status = status
-        return app_it
+        return iter(streaming.ZipStream(files, cleanup=cleanup))
 
     def _get_gdal_driver_list(self):
         gdal_drvs = []
@@ -333,3 +411,17 @@ class ExportController(BaseController):
             abort(404, _('Resource not found'))
         except NotAuthorized:
             abort(401, _('Unauthorized to read resource %s') % id)
+
+
+_export_cache = None
+
+def _get_export_cache():
+    '''Returns the (process-wide) export cache, or None if disabled'''
+    global _export_cache
+    if _export_cache is None:
+        cache_dir, max_size, lock_timeout = export_cache.get_config(config)
+        if not cache_dir:
+            return None
+        _export_cache = export_cache.ExportCache(
+            cache_dir, max_size, lock_timeout)
+    return _export_cache
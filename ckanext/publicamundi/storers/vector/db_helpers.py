@@ -1,23 +1,303 @@
-import psycopg2
+import os
+import time
+import uuid
 import urlparse
+import threading
+import logging
+import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+
+log = logging.getLogger(__name__)
+
+# Default maximum number of connections a process keeps to a database
+DEFAULT_POOL_SIZE = 8
+
+# Default number of seconds to wait for a connection of an exhausted pool
+DEFAULT_POOL_TIMEOUT = 60
+
+# Connections idle for longer than this (in seconds) are checked before reuse
+HEALTH_CHECK_INTERVAL = 30
+
+pool_size = DEFAULT_POOL_SIZE
+
+pool_timeout = DEFAULT_POOL_TIMEOUT
+
+_pools = {}
+
+_pools_lock = threading.Lock()
+
+
+def setup(max_size=None, timeout=None):
+    '''Configure the connection pools of this process.
+
+    Pools already created keep their settings, so this should be called
+    before any connection is made.
+    '''
+    global pool_size, pool_timeout
+
+    if max_size:
+        pool_size = int(max_size)
+    if timeout:
+        pool_timeout = int(timeout)
+
+
+def get_pool(db_conn_params):
+    '''Returns the pool of connections to a database (given as a URL) for
+    the current process.
+
+    A pool is never shared among processes: a (forked) Celery worker that
+    finds a pool created by its parent simply creates a new one.
+    '''
+    with _pools_lock:
+        pool = _pools.get(db_conn_params)
+        if pool is None or pool.pid != os.getpid():
+            pool = ConnectionPool(db_conn_params, pool_size, pool_timeout)
+            _pools[db_conn_params] = pool
+        return pool
+
+
+def get_stats():
+    '''Returns the statistics of all pools of this process, keyed on the
+    database (as host/name).'''
+    with _pools_lock:
+        pools = [p for p in _pools.values() if p.pid == os.getpid()]
+    return dict((p.name, p.get_stats()) for p in pools)
+
+
+class PoolTimeout(psycopg2.pool.PoolError):
+    pass
+
+
+class StatementStats(object):
+    '''Thread-safe counters of executed statements, grouped by the leading
+    SQL keyword (SELECT, INSERT, COPY etc.)'''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def add(self, query, duration, failed=False):
+        verb = _get_statement_verb(query)
+        with self._lock:
+            stats = self._stats.get(verb)
+            if stats is None:
+                stats = self._stats[verb] = {
+                    'count': 0, 'errors': 0, 'total_time': 0.0, 'max_time': 0.0}
+            stats['count'] += 1
+            stats['total_time'] += duration
+            stats['max_time'] = max(stats['max_time'], duration)
+            if failed:
+                stats['errors'] += 1
+
+    def as_dict(self):
+        with self._lock:
+            return dict((verb, dict(stats)) for verb, stats in self._stats.items())
+
+
+class _PooledConnection(psycopg2.extensions.connection):
+    '''A connection that records statement metrics (of its cursors) into
+    the stats of its pool.'''
+
+    statement_stats = None
+
+
+class _MeasuredCursor(psycopg2.extensions.cursor):
+
+    def execute(self, query, params=None):
+        t0 = time.time()
+        failed = True
+        try:
+            result = super(_MeasuredCursor, self).execute(query, params)
+            failed = False
+            return result
+        finally:
+            self._record(query, time.time() - t0, failed)
+
+    def copy_expert(self, sql, f, size=8192):
+        t0 = time.time()
+        failed = True
+        try:
+            result = super(_MeasuredCursor, self).copy_expert(sql, f, size)
+            failed = False
+            return result
+        finally:
+            self._record(sql, time.time() - t0, failed)
+
+    def _record(self, query, duration, failed):
+        stats = getattr(self.connection, 'statement_stats', None)
+        if stats is not None:
+            stats.add(query, duration, failed)
+
+
+class ConnectionPool(object):
+    '''A bounded, thread-safe pool of connections to a database.
+
+    At most max_size connections are open at any time; callers asking for
+    a connection while all of them are in use wait for one to be returned
+    (for up to timeout seconds). Idle connections are checked before being
+    reused, and broken ones are replaced.
+    '''
+
+    def __init__(self, db_conn_params, max_size=DEFAULT_POOL_SIZE,
+            timeout=DEFAULT_POOL_TIMEOUT):
+        result = urlparse.urlparse(db_conn_params)
+        self.connect_params = {
+            'database': result.path[1:],
+            'user': result.username,
+            'password': result.password,
+            'host': result.hostname,
+        }
+        if result.port:
+            self.connect_params['port'] = result.port
+        self.name = '%s/%s' % (result.hostname, result.path[1:])
+        self.max_size = max_size
+        self.timeout = timeout
+        self.pid = os.getpid()
+        self.statement_stats = StatementStats()
+
+        self._cond = threading.Condition()
+        self._idle = []
+        self._size = 0
+        self._counters = {
+            'connects': 0,
+            'checkouts': 0,
+            'waits': 0,
+            'timeouts': 0,
+            'discarded': 0,
+        }
+
+    def getconn(self):
+        '''Check out a (healthy) connection, waiting for one if the pool is
+        exhausted. Raises PoolTimeout if none is available in time.'''
+        deadline = time.time() + self.timeout
+        while True:
+            conn, last_used = self._acquire(deadline)
+            if conn is None:
+                return self._connect()
+            if self._is_healthy(conn, last_used):
+                return conn
+            self._discard(conn)
+
+    def putconn(self, conn, close=False):
+        '''Return a connection to the pool. Any pending transaction is 
+        rolled back.'''
+        if not close and not conn.closed:
+            try:
+                status = conn.get_transaction_status()
+                if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                close = True
+        if close or conn.closed:
+            self._discard(conn)
+            return
+        with self._cond:
+            self._idle.append((conn, time.time()))
+            self._cond.notify()
+
+    def closeall(self):
+        '''Close all idle connections'''
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn, last_used in idle:
+            _close_quietly(conn)
+
+    def get_stats(self):
+        with self._cond:
+            stats = dict(self._counters)
+            stats.update({
+                'max_size': self.max_size,
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+            })
+        stats['statements'] = self.statement_stats.as_dict()
+        return stats
+
+    def _acquire(self, deadline):
+        '''Take an idle connection, or reserve a slot for a new connection
+        (returning None in its place).'''
+        with self._cond:
+            self._counters['checkouts'] += 1
+            waited = False
+            while True:
+                if self._idle:
+                    return self._idle.pop()
+                if self._size < self.max_size:
+                    self._size += 1
+                    return None, None
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    self._counters['timeouts'] += 1
+                    raise PoolTimeout(
+                        'No connection to %s became available in %ss (pool size is %d)' % (
+                            self.name, self.timeout, self.max_size))
+                if not waited:
+                    self._counters['waits'] += 1
+                    waited = True
+                self._cond.wait(remaining)
+
+    def _connect(self):
+        try:
+            conn = psycopg2.connect(
+                connection_factory=_PooledConnection, **self.connect_params)
+        except:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        conn.set_client_encoding('utf_8')
+        conn.cursor_factory = _MeasuredCursor
+        conn.statement_stats = self.statement_stats
+        with self._cond:
+            self._counters['connects'] += 1
+        return conn
+
+    def _is_healthy(self, conn, last_used):
+        if conn.closed:
+            return False
+        if time.time() - last_used < HEALTH_CHECK_INTERVAL:
+            return True
+        try:
+            cursor = conn.cursor()
+            cursor.execute('SELECT 1')
+            cursor.close()
+            conn.rollback()
+        except psycopg2.Error as ex:
+            log.warning('Discarding broken connection to %s: %s' % (self.name, ex))
+            return False
+        return True
+
+    def _discard(self, conn):
+        _close_quietly(conn)
+        with self._cond:
+            self._size -= 1
+            self._counters['discarded'] += 1
+            self._cond.notify()
 
 
 class DB:
 
     def __init__(self, db_conn_params):
-        result = urlparse.urlparse(db_conn_params)
-        user = result.username
-        password = result.password
-        database = result.path[1:]
-        hostname = result.hostname
-        self.conn = psycopg2.connect(
-            database=database,
-            user=user,
-            password=password,
-            host=hostname)
-        self.conn.set_client_encoding('utf_8')
+        self.pool = get_pool(db_conn_params)
+        self.conn = self.pool.getconn()
         self.cursor = self.conn.cursor()
 
+    def iter_query(self, query, params=None, fetch_size=2000):
+        '''Iterate on the rows of a query through a server-side cursor, so
+        that only fetch_size rows are held in memory at a time.'''
+        cursor = self.conn.cursor(name='iter_%s' % (uuid.uuid4().hex))
+        cursor.itersize = fetch_size
+        try:
+            cursor.execute(query, params)
+            for row in cursor:
+                yield row
+        finally:
+            cursor.close()
+
     def check_if_table_exists(self, table_name):
         self.cursor.execute(
             "SELECT * FROM information_schema.tables WHERE table_name='%s'" %
@@ -28,6 +308,27 @@ class DB:
         else:
             return False
 
+    def get_table_marker(self, table_name):
+        '''Returns a marker that changes whenever the contents of a table are
+        modified (or the table is re-created), or None if no such table exists.
+        '''
+        self.cursor.execute(
+            """SELECT c.oid, c.relfilenode, s.n_tup_ins, s.n_tup_upd, s.n_tup_del
+            FROM pg_class c LEFT JOIN pg_stat_user_tables s ON s.relid = c.oid
+            WHERE c.relname = %s AND c.relkind = 'r'""", (table_name,))
+        row = self.cursor.fetchone()
+        if row is None:
+            return None
+        return '-'.join(str(v) for v in row)
+
+    def get_table_oid(self, table_name):
+        '''Returns the OID of a table, or None if no such table exists'''
+        self.cursor.execute(
+            "SELECT oid FROM pg_class WHERE relname = %s AND relkind = 'r'",
+            (table_name,))
+        row = self.cursor.fetchone()
+        return row[0] if row else None
+
     def create_table(
             self,
             table_name,
@@ -64,6 +365,26 @@ class DB:
         except Exception:
             pass
         
+    def copy_to_table(self, table, columns, data):
+        '''Bulk-load rows into a table using COPY ... FROM STDIN.
+
+        The data argument is a file-like object holding the rows in the
+        PostgreSQL text format, for the given list of columns.
+        '''
+        copy = (
+            "COPY \"%s\" (%s) FROM STDIN;" %
+            (table, ','.join('"%s"' % (c) for c in columns)))
+        self.cursor.copy_expert(copy, data)
+
+    def savepoint(self, name):
+        self.cursor.execute("SAVEPOINT %s;" % (name))
+
+    def release_savepoint(self, name):
+        self.cursor.execute("RELEASE SAVEPOINT %s;" % (name))
+
+    def rollback_to_savepoint(self, name):
+        self.cursor.execute("ROLLBACK TO SAVEPOINT %s;" % (name))
+
     def create_spatial_index(self, table):
         indexing = (
             '''CREATE INDEX \"%s_the_geom_idx\"
@@ -71,11 +392,59 @@ class DB:
             % (table, table))
         self.cursor.execute(indexing)
 
+    def update_serial(self, table):
+        '''Move the sequence behind the _id column past the loaded rows.'''
+        self.cursor.execute(
+            "SELECT setval(pg_get_serial_sequence('\"%s\"', '_id'), "
+            "COALESCE(MAX(_id), 0) + 1, false) FROM \"%s\";" %
+            (table, table))
+
+    def analyze_table(self, table):
+        self.cursor.execute("ANALYZE \"%s\";" % (table))
+
     def drop_table(self, table):
         indexing = ("DROP TABLE \"%s\";" % (table))
         self.cursor.execute(indexing)
 
     def commit_and_close(self):
-        self.conn.commit()
-        self.cursor.close()
-        self.conn.close()
+        '''Commit and return the connection to the pool'''
+        try:
+            self.conn.commit()
+        finally:
+            self.close()
+
+    def close(self):
+        '''Return the connection to the pool, rolling back any uncommitted
+        changes. It is safe to call this more than once.'''
+        if self.conn is None:
+            return
+        conn, self.conn = self.conn, None
+        try:
+            self.cursor.close()
+        except psycopg2.Error:
+            pass
+        self.pool.putconn(conn)
+
+    def __del__(self):
+        # Do not leak pooled connections if close was never called
+        try:
+            self.close()
+        except Exception:
+            pass
+
+#
+# Helpers
+#
+
+def _get_statement_verb(query):
+    if isinstance(query, unicode):
+        query = query.encode('utf-8')
+    words = query.split(None, 1)
+    return words[0].upper().rstrip(';') if words else ''
+
+def _close_quietly(conn):
+    try:
+        conn.close()
+    except psycopg2.Error:
+        pass
+
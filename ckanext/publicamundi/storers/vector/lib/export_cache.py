@@ -0,0 +1,226 @@
+'''A disk-backed cache for export files.
+
+Export files are content-addressed: an entry is named after a hash of
+everything that determines its content (the table and its modification
+marker, the format, the SRS and the format options). Entries are kept
+in a folder per resource, so that all exports of a resource can be
+invalidated at once.
+
+The cache is shared among processes: concurrent requests for the same
+missing entry are serialized by a file lock, so the export is computed
+only once. The lock is only held while the entry is written to disk (the
+entry is streamed to the requester afterwards), so a slow client does not
+hold back other requests. A request that waits for the lock longer than
+lock_timeout gives up and computes an uncached export instead.
+
+The cache is disabled unless enabled in the configuration (see get_config).
+'''
+
+import os
+import time
+import errno
+import fcntl
+import shutil
+import hashlib
+import logging
+from paste.deploy.converters import asbool
+
+log = logging.getLogger(__name__)
+
+# Default upper bound for the total size of cached files (1GB)
+DEFAULT_MAX_SIZE = 1024 * 1024 * 1024
+
+# Default time (in seconds) to wait for a concurrent computation of an entry
+DEFAULT_LOCK_TIMEOUT = 60
+
+# Size of chunks read from cached files
+CHUNK_SIZE = 64 * 1024
+
+# Interval (in seconds) for polling a lock held by a concurrent computation
+LOCK_POLL_INTERVAL = 0.1
+
+
+def get_config(config):
+    '''Returns the cache folder, the maximum cache size and the lock timeout,
+    as configured. The cache folder is None if the cache is disabled (the
+    default), or if its maximum size is 0.'''
+    max_size = int(config.get(
+        'ckanext.publicamundi.vectorstorer.export_cache_max_size', 
+        DEFAULT_MAX_SIZE))
+    lock_timeout = float(config.get(
+        'ckanext.publicamundi.vectorstorer.export_cache_lock_timeout',
+        DEFAULT_LOCK_TIMEOUT))
+    enabled = asbool(config.get(
+        'ckanext.publicamundi.vectorstorer.export_cache', False))
+    if not enabled or not max_size:
+        return None, max_size, lock_timeout
+    cache_dir = config.get('ckanext.publicamundi.vectorstorer.export_cache_dir')
+    if not cache_dir:
+        cache_dir = os.path.join(
+            config.get('ckanext.publicamundi.vectorstorer.temp_dir'),
+            'export-cache')
+    return cache_dir, max_size, lock_timeout
+
+
+class ExportCache(object):
+
+    def __init__(
+            self, cache_dir, max_size=DEFAULT_MAX_SIZE,
+            lock_timeout=DEFAULT_LOCK_TIMEOUT):
+        self.cache_dir = cache_dir
+        self.max_size = int(max_size)
+        self.lock_timeout = float(lock_timeout)
+
+    def get(self, resource_id, key, make_body):
+        '''Get an iterable on the contents of the entry identified by key (a
+        tuple of strings, numbers or None) for a resource.
+
+        If no such entry exists, make_body is called to compute the contents
+        (as an iterable of strings), which are stored before being returned.
+        If make_body returns None, nothing is stored and None is returned.
+        If a concurrent computation of the entry does not complete within
+        lock_timeout, the contents are computed by make_body (uncached).
+        '''
+        path = self._get_path(resource_id, key)
+
+        ifp = self._open(path)
+        if ifp:
+            return _iter_file(ifp)
+
+        _makedirs(os.path.dirname(path))
+        lock = open(path + '.lock', 'a')
+        written = False
+        try:
+            # Wait for a concurrent computation (if any) to complete
+            if not self._lock(lock):
+                lock.close()
+                log.warning(
+                    'Timed out waiting for export %s, not using cache' % (path))
+                return make_body()
+            ifp = self._open(path)
+            if ifp is None:
+                body = make_body()
+                if body is None:
+                    return None
+                ifp = self._write(path, body)
+                written = True
+        finally:
+            if not lock.closed:
+                _unlock(lock)
+
+        if written:
+            self.evict()
+        return _iter_file(ifp)
+
+    def invalidate(self, resource_id):
+        '''Remove all entries for a resource'''
+        shutil.rmtree(self._get_resource_dir(resource_id), ignore_errors=True)
+
+    def evict(self):
+        '''Remove least recently used entries, until the total size of entries
+        is under max_size.'''
+        entries = []
+        total_size = 0
+        for dirpath, dirnames, filenames in os.walk(self.cache_dir):
+            for name in filenames:
+                if name.endswith('.lock') or '.tmp-' in name:
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total_size += st.st_size
+
+        entries.sort()
+        for mtime, size, path in entries:
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total_size -= size
+            log.debug('Evicted export %s from cache' % (path))
+
+    def _get_resource_dir(self, resource_id):
+        return os.path.join(self.cache_dir, str(resource_id))
+
+    def _get_path(self, resource_id, key):
+        digest = hashlib.sha1(repr(tuple(key))).hexdigest()
+        return os.path.join(self._get_resource_dir(resource_id), digest)
+
+    def _open(self, path):
+        '''Open an entry for reading, or return None if not cached.
+
+        The entry is opened right away, so that it remains readable even if
+        it is evicted in the meanwhile.
+        '''
+        try:
+            ifp = open(path, 'rb')
+        except IOError:
+            return None
+        # Mark the entry as recently used
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return ifp
+
+    def _lock(self, lock):
+        '''Acquire an (exclusive) lock, waiting for up to lock_timeout.
+        Returns False if the lock was not acquired.'''
+        deadline = time.time() + self.lock_timeout
+        while True:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except IOError as ex:
+                if ex.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+            if time.time() >= deadline:
+                return False
+            time.sleep(LOCK_POLL_INTERVAL)
+
+    def _write(self, path, body):
+        '''Store an entry, and return it opened for reading'''
+        tmp_path = '%s.tmp-%d' % (path, os.getpid())
+        completed = False
+        try:
+            with open(tmp_path, 'wb') as ofp:
+                for data in body:
+                    ofp.write(data)
+            ifp = open(tmp_path, 'rb')
+            os.rename(tmp_path, path)
+            completed = True
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+            if not completed and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return ifp
+
+#
+# Helpers
+#
+
+def _iter_file(ifp):
+    try:
+        data = ifp.read(CHUNK_SIZE)
+        while data:
+            yield data
+            data = ifp.read(CHUNK_SIZE)
+    finally:
+        ifp.close()
+
+def _unlock(lock):
+    fcntl.flock(lock, fcntl.LOCK_UN)
+    lock.close()
+
+def _makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError as ex:
+        if ex.errno != errno.EEXIST:
+            raise
@@ -0,0 +1,342 @@
+'''Stream the features of a PostGIS table as an export file.
+
+Features are read through a server-side cursor and encoded on the fly,
+so that an export needs neither memory nor temporary disk proportional
+to the size of the table. Geometries are reprojected and encoded by
+PostGIS itself.
+'''
+
+import re
+import csv
+import json
+import time
+import zlib
+import struct
+import datetime
+import decimal
+from cStringIO import StringIO
+from xml.sax.saxutils import escape, quoteattr
+
+# Number of rows fetched from a server-side cursor in one round trip
+FETCH_SIZE = 2000
+
+# Size of chunks sent to the client
+CHUNK_SIZE = 64 * 1024
+
+# Export formats that can be streamed, mapped to their MIME type
+STREAMING_FORMATS = {
+    'geojson': 'application/json',
+    'csv': 'text/csv',
+    'gml': 'application/gml+xml',
+    'kml': 'application/vnd.google-earth.kml+xml',
+}
+
+CSV_GEOMETRY_OPTIONS = ('', 'WKT', 'XY', 'YX', 'XYZ')
+
+GML_NAMESPACES = {
+    'GML2': 'http://www.opengis.net/gml',
+    'GML3': 'http://www.opengis.net/gml',
+    'GML3DEEGREE': 'http://www.opengis.net/gml',
+    'GML3.2': 'http://www.opengis.net/gml/3.2',
+}
+
+
+def is_streamable(export_format, gml_version=None, csv_geometry=None):
+    '''Tells if an export (with the given options) can be streamed.'''
+    if export_format not in STREAMING_FORMATS:
+        return False
+    if export_format == 'gml':
+        return (gml_version or 'GML2').upper() in GML_NAMESPACES
+    if export_format == 'csv':
+        return (csv_geometry or '').upper() in CSV_GEOMETRY_OPTIONS
+    return True
+
+
+class FeatureStream(object):
+    '''Iterate on the chunks of an export file, encoding the features of a
+    PostGIS table (with a geometry column named the_geom).
+
+    The given db (a db_helpers.DB) is closed once the stream is exhausted
+    or closed.
+    '''
+
+    def __init__(
+            self, db, table_name, layer_name, export_format, export_srs,
+            gml_version=None, csv_geometry=None):
+        self.db = db
+        self.table_name = table_name
+        self.layer_name = layer_name
+        self.export_format = export_format
+        self.export_srs = int(export_srs)
+        self.gml_version = (gml_version or 'GML2').upper()
+        self.csv_geometry = (csv_geometry or '').upper()
+
+    def __iter__(self):
+        try:
+            encode = getattr(self, '_encode_%s' % (self.export_format))
+            buf = StringIO()
+            for data in encode():
+                buf.write(data)
+                if buf.tell() >= CHUNK_SIZE:
+                    yield buf.getvalue()
+                    buf = StringIO()
+            if buf.tell() > 0:
+                yield buf.getvalue()
+        finally:
+            self.db.commit_and_close()
+
+    def _get_columns(self):
+        '''Returns the attribute columns of the table (in table order)'''
+        self.db.cursor.execute(
+            "SELECT * FROM \"%s\" LIMIT 0;" % (self.table_name))
+        return [d[0] for d in self.db.cursor.description
+            if not d[0] in ('_id', 'the_geom')]
+
+    def _get_srs(self):
+        self.db.cursor.execute(
+            "SELECT Find_SRID('public', %s, 'the_geom');", (self.table_name,))
+        return self.db.cursor.fetchone()[0]
+
+    def _geometry(self):
+        '''Returns the SQL expression for the (reprojected) geometry'''
+        srs = self._get_srs()
+        if srs > 0 and srs != self.export_srs:
+            return 'ST_Transform(the_geom, %d)' % (self.export_srs)
+        return 'the_geom'
+
+    def _iter_rows(self, columns, geometry_exprs):
+        select = ', '.join(
+            ['"%s"' % (c) for c in columns] + geometry_exprs)
+        query = 'SELECT %s FROM "%s" ORDER BY _id' % (select, self.table_name)
+        return self.db.iter_query(query, fetch_size=FETCH_SIZE)
+
+    def _encode_geojson(self):
+        columns = self._get_columns()
+        geometry = 'ST_AsGeoJSON(%s, 15)' % (self._geometry())
+        ncols = len(columns)
+
+        yield '{"type": "FeatureCollection", '
+        yield '"crs": {"type": "name", "properties": {"name": "urn:ogc:def:crs:EPSG::%d"}}, ' % (
+            self.export_srs)
+        yield '"features": ['
+        sep = ''
+        for row in self._iter_rows(columns, [geometry]):
+            properties = dict(
+                (_to_unicode(c), _to_json_value(v))
+                    for c, v in zip(columns, row[:ncols]))
+            yield '%s{"type": "Feature", "properties": %s, "geometry": %s}' % (
+                sep, json.dumps(properties), row[ncols] or 'null')
+            sep = ', '
+        yield ']}'
+
+    def _encode_csv(self):
+        columns = self._get_columns()
+        geometry = self._geometry()
+
+        geometry_exprs = []
+        geometry_columns = []
+        if self.csv_geometry == 'WKT':
+            geometry_exprs = ['ST_AsText(%s)' % (geometry)]
+            geometry_columns = ['WKT']
+        elif self.csv_geometry in ('XY', 'YX', 'XYZ'):
+            # Note: Coordinates are only given for points (ST_X etc fail on 
+            # other geometries), other geometries get empty columns (as with 
+            # ogr2ogr)
+            axes = list(self.csv_geometry)
+            geometry_exprs = [
+                "CASE WHEN GeometryType(the_geom) IN ('POINT', 'POINTM') "
+                    "THEN ST_%s(%s) END" % (a, geometry) for a in axes]
+            geometry_columns = axes
+
+        buf = StringIO()
+        writer = csv.writer(buf)
+
+        def encode_row(values):
+            writer.writerow([_to_csv_value(v) for v in values])
+            data = buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+            return data
+
+        ncols = len(columns)
+        yield encode_row(geometry_columns + columns)
+        for row in self._iter_rows(columns, geometry_exprs):
+            yield encode_row(list(row[ncols:]) + list(row[:ncols]))
+
+    def _encode_gml(self):
+        columns = self._get_columns()
+        if self.gml_version == 'GML2':
+            geometry = 'ST_AsGML(2, %s, 15)' % (self._geometry())
+        else:
+            geometry = 'ST_AsGML(3, %s, 15)' % (self._geometry())
+
+        layer_tag = 'ogr:' + _to_xml_name(self.layer_name)
+        tags = ['ogr:' + _to_xml_name(c) for c in columns]
+        ncols = len(columns)
+
+        yield '<?xml version="1.0" encoding="utf-8" ?>\n'
+        yield '<ogr:FeatureCollection xmlns:ogr="http://ogr.maptools.org/" xmlns:gml=%s>\n' % (
+            quoteattr(GML_NAMESPACES[self.gml_version]))
+        fid = 0
+        for row in self._iter_rows(columns, [geometry]):
+            yield '<gml:featureMember><%s fid="F%d">' % (layer_tag, fid)
+            if row[ncols]:
+                yield '<ogr:geometryProperty>%s</ogr:geometryProperty>' % (row[ncols])
+            for tag, value in zip(tags, row[:ncols]):
+                if value is not None:
+                    yield '<%s>%s</%s>' % (tag, _to_xml_text(value), tag)
+            yield '</%s></gml:featureMember>\n' % (layer_tag)
+            fid += 1
+        yield '</ogr:FeatureCollection>\n'
+
+    def _encode_kml(self):
+        # Note: KML geometries are always in EPSG:4326
+        columns = self._get_columns()
+        geometry = 'ST_AsKML(the_geom, 15)'
+        names = [quoteattr(_to_unicode(c).encode('utf-8')) for c in columns]
+        ncols = len(columns)
+
+        yield '<?xml version="1.0" encoding="utf-8" ?>\n'
+        yield '<kml xmlns="http://www.opengis.net/kml/2.2"><Document>\n'
+        yield '<Folder><name>%s</name>\n' % (_to_xml_text(self.layer_name))
+        for row in self._iter_rows(columns, [geometry]):
+            yield '<Placemark><ExtendedData>'
+            for name, value in zip(names, row[:ncols]):
+                if value is not None:
+                    yield '<Data name=%s><value>%s</value></Data>' % (
+                        name, _to_xml_text(value))
+            yield '</ExtendedData>'
+            if row[ncols]:
+                yield row[ncols]
+            yield '</Placemark>\n'
+        yield '</Folder></Document></kml>\n'
+
+
+class ZipStream(object):
+    '''Iterate on the chunks of a zip archive, compressing the given files
+    on the fly.
+
+    The archive is written sequentially (sizes and CRCs of members follow
+    their data), so it is never kept in memory or on disk as a whole. Note
+    that ZIP64 is not supported, so members must be under 4GB.
+    '''
+
+    def __init__(self, files, cleanup=None):
+        '''Create a stream for files, a list of (path, name in archive) pairs.
+
+        The cleanup callable (if given) is called when the stream is exhausted
+        or closed.
+        '''
+        self.files = files
+        self.cleanup = cleanup
+
+    def __iter__(self):
+        try:
+            offset = 0
+            entries = []
+            for path, arcname in self.files:
+                header_offset = offset
+                dostime, dosdate = _to_dos_datetime(time.localtime())
+                arcname = arcname.encode('utf-8') \
+                    if isinstance(arcname, unicode) else arcname
+                # Local file header: flag bit 3 denotes a trailing descriptor,
+                # bit 11 denotes UTF-8 names
+                header = struct.pack('<IHHHHHIIIHH',
+                    0x04034b50, 20, 0x0808, 8, dostime, dosdate, 0, 0, 0,
+                    len(arcname), 0) + arcname
+                yield header
+                offset += len(header)
+
+                crc = 0
+                size = 0
+                compressed_size = 0
+                compressor = zlib.compressobj(
+                    zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+                with open(path, 'rb') as ifp:
+                    data = ifp.read(CHUNK_SIZE)
+                    while data:
+                        crc = zlib.crc32(data, crc)
+                        size += len(data)
+                        data = compressor.compress(data)
+                        if data:
+                            compressed_size += len(data)
+                            yield data
+                        data = ifp.read(CHUNK_SIZE)
+                data = compressor.flush()
+                compressed_size += len(data)
+                crc = crc & 0xffffffff
+                descriptor = struct.pack('<IIII',
+                    0x08074b50, crc, compressed_size, size)
+                yield data + descriptor
+                offset += compressed_size + len(descriptor)
+
+                entries.append((arcname, dostime, dosdate, crc,
+                    compressed_size, size, header_offset))
+
+            # Central directory
+            directory = StringIO()
+            for arcname, dostime, dosdate, crc, compressed_size, size, \
+                    header_offset in entries:
+                directory.write(struct.pack('<IHHHHHHIIIHHHHHII',
+                    0x02014b50, 20, 20, 0x0808, 8, dostime, dosdate, crc,
+                    compressed_size, size, len(arcname), 0, 0, 0, 0, 0,
+                    header_offset))
+                directory.write(arcname)
+            directory_data = directory.getvalue()
+            yield directory_data + struct.pack('<IHHHHIIH',
+                0x06054b50, 0, 0, len(entries), len(entries),
+                len(directory_data), offset, 0)
+        finally:
+            if self.cleanup:
+                self.cleanup()
+
+#
+# Helpers
+#
+
+def _to_dos_datetime(t):
+    dostime = (t[3] << 11) | (t[4] << 5) | (t[5] // 2)
+    dosdate = ((t[0] - 1980) << 9) | (t[1] << 5) | t[2]
+    return dostime, dosdate
+
+def _to_unicode(value):
+    if isinstance(value, str):
+        return value.decode('utf-8')
+    return value
+
+def _to_json_value(value):
+    if isinstance(value, str):
+        return value.decode('utf-8')
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, list):
+        return [_to_json_value(v) for v in value]
+    if isinstance(value, buffer):
+        return str(value).encode('hex')
+    return value
+
+def _to_csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, float):
+        return repr(value)
+    if isinstance(value, list):
+        return json.dumps(_to_json_value(value))
+    if isinstance(value, buffer):
+        return str(value).encode('hex')
+    return str(value)
+
+def _to_xml_text(value):
+    return escape(_to_csv_value(value))
+
+def _to_xml_name(name):
+    name = re.sub(r'[^\w.-]', '_', _to_unicode(name), flags=re.UNICODE)
+    if not re.match(r'[^\W\d]', name, flags=re.UNICODE):
+        name = '_' + name
+    return name.encode('utf-8')
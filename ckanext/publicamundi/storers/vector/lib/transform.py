@@ -0,0 +1,121 @@
+'''Memoized spatial references and coordinate transformations.
+
+Building an osr.SpatialReference (and even more a CoordinateTransformation)
+means parsing (and looking up) CRS definitions, so these objects are kept
+in a bounded LRU cache and reused. Since OSR objects are not meant to be
+shared among threads, each thread keeps a cache of its own.
+
+Spatial references are identified either by an EPSG code (an integer) or
+by a PROJ.4 definition (a string).
+'''
+
+import threading
+from collections import OrderedDict
+
+import ckanext.publicamundi.storers.vector as vectorstorer
+
+# Maximum number of spatial references (and of transformations) kept
+MAX_SIZE = 64
+
+# Number of points per edge when transforming a bounding box
+BBOX_DENSIFY = 8
+
+
+class TransformationCache(threading.local):
+
+    def __init__(self, max_size=MAX_SIZE):
+        self.max_size = max_size
+        self.srs = OrderedDict()
+        self.transformations = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get_srs(self, srs):
+        '''Returns a (cached) osr.SpatialReference for an EPSG code or a
+        PROJ.4 definition'''
+        spatial_ref = self._get(self.srs, srs)
+        if spatial_ref is None:
+            spatial_ref = vectorstorer.osr.SpatialReference()
+            if isinstance(srs, basestring):
+                spatial_ref.ImportFromProj4(srs)
+            else:
+                spatial_ref.ImportFromEPSG(int(srs))
+            self._put(self.srs, srs, spatial_ref)
+        return spatial_ref
+
+    def get_transformation(self, source, target):
+        '''Returns a (cached) osr.CoordinateTransformation from source to target
+        spatial references, or None if both are the same.'''
+        if source == target:
+            return None
+        key = (source, target)
+        transformation = self._get(self.transformations, key)
+        if transformation is None:
+            transformation = vectorstorer.osr.CoordinateTransformation(
+                self.get_srs(source), self.get_srs(target))
+            self._put(self.transformations, key, transformation)
+        return transformation
+
+    def clear(self):
+        self.srs.clear()
+        self.transformations.clear()
+
+    def _get(self, d, key):
+        value = d.pop(key, None)
+        if value is None:
+            self.misses += 1
+        else:
+            # Re-insert, so that the key is marked as most recently used
+            d[key] = value
+            self.hits += 1
+        return value
+
+    def _put(self, d, key, value):
+        d[key] = value
+        while len(d) > self.max_size:
+            d.popitem(last=False)
+
+_cache = TransformationCache()
+
+def get_srs(srs):
+    return _cache.get_srs(srs)
+
+def get_transformation(source, target):
+    return _cache.get_transformation(source, target)
+
+def transform_geometry(geom, source, target):
+    '''Transform an ogr.Geometry in place'''
+    transformation = _cache.get_transformation(source, target)
+    if transformation is not None:
+        geom.Transform(transformation)
+    return geom
+
+def transform_points(points, source, target):
+    '''Transform a sequence of (x, y) or (x, y, z) coordinates in one batch.
+
+    Returns a list of (x, y, z) tuples.
+    '''
+    transformation = _cache.get_transformation(source, target)
+    if transformation is None:
+        return [(p[0], p[1], p[2] if len(p) > 2 else 0.0) for p in points]
+    return transformation.TransformPoints(list(points))
+
+def transform_bbox(bbox, source, target, densify=BBOX_DENSIFY):
+    '''Transform a bounding box (minx, miny, maxx, maxy), returning the bounding
+    box of the transformed one.
+
+    The edges of the box are densified before being transformed (in a single
+    batch), so that the result also covers curved edges.
+    '''
+    if source == target:
+        return tuple(bbox)
+    minx, miny, maxx, maxy = bbox
+    points = []
+    for i in range(densify + 1):
+        x = minx + (maxx - minx) * i / float(densify)
+        y = miny + (maxy - miny) * i / float(densify)
+        points.extend([(x, miny), (x, maxy), (minx, y), (maxx, y)])
+    points = transform_points(points, source, target)
+    xs = [p[0] for p in points]
+    ys = [p[1] for p in points]
+    return (min(xs), min(ys), max(xs), max(ys))
@@ -1,6 +1,8 @@
 import os
 import urlparse
 
+from ckanext.publicamundi.storers.vector.lib import transform
+
 MAP_PROJECTION = 4326
 OWS_SRS_LIST = [4326, 3857, 900913]
 
@@ -202,59 +204,27 @@ class MapServerUtils:
         '''Returns the spatial extent of a map file in the following
         format : [minx, miny, maxx, maxy]'''
 
-        # Create a memory vector layer to add each layer's extent
-        # as a feature
-        drv = ogr.GetDriverByName( 'Memory' )
-        dst_ds = drv.CreateDataSource( 'temp_vector_for_extent' )
-
-        ext_layer = dst_ds.CreateLayer("map_extent", geom_type=ogr.wkbPolygon)
+        # Reproject the bounding box of each layer to the default map
+        # projection (note that transformations are cached per projection)
+        minx = miny = float('inf')
+        maxx = maxy = float('-inf')
         for layer_idx in map.getLayerOrder():
-
-            # Create a polygon for each layer, from the bounding
-            # box coordinates
-            ring = ogr.Geometry(ogr.wkbLinearRing)
             layer_extent = map.getLayer(layer_idx).getExtent()
-            ring.AddPoint(layer_extent.minx,layer_extent.miny)
-            ring.AddPoint(layer_extent.maxx,layer_extent.miny)
-            ring.AddPoint(layer_extent.maxx,layer_extent.maxy)
-            ring.AddPoint(layer_extent.minx,layer_extent.maxy)
-            ring.AddPoint(layer_extent.minx,layer_extent.miny)
-
-            # reproject the geometry to default map projection
-            ring_reprojected = self._reproject_geom_to_default_proj(ring,map.getLayer(layer_idx).getProjection() )
-
-            poly = ogr.Geometry(ogr.wkbPolygon)
-            poly.AddGeometry(ring_reprojected)
-
-            featureDefn = ext_layer.GetLayerDefn()
+            bbox = transform.transform_bbox(
+                (layer_extent.minx, layer_extent.miny,
+                    layer_extent.maxx, layer_extent.maxy),
+                map.getLayer(layer_idx).getProjection(),
+                MAP_PROJECTION)
+            minx, miny = min(minx, bbox[0]), min(miny, bbox[1])
+            maxx, maxy = max(maxx, bbox[2]), max(maxy, bbox[3])
 
-            # create a new feature
-            layer_ext_feat = ogr.Feature(featureDefn)
-
-            # Set geometry
-            layer_ext_feat.SetGeometry(poly)
-
-            # Add new feature to output Layer
-            ext_layer.CreateFeature(layer_ext_feat)
-
-        extent = list(ext_layer.GetExtent())
-        return extent[0], extent[2], extent[1], extent[3]
+        return minx, miny, maxx, maxy
 
     def _reproject_geom_to_default_proj(self, geom, native_spatial_ref):
         '''Reprojects the geom from layer's native spatial reference
         system to the default projection of the map.'''
-        inSpatialRef = osr.SpatialReference()
-        inSpatialRef.ImportFromProj4(native_spatial_ref)
-
-        # output SpatialReference
-        outSpatialRef = osr.SpatialReference()
-        outSpatialRef.ImportFromEPSG(MAP_PROJECTION)
-
-        # create the CoordinateTransformation
-        coordTrans = osr.CoordinateTransformation(inSpatialRef, outSpatialRef)
-
-        geom.Transform(coordTrans)
-        return geom
+        return transform.transform_geometry(
+            geom, native_spatial_ref, MAP_PROJECTION)
 
     def update_srs_list(self, map, srs):
         '''Returns a map object which contains the updated srs list
@@ -8,7 +8,7 @@ import ckan.plugins.toolkit as toolkit
 import ckan.model as model
 
 import ckanext.publicamundi.storers.vector as vectorstorer
-from ckanext.publicamundi.storers.vector import resource_actions
+from ckanext.publicamundi.storers.vector import resource_actions, db_helpers
 from ckanext.publicamundi.storers.vector.resources import (
     DBTableResource, WMSResource, WFSResource) 
 from ckanext.publicamundi.storers.vector.lib.template_helpers import (
@@ -170,6 +170,10 @@ class VectorStorer(p.SingletonPlugin):
             'ckanext.publicamundi.vectorstorer.temp_dir')
         
         vectorstorer.setup(gdal_folder, temp_folder)
+        
+        db_helpers.setup(
+            config.get('ckanext.publicamundi.vectorstorer.db_pool_size'),
+            config.get('ckanext.publicamundi.vectorstorer.db_pool_timeout'))
 
         return
 
@@ -0,0 +1,167 @@
+'''Profile the features of a vector layer in a single pass.
+
+A profile gathers everything the ingestion needs to know about a layer
+(geometry types, coordinate dimension, extent, null attributes, encoding
+hints), so that the layer is not read over and over again.
+'''
+
+# OGR field types holding (lists of) strings
+STRING_FIELD_TYPES = (4, 5, 6, 7)
+
+
+class LayerProfile(object):
+
+    def __init__(self, layer_name):
+        self.layer_name = layer_name
+        # The number of profiled features
+        self.feature_count = 0
+        # True if only the first features were profiled
+        self.is_sample = False
+        # A histogram of geometry names (Point, Polygon, etc.)
+        self.geometry_types = {}
+        self.null_geometries = 0
+        self.coordinate_dimension = None
+        # The extent as (minx, maxx, miny, maxy), as OGR reports extents
+        self.extent = None
+        # Null counts for each attribute
+        self.null_counts = {}
+        # Counts of non-ASCII and non-UTF-8 values for each string attribute
+        self.non_ascii_counts = {}
+        self.invalid_utf8_counts = {}
+        # The encoding declared by the source (if any)
+        self.source_encoding = None
+
+    @property
+    def geometry_name(self):
+        '''Returns the geometry name of the layer (Polygon, Point, etc.)
+
+        A layer mixing simple geometries and their multi- counterparts is
+        named after the latter, while any other mix of types is named as
+        GEOMETRY.
+        '''
+        geometry_names = self.geometry_types.keys()
+
+        if len(geometry_names) == 0:
+            return None
+        if len(geometry_names) == 1:
+            return geometry_names[0]
+        if len(geometry_names) == 2:
+            multi_geom = self._get_multi_geometry_name()
+            if multi_geom:
+                return multi_geom
+        return 'GEOMETRY'
+
+    @property
+    def needs_conversion_to_multi(self):
+        '''Tells if some geometries must be promoted to multi-geometries'''
+        return len(self.geometry_types) == 2 and \
+            self._get_multi_geometry_name() is not None
+
+    def _get_multi_geometry_name(self):
+        multi_geom = None
+        simple_geom = None
+        for gname in self.geometry_types:
+            gname_upp = gname.upper()
+            if 'MULTI' in gname_upp:
+                multi_geom = gname_upp
+            else:
+                simple_geom = gname_upp
+        if multi_geom and simple_geom:
+            if multi_geom.split('MULTI')[1] == simple_geom:
+                return multi_geom
+        return None
+
+    def as_dict(self):
+        return {
+            'layer_name': self.layer_name,
+            'feature_count': self.feature_count,
+            'is_sample': self.is_sample,
+            'geometry_types': dict(self.geometry_types),
+            'geometry_name': self.geometry_name,
+            'null_geometries': self.null_geometries,
+            'coordinate_dimension': self.coordinate_dimension,
+            'extent': self.extent,
+            'null_counts': dict(self.null_counts),
+            'non_ascii_counts': dict(self.non_ascii_counts),
+            'invalid_utf8_counts': dict(self.invalid_utf8_counts),
+            'source_encoding': self.source_encoding,
+        }
+
+
+def profile_layer(layer, sample_size=None):
+    '''Profile a layer reading its features once.
+
+    If a sample_size is given, only the first sample_size features are read.
+    '''
+
+    profile = LayerProfile(layer.GetName())
+
+    layerDefinition = layer.GetLayerDefn()
+    fields = []
+    for i in range(layerDefinition.GetFieldCount()):
+        field_defn = layerDefinition.GetFieldDefn(i)
+        fname = field_defn.GetName()
+        is_string = field_defn.GetType() in STRING_FIELD_TYPES
+        fields.append((i, fname, is_string))
+        profile.null_counts[fname] = 0
+        if is_string:
+            profile.non_ascii_counts[fname] = 0
+            profile.invalid_utf8_counts[fname] = 0
+
+    try:
+        profile.source_encoding = layer.GetMetadataItem(
+            'SOURCE_ENCODING', 'SHAPEFILE')
+    except Exception:
+        pass
+
+    geometry_types = profile.geometry_types
+    coordinate_dimension = None
+    minx = miny = float('inf')
+    maxx = maxy = float('-inf')
+
+    layer.ResetReading()
+    feat = layer.GetNextFeature()
+    while feat is not None:
+        if sample_size and profile.feature_count >= sample_size:
+            profile.is_sample = True
+            break
+        profile.feature_count += 1
+
+        geom = feat.GetGeometryRef()
+        if geom is None:
+            profile.null_geometries += 1
+        else:
+            gname = geom.GetGeometryName()
+            geometry_types[gname] = geometry_types.get(gname, 0) + 1
+            if coordinate_dimension is None:
+                coordinate_dimension = geom.GetCoordinateDimension()
+            else:
+                coordinate_dimension = max(
+                    coordinate_dimension, geom.GetCoordinateDimension())
+            if not geom.IsEmpty():
+                env = geom.GetEnvelope()
+                minx, maxx = min(minx, env[0]), max(maxx, env[1])
+                miny, maxy = min(miny, env[2]), max(maxy, env[3])
+
+        for i, fname, is_string in fields:
+            if not feat.IsFieldSet(i):
+                profile.null_counts[fname] += 1
+            elif is_string:
+                value = feat.GetFieldAsString(i)
+                try:
+                    value.decode('ascii')
+                except UnicodeDecodeError:
+                    profile.non_ascii_counts[fname] += 1
+                    try:
+                        value.decode('utf-8')
+                    except UnicodeDecodeError:
+                        profile.invalid_utf8_counts[fname] += 1
+
+        feat = layer.GetNextFeature()
+    layer.ResetReading()
+
+    profile.coordinate_dimension = coordinate_dimension
+    if minx <= maxx:
+        profile.extent = (minx, maxx, miny, maxy)
+
+    return profile
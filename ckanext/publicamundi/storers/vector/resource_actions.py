@@ -14,6 +14,7 @@ from ckanext.publicamundi.model.resource_ingest import (
     ResourceIngest, ResourceStorerType, IngestStatus)
 from ckanext.publicamundi.storers.vector.resources import (
     DBTableResource, WMSResource, WFSResource)
+from ckanext.publicamundi.storers.vector.lib import export_cache
 
 vector_child_formats = [
     DBTableResource.FORMAT,
@@ -51,6 +52,21 @@ def _make_default_context():
             'ckanext.publicamundi.vectorstorer.gdal_folder'),
         'temp_folder': config.get(
             'ckanext.publicamundi.vectorstorer.temp_dir'),
+        # Storage of uploaded resources (if reachable from workers)
+        'storage_path': config.get('ckan.storage_path'),
+        # Configuration needed to ingest vector layers
+        'copy_batch_size': config.get(
+            'ckanext.publicamundi.vectorstorer.copy_batch_size'),
+        'ingest_chunk_size': config.get(
+            'ckanext.publicamundi.vectorstorer.ingest_chunk_size'),
+        'profile_sample_size': config.get(
+            'ckanext.publicamundi.vectorstorer.profile_sample_size'),
+        'db_pool_size': config.get(
+            'ckanext.publicamundi.vectorstorer.db_pool_size'),
+        'db_pool_timeout': config.get(
+            'ckanext.publicamundi.vectorstorer.db_pool_timeout'),
+        # Configuration needed to invalidate cached exports
+        'export_cache_dir': export_cache.get_config(config)[0],
     }
 
 def identify_resource(resource):
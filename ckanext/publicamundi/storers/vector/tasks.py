@@ -14,11 +14,14 @@ from celery.task.http import HttpDispatchTask
 from ckan.lib.celery_app import celery as celery_app
 
 import ckanext.publicamundi.storers.vector as vectorstorer
+from ckanext.publicamundi.storers import download
 from ckanext.publicamundi.storers.vector import vector
 from ckanext.publicamundi.storers.vector.resources import(
     WMSResource, DBTableResource, WFSResource)
+from ckanext.publicamundi.storers.vector import db_helpers
 from ckanext.publicamundi.storers.vector.db_helpers import DB
 from ckanext.publicamundi.storers.vector.lib import utils
+from ckanext.publicamundi.storers.vector.lib.export_cache import ExportCache
 
 # List MIME types recognized as archives from pyunpack
 archive_mime_types = [
@@ -46,6 +49,8 @@ def setup_vectorstorer_in_task_context(context):
     temp_folder = context['temp_folder']
     gdal_folder = context['gdal_folder']
     vectorstorer.setup(gdal_folder, temp_folder)
+    db_helpers.setup(
+        context.get('db_pool_size'), context.get('db_pool_timeout'))
     return
 
 @celery_app.task(name='vectorstorer.identify', max_retries=2)
@@ -60,7 +65,8 @@ def identify_resource(resource_dict, context):
     # Download
 
     try:
-        tmp_folder, filename = _download_resource(resource_dict, api_key)
+        tmp_folder, filename = _download_resource(
+            resource_dict, api_key, context.get('storage_path'))
     except CannotDownload as ex:
         # Retry later, maybe the resource is still uploading
         logger.error('Failed to identify: %s' % (ex.message))
@@ -71,7 +77,9 @@ def identify_resource(resource_dict, context):
 
     result = None
     try:
-        result = _identify_resource(resource_dict, api_key, tmp_folder, filename)
+        result = _identify_resource(
+            resource_dict, api_key, tmp_folder, filename,
+            context.get('profile_sample_size'))
         logger.info('Identified resource %s' % (resource_id))
     except vector.DatasourceException as ex:
         logger.error('Failed to identify resource %s: %s' % (resource_id, ex))
@@ -81,7 +89,9 @@ def identify_resource(resource_dict, context):
 
     return result
 
-def _identify_resource(resource, user_api_key, resource_tmp_folder, filename):
+def _identify_resource(
+        resource, user_api_key, resource_tmp_folder, filename,
+        profile_sample_size=None):
     
     # Todo: Document this function
 
@@ -92,7 +102,12 @@ def _identify_resource(resource, user_api_key, resource_tmp_folder, filename):
 
     if gdal_driver:
         result['gdal_driver'] = gdal_driver
-        _vector = vector.Vector(gdal_driver, vector_file_path, None, None)
+        _vector = vector.Vector(
+            gdal_driver,
+            vector_file_path,
+            None,
+            None,
+            profile_sample_size=profile_sample_size)
         layer_count = _vector.get_layer_count()
         layers = []
         for layer_idx in range(0, layer_count):
@@ -122,7 +137,8 @@ def vectorstorer_upload(resource_dict, context, backend_context):
     
     # Download
 
-    tmp_folder, filename = _download_resource(resource_dict, api_key)
+    tmp_folder, filename = _download_resource(
+        resource_dict, api_key, context.get('storage_path'))
     logger.info(
         'Downloaded resource %s at %s' % (resource_id, tmp_folder))
     
@@ -134,20 +150,28 @@ def vectorstorer_upload(resource_dict, context, backend_context):
 
     # Ingest
     
+    dispatched = False
     try:
-        _ingest_resource(
+        dispatched = _ingest_resource(
             resource_dict,
             context1,
             backend_context,
             tmp_folder,
             filename)
+        if dispatched:
+            # The chunks are loaded (and the layers are published) by subtasks,
+            # which will also cleanup and reload the backend
+            logger.info('Dispatched ingestion of resource %s' % (resource_id))
+            return
         logger.info('Ingested resource %s' % (resource_id))
+        _log_db_stats(logger)
     except Exception as ex:
         logger.error(
             'Failed to ingest resource %s: %s' % (resource_id, ex))
         raise
     finally:
-        _delete_temp(tmp_folder)
+        if not dispatched:
+            _delete_temp(tmp_folder)
 
     # Reload configuration at backend 
     
@@ -169,6 +193,10 @@ def _ingest_resource(
     #  a. Document this function
     #  b. This is a core processing unit and should return an overall status
 
+    # Returns True if the selected layers were split into chunks, dispatched 
+    # to be loaded in parallel by subtasks, or False if they were ingested
+    # in-place.
+
     gdal_driver, vector_file_path, prj_exists = _get_gdalDRV_filepath(
         resource, resource_tmp_folder, filename)
 
@@ -190,12 +218,27 @@ def _ingest_resource(
             gdal_driver,
             vector_file_path,
             _encoding,
-            db_conn_params)
+            db_conn_params,
+            copy_batch_size=context.get('copy_batch_size'),
+            profile_sample_size=context.get('profile_sample_size'))
         logger.info('Read vector resource using GDAL');
 
         layer_count = _vector.get_layer_count()
         logger.info('Found %d vector layers to ingest' % (layer_count))
 
+        chunk_size = int(context.get('ingest_chunk_size') or 0)
+        if chunk_size > 0:
+            return _dispatch_ingest_chunks(
+                _vector,
+                resource,
+                context,
+                backend_context,
+                gdal_driver,
+                vector_file_path,
+                _encoding,
+                resource_tmp_folder,
+                chunk_size)
+
         for layer_idx in range(0, layer_count):
             if layer_params[layer_idx]['is_selected']:
                 layer_name = layer_params[layer_idx]['name']
@@ -212,6 +255,227 @@ def _ingest_resource(
                     srs,
                     encoding)
 
+    return False
+
+def _dispatch_ingest_chunks(
+        _vector,
+        resource,
+        context,
+        backend_context,
+        gdal_driver,
+        vector_file_path,
+        encoding,
+        resource_tmp_folder,
+        chunk_size):
+    '''Create the tables for all selected layers, split each layer into ranges
+    of (at most) chunk_size features and dispatch them as a chord: the chunks
+    are loaded concurrently by `vectorstorer.ingest_chunk` subtasks and, once 
+    all are done, `vectorstorer.finalize_upload` indexes and publishes every 
+    layer. If any of them fails, `vectorstorer.abort_upload` drops the tables
+    (and their resources) and removes the temporary folder.
+
+    Every chunk is read with the encoding selected for its layer.
+
+    Note that the subtasks read the vector file from the resource's temporary 
+    folder, so the temporary folder must be shared among the Celery workers.
+
+    Returns True if any chunks were dispatched.
+    '''
+
+    layer_params = context['layer_params']['layers']
+    logger = context['logger']
+    
+    # Note: Subtasks need a serializable context (i.e. without a logger)
+    task_context = dict((k, v) for k, v in context.items() if k != 'logger')
+    
+    layers = []
+    chunks = []
+    for layer_idx in range(0, _vector.get_layer_count()):
+        if not layer_params[layer_idx]['is_selected']:
+            continue
+        layer = _vector.get_layer(layer_idx)
+        if not layer:
+            continue
+        feature_count = layer.GetFeatureCount()
+        if feature_count <= 0:
+            continue
+        
+        layer_name = layer_params[layer_idx]['name']
+        srs = int(layer_params[layer_idx]['srs'])
+        layer_encoding = layer_params[layer_idx]['encoding']
+        geom_name = _vector.get_geometry_name(layer)
+        _log_layer_profile(logger, layer_name, _vector.profile_layer(layer))
+        created_db_table_resource = _add_db_table_resource(
+            context,
+            resource,
+            geom_name,
+            layer_name)
+        table_name = str(created_db_table_resource['id'].lower())
+        
+        layer = _vector.get_layer(layer_idx)
+        _vector.create_layer_table(layer, geom_name, table_name, srs)
+        _vector._db.commit_and_close()
+        
+        layers.append({
+            'idx': layer_idx,
+            'name': layer_name,
+            'srs': srs,
+            'geometry': geom_name,
+            'table_name': table_name,
+            'db_table_resource': created_db_table_resource,
+        })
+        for start in range(0, feature_count, chunk_size):
+            chunks.append({
+                'layer_idx': layer_idx,
+                'table_name': table_name,
+                'srs': srs,
+                'encoding': layer_encoding,
+                'geometry': geom_name,
+                'start': start,
+                'count': min(chunk_size, feature_count - start),
+            })
+        logger.info('Split layer `%s` (%d features) into %d chunks', 
+            layer_name, feature_count, len(range(0, feature_count, chunk_size)))
+    
+    if not chunks:
+        return False
+
+    source = {
+        'gdal_driver': gdal_driver,
+        'file_path': vector_file_path,
+        'encoding': encoding,
+        'tmp_folder': resource_tmp_folder,
+    }
+    
+    header = [
+        vectorstorer_ingest_chunk.s(source, chunk, task_context) 
+            for chunk in chunks]
+    callback = vectorstorer_finalize_upload.s(
+        source, layers, resource, task_context, backend_context)
+    callback.link_error(
+        vectorstorer_abort_upload.s(source, layers, task_context))
+    celery.chord(header)(callback)
+    return True
+
+@celery_app.task(name='vectorstorer.ingest_chunk')
+def vectorstorer_ingest_chunk(source, chunk, context):
+    '''Load a range of features of a layer into its (already created) table.'''
+    setup_vectorstorer_in_task_context(context)
+    
+    logger = vectorstorer_ingest_chunk.get_logger()
+    
+    _vector = vector.Vector(
+        source['gdal_driver'],
+        source['file_path'],
+        chunk.get('encoding') or source['encoding'],
+        context['db_params'],
+        copy_batch_size=context.get('copy_batch_size'))
+    layer = _vector.get_layer(chunk['layer_idx'])
+    load_errors = _vector.write_chunk(
+        chunk['table_name'],
+        layer,
+        chunk['srs'],
+        chunk['geometry'],
+        chunk['start'],
+        chunk['count'])
+    logger.info('Loaded %d features (from #%d) into table %s', 
+        chunk['count'], chunk['start'], chunk['table_name'])
+    
+    return {
+        'table_name': chunk['table_name'],
+        'errors': load_errors,
+    }
+
+@celery_app.task(name='vectorstorer.finalize_upload')
+def vectorstorer_finalize_upload(
+        chunk_results, source, layers, resource_dict, context, backend_context):
+    '''Complete a chunked ingestion, once all chunks are loaded: index, analyze
+    and publish every layer, then cleanup and reload the backend.
+    '''
+    setup_vectorstorer_in_task_context(context)
+    
+    logger = vectorstorer_finalize_upload.get_logger()
+    resource_id = resource_dict['id']
+
+    context1 = copy.deepcopy(context)
+    context1['logger'] = logger
+    
+    try:
+        _vector = vector.Vector(
+            source['gdal_driver'],
+            source['file_path'],
+            source['encoding'],
+            context['db_params'])
+        for layer_info in layers:
+            table_name = layer_info['table_name']
+            for result in chunk_results:
+                if result['table_name'] == table_name:
+                    _log_load_errors(logger, layer_info['name'], result['errors'])
+            
+            _vector._db = DB(context['db_params'])
+            try:
+                _vector.finalize_table(table_name)
+                _vector._db.commit_and_close()
+            finally:
+                _vector._db.close()
+            
+            _publish_vector(
+                _vector.get_layer(layer_info['idx']),
+                layer_info['name'],
+                resource_dict,
+                layer_info['db_table_resource'],
+                context1,
+                backend_context,
+                layer_info['srs'],
+                layer_info['geometry'])
+        logger.info('Ingested resource %s' % (resource_id))
+        _log_db_stats(logger)
+    except Exception as ex:
+        logger.error(
+            'Failed to ingest resource %s: %s' % (resource_id, ex))
+        raise
+    finally:
+        _delete_temp(source['tmp_folder'])
+    
+    # Reload configuration at backend 
+    
+    try:
+        _reload_geoserver_config(context1, backend_context['geoserver_context'])
+    except Exception as ex:
+        logger.warning('Failed to reload backend configuration: %s' % (ex))
+
+    return
+
+@celery_app.task(name='vectorstorer.abort_upload')
+def vectorstorer_abort_upload(task_id, source, layers, context):
+    '''Cleanup after a chunked ingestion has failed (i.e. any of its chunks,
+    or its finalization): drop the tables of all layers, delete their table 
+    resources, and remove the temporary folder.
+    
+    This is linked as an errback of `vectorstorer.finalize_upload`, so it is
+    called with the id of the failed task.
+    '''
+    setup_vectorstorer_in_task_context(context)
+
+    logger = vectorstorer_abort_upload.get_logger()
+    logger.error('Chunked ingestion failed (task %s), cleaning up' % (task_id))
+    
+    context1 = copy.deepcopy(context)
+    context1['logger'] = logger
+
+    for layer_info in layers:
+        _delete_from_datastore(
+            layer_info['table_name'], context['db_params'], context1, logger)
+        res = {'id': layer_info['db_table_resource']['id']}
+        try:
+            _invoke_api_resource_action(context1, res, 'resource_delete')
+        except urllib2.HTTPError as ex:
+            logger.warning('Failed to delete resource %s: %s' % (res['id'], ex))
+    
+    shutil.rmtree(source['tmp_folder'], ignore_errors=True)
+    
+    return
+
 def _get_gdalDRV_filepath(resource, resource_tmp_folder, file_name):
     '''Tries to find the vector file which is going to be read by GDAL.
     
@@ -257,47 +521,25 @@ def _get_file_folder(extraction_folder):
             break
     return files_folder
 
-def _download_resource(resource_dict, api_key):
+def _download_resource(resource_dict, api_key, storage_path=None):
     '''Downloads the HTTP resource specified in resource-url and saves it inder a 
     temporary folder.
+
+    The file is streamed to disk (or copied from storage_path, for uploads),
+    and a download interrupted by a previous attempt is resumed.
     '''
 
     temp_folder = os.path.join(vectorstorer.temp_dir, resource_dict['id'])
-    os.makedirs(temp_folder)
     
     resource_url = urllib2.unquote(resource_dict['url'])
-    is_upload = resource_dict.get('url_type', '') == 'upload'
-
-    # Prepare download request
-
-    download_request = urllib2.Request(resource_url)
-    if is_upload:
-        download_request.add_header('Authorization', api_key)
-    
-    # Perform request, handle errors
-    
-    try:
-        download_response = urllib2.urlopen(download_request)
-    except urllib2.HTTPError as ex:
-        _delete_temp(temp_folder)
-        try:
-            detail = ex.read(128)
-        except:
-            detail = 'n/a'
-        raise CannotDownload(
-            'Failed to download %s: %s: %s' % (resource_url, ex, detail))
-    except urllib2.URLError as ex:
-        _delete_temp(temp_folder)
-        raise CannotDownload(
-            'Failed to download %s: %s' % (resource_url, ex))
-
-    # Save downloaded resource in a local file
-    
     filename = urlparse(resource_url).path.split('/')[-1]
     downloaded_file = os.path.join(temp_folder, filename)
-    with open(downloaded_file, 'wb') as ofp:
-        ofp.write(download_response.read())
-        ofp.close()
+    
+    try:
+        download.download_resource(
+            resource_dict, downloaded_file, api_key, storage_path)
+    except download.DownloadError as ex:
+        raise CannotDownload(str(ex))
 
     return temp_folder, filename
 
@@ -405,8 +647,7 @@ def _ingest_vector(
     if layer and layer.GetFeatureCount() > 0:
         #layer_name = layer.GetName()
         geom_name = _vector.get_geometry_name(layer)
-        spatial_ref = vectorstorer.osr.SpatialReference()
-        spatial_ref.ImportFromEPSG(srs)
+        _log_layer_profile(logger, layer_name, _vector.profile_layer(layer))
         
         created_db_table_resource = _add_db_table_resource(
             context,
@@ -416,49 +657,106 @@ def _ingest_vector(
         layer = _vector.get_layer(layer_idx)
 
         table_name = str(created_db_table_resource['id'].lower())
-        _vector.handle_layer(
+        load_errors = _vector.handle_layer(
             layer,
             geom_name,
             table_name,
             srs,
             encoding)
+        _log_load_errors(logger, layer_name, load_errors)
 
-        publishing_server = backend_context['default_publishing_server']
-        publishing_server_url = None
-        publishing_layer = None
-        
-        logger.info('About to publish %s layer `%s` (originally named as `%s`) at %s backend', 
-            geom_name, layer_name, layer.GetName(), publishing_server)
-
-        # Publish to Geoserver or Mapserver (Based on configuration)
-        if publishing_server == 'geoserver':
-            publishing_server_url, publishing_layer = _publish_layer_to_geoserver(
-                backend_context['geoserver_context'], layer_name,
-                created_db_table_resource, spatial_ref)
-        elif publishing_server == 'mapserver':
-            publishing_server_url, publishing_layer = _publish_layer_to_mapserver(
-                context, backend_context['mapserver_context'], layer_name,
-                created_db_table_resource,spatial_ref, srs, layer, geom_name)
-            mapping_server = "mapserver"
-
-        logger.info('Published layer `%s` under %s backend: %s' % (
-            publishing_layer, publishing_server, publishing_server_url))
-
-        _add_wms_resource(
-            context,
+        _publish_vector(
+            layer,
             layer_name,
             resource,
             created_db_table_resource,
-            publishing_server_url,
-            publishing_layer)
-
-        _add_wfs_resource(
             context,
-            layer_name,
-            resource,
-            created_db_table_resource,
-            publishing_server_url,
-            publishing_layer)
+            backend_context,
+            srs,
+            geom_name)
+
+def _log_layer_profile(logger, layer_name, profile):
+    logger.info('Profiled %s%d features of layer `%s`: geometries=%r, dimension=%s', 
+        'a sample of ' if profile.is_sample else '', profile.feature_count, 
+        layer_name, profile.geometry_types, profile.coordinate_dimension)
+    for fname, n in profile.invalid_utf8_counts.items():
+        if n > 0:
+            logger.warning(
+                'Found %d values of attribute `%s` of layer `%s` not in UTF-8', 
+                n, fname, layer_name)
+
+def _log_load_errors(logger, layer_name, load_errors):
+    for err in load_errors:
+        logger.error(
+            'Failed to load %d features (#%d to #%d) of layer `%s`: %s',
+            err['count'], err['first'], err['last'], layer_name,
+            err['error'])
+
+def _log_db_stats(logger):
+    for name, stats in db_helpers.get_stats().items():
+        logger.debug(
+            'Connection pool for %s: size=%d/%d, connects=%d, waits=%d, timeouts=%d',
+            name, stats['size'], stats['max_size'], stats['connects'],
+            stats['waits'], stats['timeouts'])
+        for verb, s in sorted(stats['statements'].items()):
+            logger.debug(
+                'Statements %s on %s: count=%d, errors=%d, total=%.3fs, max=%.3fs',
+                verb, name, s['count'], s['errors'], s['total_time'], s['max_time'])
+
+def _publish_vector(
+        layer,
+        layer_name,
+        resource,
+        created_db_table_resource,
+        context,
+        backend_context,
+        srs,
+        geom_name):
+    '''Publish an ingested layer to the default backend and add the WMS/WFS
+    resources pointing to it.
+    '''
+
+    logger = context['logger']
+
+    spatial_ref = vectorstorer.osr.SpatialReference()
+    spatial_ref.ImportFromEPSG(srs)
+
+    publishing_server = backend_context['default_publishing_server']
+    publishing_server_url = None
+    publishing_layer = None
+    
+    logger.info('About to publish %s layer `%s` (originally named as `%s`) at %s backend', 
+        geom_name, layer_name, layer.GetName(), publishing_server)
+
+    # Publish to Geoserver or Mapserver (Based on configuration)
+    if publishing_server == 'geoserver':
+        publishing_server_url, publishing_layer = _publish_layer_to_geoserver(
+            backend_context['geoserver_context'], layer_name,
+            created_db_table_resource, spatial_ref)
+    elif publishing_server == 'mapserver':
+        publishing_server_url, publishing_layer = _publish_layer_to_mapserver(
+            context, backend_context['mapserver_context'], layer_name,
+            created_db_table_resource,spatial_ref, srs, layer, geom_name)
+        mapping_server = "mapserver"
+
+    logger.info('Published layer `%s` under %s backend: %s' % (
+        publishing_layer, publishing_server, publishing_server_url))
+
+    _add_wms_resource(
+        context,
+        layer_name,
+        resource,
+        created_db_table_resource,
+        publishing_server_url,
+        publishing_layer)
+
+    _add_wfs_resource(
+        context,
+        layer_name,
+        resource,
+        created_db_table_resource,
+        publishing_server_url,
+        publishing_layer)
 
 def _add_db_table_resource(context, resource, geom_name, layer_name):
     db_table_resource = DBTableResource(
@@ -674,6 +972,10 @@ def vectorstorer_update(resource_dict, context, backend_context):
 
     if len(resource_ids) > 0:
         for res_id in resource_ids:
+            # Note: Child resources may be given as resource dicts
+            if isinstance(res_id, dict):
+                res_id = res_id['id']
+            _invalidate_export_cache(context, res_id)
             res = {'id': res_id}
             try:
                 _invoke_api_resource_action(context, res, 'resource_delete')
@@ -764,13 +1066,24 @@ def _delete_from_datastore(resource_id, db_conn_params, context, logger):
     from psycopg2 import ProgrammingError
     try:
         _db = DB(db_conn_params)
-        _db.drop_table(resource_id)
-        _db.commit_and_close()
+        try:
+            _db.drop_table(resource_id)
+            _db.commit_and_close()
+        finally:
+            _db.close()
         logger.info('Deleted table %s from the Database'
             % (resource_id))
     except ProgrammingError as ex:
         logger.error('Failed to delete table %s from the database: %s'
             % (resource_id, ex))
+    _invalidate_export_cache(context, resource_id)
+
+def _invalidate_export_cache(context, resource_id):
+    '''Remove cached exports of a (table) resource'''
+    cache_dir = context.get('export_cache_dir')
+    if cache_dir:
+        ExportCache(cache_dir).invalidate(resource_id)
+        context['logger'].info('Invalidated cached exports of %s' % (resource_id))
 
 def _unpublish_from_geoserver(resource, geoserver_context, logger):
     '''Contact Geoserver and unpublish a layer previously created as an 
@@ -1,7 +1,9 @@
+import struct
 import psycopg2
+from cStringIO import StringIO
 
 import ckanext.publicamundi.storers.vector as vectorstorer
-from ckanext.publicamundi.storers.vector import db_helpers
+from ckanext.publicamundi.storers.vector import db_helpers, profiler
 
 
 SHAPEFILE = 'ESRI Shapefile'
@@ -14,6 +16,38 @@ XLS = 'XLS'
 SQLITE = 'SQLite'
 GEOPACKAGE = 'GPKG'
 
+# Number of features sent to the database with a single COPY
+DEFAULT_COPY_BATCH_SIZE = 10000
+
+# Map OGR field type codes to PostgreSQL column types
+FIELD_TYPES = {
+    0: 'integer',
+    1: 'integer[]',
+    2: 'real',
+    3: 'real[]',
+    4: 'varchar',
+    5: 'varchar[]',
+    6: 'varchar',
+    7: 'varchar[]',
+    8: 'bytea',
+    9: 'date',
+    10: 'time without time zone',
+    11: 'timestamp without time zone',
+}
+
+LIST_FIELD_TYPES = (1, 3, 5, 7)
+
+# Geometry names that features may be promoted to, mapped to the OGR
+# function performing the promotion
+FORCE_TO_MULTI = {
+    'MULTIPOINT': 'ForceToMultiPoint',
+    'MULTILINESTRING': 'ForceToMultiLineString',
+    'MULTIPOLYGON': 'ForceToMultiPolygon',
+}
+
+# Flag marking an EWKB geometry type which is followed by an SRID
+EWKB_SRID_FLAG = 0x20000000
+
 
 class DatasourceException(Exception):
     pass
@@ -29,10 +63,17 @@ class Vector:
             gdal_driver,
             file_path,
             encoding=None,
-            db_conn_params=None):
+            db_conn_params=None,
+            bulk_load=True,
+            copy_batch_size=DEFAULT_COPY_BATCH_SIZE,
+            profile_sample_size=None):
         self.gdal_driver = gdal_driver
         self.encoding = encoding
         self.db_conn_params = db_conn_params
+        self.bulk_load = bulk_load
+        self.copy_batch_size = int(copy_batch_size or DEFAULT_COPY_BATCH_SIZE)
+        self.profile_sample_size = int(profile_sample_size or 0) or None
+        self._profiles = {}
         
         if gdal_driver == SHAPEFILE:
             # Set the SHAPE_ENCODING gdal option in order to read the
@@ -51,22 +92,26 @@ class Vector:
         return self.dataSource.GetLayer(layer_idx)
 
     def handle_layer(self, layer, geom_name, table_name, srs, layer_encoding):
-        featureCount = layer.GetFeatureCount()
+        self.create_layer_table(layer, geom_name, table_name, srs)
+        return self.write_to_db(
+            table_name, layer, srs, geom_name, layer_encoding)
+
+    def create_layer_table(self, layer, geom_name, table_name, srs):
+        '''Creates the (empty) table that will hold the features of a layer.
+
+        The table is created on a new connection, which is kept open (and
+        uncommitted) for subsequent writes.
+        '''
         layerDefinition = layer.GetLayerDefn()
         self._db = db_helpers.DB(self.db_conn_params)
         fields = self._get_layer_fields(layerDefinition)
-        layer.ResetReading()
-        feat = layer.GetNextFeature()
-        feat_geom = feat.GetGeometryRef()
-        coordinate_dimension = feat_geom.GetCoordinateDimension()
-        layer.ResetReading()
+        coordinate_dimension = self.profile_layer(layer).coordinate_dimension
         self._db.create_table(
             table_name,
             fields,
             geom_name,
             srs,
             coordinate_dimension)
-        self.write_to_db(table_name, layer, srs, geom_name, layer_encoding)
 
     def get_SRS(self, layer):
         if not layer.GetSpatialRef() is None:
@@ -82,68 +127,39 @@ class Vector:
 
     def _get_layer_fields(self, layerDefinition):
         fields = ''
+        for fname, ftype in self._get_layer_field_types(layerDefinition):
+            fields += ',' + ('"' + fname + '"' + ' ' + FIELD_TYPES[ftype])
+        return fields
+
+    def _get_layer_field_types(self, layerDefinition):
+        '''Returns a list of (name, OGR type code) pairs for the fields of a
+        layer that can be stored in the database.'''
+        field_types = []
         for i in range(layerDefinition.GetFieldCount()):
-            fname = '"' + layerDefinition.GetFieldDefn(i).GetName() + '"'
-            ftype = layerDefinition.GetFieldDefn(i).GetType()
-            if ftype == 0:
-                fields += ',' + (fname + ' ' + 'integer')
-            elif ftype == 1:
-                fields += ',' + (fname + ' ' + 'integer[]')
-            elif ftype == 2:
-                fields += ',' + (fname + ' ' + 'real')
-            elif ftype == 3:
-                fields += ',' + (fname + ' ' + 'real[]')
-            elif ftype == 4:
-                fields += ',' + (fname + ' ' + 'varchar')
-            elif ftype == 5:
-                fields += ',' + (fname + ' ' + 'varchar[]')
-            elif ftype == 6:
-                fields += ',' + (fname + ' ' + 'varchar')
-            elif ftype == 7:
-                fields += ',' + (fname + ' ' + 'varchar[]')
-            elif ftype == 8:
-                fields += ',' + (fname + ' ' + 'bytea')
-            elif ftype == 9:
-                fields += ',' + (fname + ' ' + 'date')
-            elif ftype == 10:
-                fields += ',' + (fname + ' ' + 'time without time zone')
-            elif ftype == 11:
-                fields += ',' + (fname + ' ' + 'timestamp without time zone')
+            field_defn = layerDefinition.GetFieldDefn(i)
+            ftype = field_defn.GetType()
+            if ftype in FIELD_TYPES:
+                field_types.append((field_defn.GetName(), ftype))
+        return field_types
 
-        return fields
+    def profile_layer(self, layer):
+        '''Returns the profile of a layer, computed by reading the layer once
+        (or only a sample of it, if a profile_sample_size is set).
+
+        The profile is kept, so subsequent calls for the same layer do not
+        read any features.
+        '''
+        layer_name = layer.GetName()
+        if not layer_name in self._profiles:
+            self._profiles[layer_name] = profiler.profile_layer(
+                layer, self.profile_sample_size)
+        return self._profiles[layer_name]
 
     def get_geometry_name(self, layer):
         '''Returns the geometry name of the layer (Polygon, Point, etc.)'''
-        geometry_names = []
-        for feat in layer:
-            if not feat:
-                continue
-            feat_geom = feat.GetGeometryRef().GetGeometryName()
-            if feat_geom not in geometry_names:
-                geometry_names.append(feat_geom)
-
-        geometry_name = None
-        if len(geometry_names) == 1:
-            return geometry_names[0]
-        if len(geometry_names) == 2:
-            multi_geom = None
-            simple_geom = None
-            for gname in geometry_names:
-                gname_upp = gname.upper()
-                if 'MULTI' in gname_upp:
-                    multi_geom = gname_upp
-                else:
-                    simple_geom = gname_upp
-
-            if multi_geom and simple_geom:
-                if multi_geom.split('MULTI')[1] == simple_geom:
-                    self._check_for_conversion = True
-                    geometry_name = multi_geom
-                    return geometry_name
-            else:
-                return 'GEOMETRY'
-        elif len(geometry_names) > 2:
-            return 'GEOMETRY'
+        profile = self.profile_layer(layer)
+        self._check_for_conversion = profile.needs_conversion_to_multi
+        return profile.geometry_name
 
     def get_sample_data(self, layer):
         feat_data = {}
@@ -161,6 +177,55 @@ class Vector:
         return feat_data
 
     def write_to_db(self, table_name, layer, srs, layer_geom_name, layer_encoding):
+        '''Writes the features of a layer into an (already created) table.
+
+        Returns a list of errors, one for each batch of features that failed
+        to be loaded. Each error is a dict holding the range of feature
+        indices in the batch, the number of features and the database error.
+        '''
+        try:
+            if self.bulk_load:
+                errors = self._copy_to_db(
+                    table_name, layer, srs, layer_geom_name)
+            else:
+                errors = self._insert_to_db(
+                    table_name, layer, srs, layer_geom_name)
+
+            self.finalize_table(table_name)
+            self._db.commit_and_close()
+        finally:
+            self._db.close()
+        return errors
+
+    def write_chunk(self, table_name, layer, srs, layer_geom_name, start, count):
+        '''Writes a range of features of a layer into an (already created and
+        committed) table, using a connection of its own.
+
+        This is meant to be called concurrently for disjoint ranges of the
+        same layer. Returns the batch errors, as write_to_db does.
+        '''
+        if layer_geom_name in FORCE_TO_MULTI:
+            self._check_for_conversion = True
+        self._db = db_helpers.DB(self.db_conn_params)
+        try:
+            errors = self._copy_to_db(
+                table_name, layer, srs, layer_geom_name, start, count)
+            self._db.commit_and_close()
+        finally:
+            self._db.close()
+        return errors
+
+    def finalize_table(self, table_name):
+        '''Indexes and analyzes a table once all features are written.'''
+        self._db.create_spatial_index(table_name)
+        self._db.update_serial(table_name)
+        self._db.analyze_table(table_name)
+
+    def _insert_to_db(self, table_name, layer, srs, layer_geom_name):
+        '''Writes features using one INSERT statement per feature.
+
+        Failed features are silently skipped, so no errors are reported.
+        '''
         i = 0
         for feat in layer:
             feature_fields = '%s,' % i
@@ -187,12 +252,156 @@ class Vector:
                 feat.GetGeometryRef(),
                 convert_to_multi,
                 srs)
+        return []
 
-        self._db.create_spatial_index(table_name)
-        self._db.commit_and_close()
+    def _copy_to_db(
+            self, table_name, layer, srs, layer_geom_name, start=0, count=None):
+        '''Writes features in batches, streaming each batch with COPY.
+
+        Only the range of count features starting at index start is written,
+        if such a range is given.
+
+        Every batch is loaded inside its own savepoint, so a failing batch
+        is rolled back (and reported) without aborting the whole load.
+        '''
+        layerDefinition = layer.GetLayerDefn()
+        field_types = self._get_layer_field_types(layerDefinition)
+        field_indices = [
+            layerDefinition.GetFieldIndex(fname) for fname, _ in field_types]
+        columns = ['_id'] + [fname for fname, _ in field_types] + ['the_geom']
+
+        force_to_multi = None
+        if self._check_for_conversion:
+            force_to_multi = getattr(
+                vectorstorer.ogr, FORCE_TO_MULTI[layer_geom_name], None)
+
+        errors = []
+        batch = StringIO()
+        batch_size = 0
+        batch_first = None
+        for feat_idx, feat in _iter_features(layer, start, count):
+            if batch_first is None:
+                batch_first = feat_idx
+
+            row = [str(feat_idx)]
+            for idx, (fname, ftype) in zip(field_indices, field_types):
+                row.append(self._copy_value(feat, idx, ftype))
+
+            geom = feat.GetGeometryRef()
+            if geom is None:
+                row.append('\\N')
+            else:
+                if force_to_multi and self.needs_conversion_to_multi(
+                        feat, layer_geom_name):
+                    geom = force_to_multi(geom)
+                row.append(_to_ewkb(geom, srs))
+
+            batch.write('\t'.join(row))
+            batch.write('\n')
+            batch_size += 1
+
+            if batch_size >= self.copy_batch_size:
+                self._copy_batch(
+                    table_name, columns, batch, batch_first, feat_idx,
+                    batch_size, errors)
+                batch = StringIO()
+                batch_size = 0
+                batch_first = None
+
+        if batch_size > 0:
+            self._copy_batch(
+                table_name, columns, batch, batch_first, feat_idx,
+                batch_size, errors)
+        return errors
+
+    def _copy_batch(
+            self, table_name, columns, batch, first, last, size, errors):
+        batch.seek(0)
+        self._db.savepoint('copy_batch')
+        try:
+            self._db.copy_to_table(table_name, columns, batch)
+        except psycopg2.Error as ex:
+            self._db.rollback_to_savepoint('copy_batch')
+            errors.append({
+                'first': first,
+                'last': last,
+                'count': size,
+                'error': str(ex).strip(),
+            })
+        else:
+            self._db.release_savepoint('copy_batch')
+        finally:
+            batch.close()
+
+    def _copy_value(self, feat, idx, ftype):
+        '''Formats a feature field as a value of the COPY text format.'''
+        if not feat.IsFieldSet(idx):
+            return '\\N'
+        if ftype in LIST_FIELD_TYPES:
+            value = _to_array_literal(feat.GetField(idx), ftype)
+        elif ftype == 8:
+            # Binary fields are returned as hex-encoded strings
+            value = '\\x' + feat.GetFieldAsString(idx)
+        elif ftype == 2:
+            value = repr(feat.GetFieldAsDouble(idx))
+        else:
+            value = feat.GetField(idx)
+            if value is None:
+                return '\\N'
+            if isinstance(value, unicode):
+                value = value.encode('utf-8')
+            else:
+                value = str(value)
+        return _copy_escape(value)
 
     def needs_conversion_to_multi(self, feat, layer_geom_name):
         if not feat.GetGeometryRef().GetGeometryName() == layer_geom_name:
             return True
         else:
             return False
+
+
+def _iter_features(layer, start=0, count=None):
+    '''Iterates on (index, feature) pairs of a layer, optionally limited to the
+    range of count features starting at index start.'''
+    layer.ResetReading()
+    if start:
+        layer.SetNextByIndex(start)
+    i = 0
+    while count is None or i < count:
+        feat = layer.GetNextFeature()
+        if feat is None:
+            break
+        yield start + i, feat
+        i = i + 1
+
+
+def _copy_escape(value):
+    '''Escapes a string to be used as a value of the COPY text format.'''
+    return (value.replace('\\', '\\\\').replace('\t', '\\t')
+        .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+def _to_array_literal(values, ftype):
+    '''Formats a list field as a PostgreSQL array literal.'''
+    items = []
+    for value in values:
+        if ftype in (1, 3):
+            items.append(repr(value))
+        else:
+            if isinstance(value, unicode):
+                value = value.encode('utf-8')
+            items.append(
+                '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"')
+    return '{' + ','.join(items) + '}'
+
+
+def _to_ewkb(geom, srs):
+    '''Returns the hex-encoded EWKB of a geometry, tagged with an SRID.'''
+    wkb = geom.ExportToWkb(vectorstorer.ogr.wkbNDR)
+    srid = int(srs)
+    if srid > 0:
+        geom_type = struct.unpack('<I', wkb[1:5])[0]
+        wkb = (wkb[0] + struct.pack('<II', geom_type | EWKB_SRID_FLAG, srid) +
+            wkb[5:])
+    return wkb.encode('hex')
@@ -0,0 +1,147 @@
+import os
+import time
+import random
+import logging
+import datetime
+
+from nose.tools import ok_, eq_
+from nose.plugins.skip import SkipTest
+
+from ckanext.publicamundi.analytics.controllers.util.habbox import HABbox, to_web_mercator
+from ckanext.publicamundi.analytics.controllers.parsedinfo.habboxaccessinfo import HABboxAccessInfo
+from ckanext.publicamundi.analytics.controllers.parsers.haparser import HAParser, HAInfoAggregator
+from ckanext.publicamundi.analytics.controllers.parsers.hafusedparser import HAFusedParser
+from ckanext.publicamundi.analytics.controllers.parsers.habboxaccessparser import HABboxAccessParser
+from ckanext.publicamundi.analytics.controllers.parsers.hacoveragebandparser import HACoverageBandParser
+from ckanext.publicamundi.analytics.controllers.parsers.hausedcoveragesparser import HAUsedCoveragesParser
+from ckanext.publicamundi.analytics.controllers.parsers.haservicesaccessparser import HAServicesAccessParser
+
+log = logging.getLogger(__name__)
+
+# Number of (synthetic) log lines for benchmarking (the benchmark only runs if ANALYTICS_BENCHMARK_LINES is set)
+benchmark_lines = int(os.environ.get('ANALYTICS_BENCHMARK_LINES', 0))
+
+line_format = 'Nov 18 10:00:00 localhost haproxy[1234]: 10.0.0.1:41830 [18/Nov/2015:%(time)s.123] ' + \
+    'http-in backends/s1 0/0/0/12/12 200 1520 - - ---- 1/1/0/1/0 0/0 "GET %(path)s HTTP/1.1"\n'
+
+request_formats = [
+    '/rasdaman/ows?service=WCS&version=2.0.1&request=GetCoverage&coverageId=%(name)s'
+        '&subset=x(%(x0)d,%(x1)d)&subset=y(%(y0)d,%(y1)d)&rangesubset=red,green',
+    '/rasdaman/ows?service=WCS&request=GetCoverage&coverageId=%(name)s&rangesubset=nir',
+    '/rasdaman/ows?service=WCS&request=ProcessCoverage&query=for%%20c%%20in%%20(%(name)s)%%20return%%201',
+    '/geoserver/wms?SERVICE=WMS&REQUEST=GetMap&LAYERS=publicamundi:%(name)s'
+        '&BBOX=%(x0)d,%(y0)d,%(x1)d,%(y1)d,0&WIDTH=256',
+    '/geoserver/wms?service=WMS&request=GetLegendGraphic&layer=%(name)s',
+    '/dataset/%(name)s',
+]
+
+coverage_names = ['Landsat8', 'dem', 'Corine2006', 'ndvi']
+
+def make_log_lines(n, seed=42):
+    rnd = random.Random(seed)
+    lines = []
+    for i in xrange(n):
+        x, y = rnd.randint(0, 3), rnd.randint(0, 3)
+        path = rnd.choice(request_formats) % {
+            'name': rnd.choice(coverage_names),
+            'x0': 10 * x, 'x1': 10 * (x + 1), 'y0': 10 * y, 'y1': 10 * (y + 1),
+        }
+        t = (i // 12) % 86400
+        lines.append(line_format % {
+            'time': '%02d:%02d:%02d' % (t // 3600, (t // 60) % 60, t % 60),
+            'path': path,
+        })
+    return lines
+
+def parse_separately(log_lines):
+    result = []
+    for parser in [
+            HAUsedCoveragesParser, HAServicesAccessParser,
+            HACoverageBandParser, HABboxAccessParser]:
+        result += parser(log_lines).parse()
+    return result
+
+def test_parity():
+    for n in (0, 1, 100, 5000):
+        yield _test_parity, n
+
+def _test_parity(n):
+    log_lines = make_log_lines(n)
+    expected = parse_separately(log_lines)
+    result = HAFusedParser(log_lines).parse()
+    eq_([type(x) for x in result], [type(x) for x in expected])
+    eq_([str(x) for x in result], [str(x) for x in expected])
+    eq_([x.date for x in result], [x.date for x in expected])
+
+def test_malformed_lines():
+    log_lines = make_log_lines(10) + ['\n', 'garbage\n', 'Nov 18 10:00:00 a b c d [not-a-date] e\n']
+    result = HAFusedParser(log_lines).parse()
+    eq_([str(x) for x in result], [str(x) for x in parse_separately(log_lines[:10])])
+
+def test_merge_info_list():
+    day = datetime.date(2015, 11, 18)
+    n, k = 20000, 5000
+    infos = [HABboxAccessInfo(day, HABbox(i % k, 0, i % k + 1, 1), 1) for i in xrange(n)]
+    result = HAParser.merge_info_list(iter(infos), HABboxAccessInfo.bbox_property_key)
+    eq_(len(result), k)
+    eq_([x.bbox.min_x for x in result], [float(i) for i in xrange(k)])
+    ok_(all(x.access_count == n / k for x in result))
+    # Merged objects are new ones, the given ones are left intact
+    ok_(all(x.access_count == 1 for x in infos))
+
+def test_aggregator_incremental():
+    day = datetime.date(2015, 11, 18)
+    aggregator = HAInfoAggregator(HABboxAccessInfo.bbox_property_key)
+    a = HABboxAccessInfo(day, HABbox(0, 0, 1, 1), 1)
+    aggregator.add(a)
+    ok_(aggregator.results()[0] is a)
+    aggregator.extend([HABboxAccessInfo(day, HABbox(0, 0, 1, 1), 2), HABboxAccessInfo(day, HABbox(1, 1, 2, 2), 1)])
+    aggregator.add(HABboxAccessInfo(day, HABbox('0', '0', '1', '1'), 4))
+    eq_([x.access_count for x in aggregator.results()], [7, 1])
+    eq_(a.access_count, 1)
+
+def test_bbox_normalization():
+    day = datetime.date(2015, 11, 18)
+    x0, y0 = to_web_mercator(20.0, 35.0)
+    x1, y1 = to_web_mercator(25.0, 40.0)
+    expected = HABbox(x0, y0, x1, y1)
+    log_lines = [line_format % {'time': '10:00:00', 'path': path} for path in [
+        # WMS 1.3.0 (latitude first), WMS 1.1.1 and CRS:84 (longitude first)
+        '/geoserver/wms?SERVICE=WMS&VERSION=1.3.0&REQUEST=GetMap&CRS=EPSG:4326&BBOX=35,20,40,25,0',
+        '/geoserver/wms?SERVICE=WMS&VERSION=1.1.1&REQUEST=GetMap&SRS=EPSG:4326&BBOX=20,35,25,40,0',
+        '/geoserver/wms?SERVICE=WMS&VERSION=1.3.0&REQUEST=GetMap&CRS=CRS:84&BBOX=20.0,35.0,25.0,40.0,0',
+        # WCS, by the labels of subsets
+        '/rasdaman/ows?service=WCS&request=GetCoverage&coverageId=dem&subset=Lat(35,40)&subset=Long(20,25)',
+        # EPSG:3857 (integral and decimal coordinates are equal)
+        '/geoserver/wms?SERVICE=WMS&REQUEST=GetMap&SRS=EPSG:3857&BBOX=10,20,30,40,0',
+        '/geoserver/wms?SERVICE=WMS&REQUEST=GetMap&SRS=EPSG:3857&BBOX=10.0,20.0,30,40.00,0',
+        # not numbers
+        '/geoserver/wms?SERVICE=WMS&REQUEST=GetMap&BBOX=a,b,c,d,0',
+    ]]
+    for result in (HABboxAccessParser(log_lines).parse(), HAFusedParser(log_lines).parse_metrics()['bbox']):
+        eq_([(x.access_count, x.crs) for x in result], [(4, HABbox.crs), (2, HABbox.crs)])
+        ok_(all(abs(a - b) < 1e-6 for a, b in zip(
+            [result[0].bbox.min_x, result[0].bbox.min_y, result[0].bbox.max_x, result[0].bbox.max_y],
+            [expected.min_x, expected.min_y, expected.max_x, expected.max_y])))
+        eq_(result[1].bbox, HABbox(10, 20, 30, 40))
+        eq_(result[1].bbox.to_coordinates_str(), '[[[10,20],[10,40],[30,40],[30,20]]]')
+
+def test_benchmark():
+    if not benchmark_lines:
+        raise SkipTest('ANALYTICS_BENCHMARK_LINES is not set')
+    log_lines = make_log_lines(benchmark_lines)
+    rates = []
+    for parse in (parse_separately, lambda lines: HAFusedParser(lines).parse()):
+        t0 = time.time()
+        parse(log_lines)
+        rates.append(len(log_lines) / (time.time() - t0))
+    log.info('Parse %d lines: separately %.0f lines/s, fused %.0f lines/s (x%.2f)',
+        len(log_lines), rates[0], rates[1], rates[1] / rates[0])
+
+def test_iter_json_array():
+    day = datetime.date(2015, 11, 18)
+    for n in (0, 1, 3):
+        infos = [HABboxAccessInfo(day, HABbox(i, 0, i + 1, 1), 1) for i in xrange(n)]
+        expected = '[' + ','.join(str(x) for x in infos) + ']'
+        eq_(''.join(HAParser.iter_json_array(iter(infos))), expected)
+        eq_(HAParser.print_as_json_array(infos), expected)
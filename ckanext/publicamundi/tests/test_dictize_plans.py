@@ -0,0 +1,70 @@
+import nose.tools
+from nose.tools import ok_, eq_
+
+from ckanext.publicamundi.lib.metadata.base import Object
+from ckanext.publicamundi.tests import fixtures
+
+fixture_names = ['foo1', 'foo2', 'baz1', 'inspire1']
+
+dictize_opts = [
+    {},
+    {'serialize-keys': True},
+    {'serialize-values': True},
+    {'serialize-keys': True, 'serialize-values': 'json-s'},
+    {'max-depth': 1},
+    {'max-depth': 2},
+    {'format-values': True},
+]
+
+class interpreted(object):
+    '''Use the interpreted (non-compiled) dictizer and loader'''
+
+    def __enter__(self):
+        Object.Dictizer.compiled = False
+        Object.Loader.compiled = False
+
+    def __exit__(self, *args):
+        Object.Dictizer.compiled = True
+        Object.Loader.compiled = True
+
+#
+# Tests
+#
+
+@nose.tools.istest
+def test_dictize_parity():
+    for name in fixture_names:
+        for opts in dictize_opts:
+            for flat in (False, True):
+                yield _test_dictize_parity, name, opts, flat
+
+@nose.tools.istest
+def test_load_parity():
+    for name in fixture_names:
+        yield _test_load_parity, name, {}
+        yield _test_load_parity, name, {'serialize-values': True}
+
+#
+# Helpers
+#
+
+def _test_dictize_parity(fixture_name, opts, flat):
+    x = getattr(fixtures, fixture_name)
+
+    d1 = x.to_dict(flat=flat, opts=opts)
+    with interpreted():
+        d0 = x.to_dict(flat=flat, opts=opts)
+    eq_(d1, d0)
+
+def _test_load_parity(fixture_name, opts):
+    x = getattr(fixtures, fixture_name)
+    cls = type(x)
+
+    d = x.to_dict(flat=False, opts=opts)
+    load_opts = {'unserialize-values': opts.get('serialize-values', False)}
+
+    x1 = cls().from_dict(d, is_flat=False, opts=load_opts)
+    with interpreted():
+        x0 = cls().from_dict(d, is_flat=False, opts=load_opts)
+    eq_(x1.to_dict(flat=True), x0.to_dict(flat=True))
+    eq_(x1.to_dict(flat=True), x.to_dict(flat=True))
@@ -94,9 +94,63 @@ class TestController(ckan.tests.TestController):
             tr.translate(yf, language, translated_value)
             # Lookup again for translations (should be there)
             translated_yf = tr.get(yf, language) 
-            assert translated_yf.context.value == translated_value 
+            assert translated_yf.context.value == translated_value
         pass
 
+    def test_package_translation_bulk(self):
+
+        language = 'el'
+        keys = ['title', 'notes']
+        uf = zope.schema.Text()
+
+        # Add translations (for title only)
+
+        expected = {}
+        for pkg_name, pkg in self.packages.items():
+            tr = package_translation.FieldTranslation(pkg['id'], pkg['language'])
+            tr.discard()
+            translated_value = u' ** BULK TRANSLATION ** %s' % (pkg['title'])
+            tr.translate(bound_field(uf, ('title',), pkg['title']), language, translated_value)
+            expected[pkg['id']] = {'title': translated_value}
+
+        # Lookup for all translations at once
+
+        result = translations_for_packages(self.packages.values(), keys, language)
+        assert result == expected
+
+        # Lookup for another language (nothing there)
+
+        result = translations_for_packages(self.packages.values(), keys, 'de')
+        assert result == {}
+
+    def test_package_translation_preload(self):
+
+        language = 'el'
+        uf = zope.schema.Text()
+
+        pkg = self.packages.values()[0]
+        tr = package_translation.FieldTranslation(pkg['id'], pkg['language'])
+        tr.discard()
+
+        title_yf = bound_field(uf, ('title',), pkg['title'])
+        notes_yf = bound_field(uf, ('notes',), pkg['notes'])
+        tr.translate(title_yf, language, u'Preloaded title')
+
+        # Lookups are served from preloaded translations
+
+        assert tr.preload(language) == {'title': u'Preloaded title'}
+        assert tr.get(title_yf, language).context.value == u'Preloaded title'
+        assert tr.get(notes_yf, language) is None
+
+        # A change discards preloaded (and cached) translations
+
+        tr.translate(notes_yf, language, u'Preloaded notes')
+        assert tr.get(notes_yf, language).context.value == u'Preloaded notes'
+
+        tr1 = package_translation.FieldTranslation(pkg['id'], pkg['language'])
+        assert tr1.preload(language) == {
+            'title': u'Preloaded title', 'notes': u'Preloaded notes'}
+
     def test_term_translation(self):
         
         # Todo
@@ -0,0 +1,89 @@
+import os
+import gzip
+import shutil
+import tempfile
+import datetime
+
+from nose.tools import ok_, eq_
+
+from ckanext.publicamundi.analytics.controllers.log_tailer import LogTailer
+
+line_format = 'Nov 18 10:00:00 localhost haproxy[1234]: 10.0.0.1:41830 [%(date)s:10:00:%(second)02d.123] ' + \
+    'http-in backends/s1 0/0/0/12/12 200 1520 - - ---- 1/1/0/1/0 0/0 "GET /rasdaman/ows?n=%(n)d HTTP/1.1"\n'
+
+start_date = datetime.date(2015, 11, 18)
+
+class Positions(object):
+    '''A positions store kept in memory (see LogPositions)'''
+
+    def __init__(self):
+        self.entries = {}
+
+    def get(self, fingerprint):
+        return self.entries.get(fingerprint)
+
+    def update(self, fingerprint, logpath, stat, offset, complete):
+        self.entries[fingerprint] = {'offset': offset, 'complete': complete}
+
+def make_lines(first, n, date='18/Nov/2015'):
+    return [line_format % {'date': date, 'second': i % 60, 'n': i} for i in xrange(first, first + n)]
+
+class TestLogTailer(object):
+
+    def setup(self):
+        self.dir = tempfile.mkdtemp()
+        self.logpath = os.path.join(self.dir, 'haproxy.log')
+        self.positions = Positions()
+
+    def teardown(self):
+        shutil.rmtree(self.dir)
+
+    def _append(self, lines):
+        with open(self.logpath, 'a') as f:
+            f.writelines(lines)
+
+    def _tail(self, batch_size=1000):
+        tailer = LogTailer(
+            os.path.join(self.dir, 'haproxy.log*'), self.positions, start_date, batch_size)
+        lines = []
+        for batch in tailer.iter_batches():
+            for day in sorted(batch):
+                lines += batch[day]
+        return lines
+
+    def test_append(self):
+        self._append(make_lines(0, 10))
+        eq_(self._tail(), make_lines(0, 10))
+        eq_(self._tail(), [])
+        # An incomplete line is left for next time
+        self._append(make_lines(10, 5) + ['Nov 18 10:00:00 incomplete'])
+        eq_(self._tail(), make_lines(10, 5))
+        self._append([' line\n'])
+        eq_(self._tail(), [])
+
+    def test_batches(self):
+        self._append(make_lines(0, 25, '17/Nov/2015') + make_lines(25, 25))
+        tailer = LogTailer(
+            os.path.join(self.dir, 'haproxy.log*'), self.positions, start_date, 10)
+        batches = list(tailer.iter_batches())
+        eq_([sum(len(v) for v in b.values()) for b in batches], [10, 10, 5])
+        ok_(all(b.keys() == [start_date] for b in batches))
+
+    def test_rotate_and_compress(self):
+        self._append(make_lines(0, 10))
+        eq_(self._tail(), make_lines(0, 10))
+        # Lines appended before rotation are read from the rotated (and compressed) file
+        self._append(make_lines(10, 5))
+        with open(self.logpath) as f, gzip.open(self.logpath + '.1.gz', 'w') as g:
+            g.write(f.read())
+        os.remove(self.logpath)
+        self._append(make_lines(15, 5))
+        eq_(sorted(self._tail()), sorted(make_lines(10, 10)))
+        eq_(self._tail(), [])
+
+    def test_truncate(self):
+        self._append(make_lines(0, 10))
+        eq_(self._tail(), make_lines(0, 10))
+        open(self.logpath, 'w').close()
+        self._append(make_lines(10, 3))
+        eq_(self._tail(), make_lines(10, 3))
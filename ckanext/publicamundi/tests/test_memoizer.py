@@ -0,0 +1,99 @@
+import time
+import threading
+from nose.tools import ok_, eq_
+
+from ckanext.publicamundi.lib import memoizer
+from ckanext.publicamundi.lib.memoizer import memoize
+
+calls = []
+
+@memoize(max_size=2, tags=['test'])
+def add(a, b=0):
+    calls.append((a, b))
+    return a + b
+
+@memoize(tags=['test'])
+def total(values, weights=None):
+    calls.append(values)
+    weights = weights or {}
+    return sum(v * weights.get(i, 1) for i, v in enumerate(values))
+
+@memoize(ttl=0.05)
+def now():
+    return time.time()
+
+@memoize
+def slow_square(x):
+    calls.append(x)
+    time.sleep(0.1)
+    return x * x
+
+class Named(object):
+    __hash__ = None
+    def __init__(self, name):
+        self.name = name
+
+@memoize(tags=['test'])
+def name_of(x):
+    calls.append(x)
+    return x[0].name if isinstance(x, list) else x.name
+
+def setup():
+    memoizer.clear(tag='test')
+
+def test_keyword_args():
+    del calls[:]
+    eq_(add(1, b=2), 3)
+    eq_(add(1, b=2), 3)
+    eq_(add(1, 2), 3)
+    eq_(len(calls), 2)
+
+def test_lru_eviction():
+    add.cache.clear()
+    add(1); add(2); add(3)
+    info = add.cache.info()
+    eq_(info['size'], 2)
+    eq_(info['evictions'], 1)
+
+def test_unhashable_args():
+    del calls[:]
+    eq_(total([1, 2, 3], weights={0: 10}), 15)
+    eq_(total([1, 2, 3], weights={0: 10}), 15)
+    eq_(total([1, 2, 3]), 6)
+    eq_(len(calls), 2)
+
+def test_unkeyable_args():
+    del calls[:]
+    name_of.cache.clear()
+    eq_(name_of(Named('a')), 'a')
+    eq_(name_of(Named('b')), 'b')
+    eq_(name_of([Named('c')]), 'c')
+    # Such calls are never cached (the id of an object may be reused by another)
+    eq_(len(calls), 3)
+    eq_(name_of.cache.info()['size'], 0)
+
+def test_ttl():
+    t1 = now()
+    ok_(now() == t1)
+    time.sleep(0.1)
+    ok_(now() > t1)
+    eq_(now.cache.info()['expirations'], 1)
+
+def test_concurrent_population():
+    del calls[:]
+    slow_square.cache.clear()
+    threads = [threading.Thread(target=slow_square, args=(7,)) for i in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    eq_(calls, [7])
+    eq_(slow_square.cache.info()['hits'], 4)
+
+def test_clear_by_tag():
+    add(5)
+    total([5])
+    cleared = memoizer.clear(tag='test')
+    ok_(add.cache.name in cleared and total.cache.name in cleared)
+    ok_(not now.cache.name in cleared)
+    eq_(add.cache.info()['size'], 0)
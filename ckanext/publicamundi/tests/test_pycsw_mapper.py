@@ -0,0 +1,58 @@
+import timeit
+import logging
+from lxml import etree
+
+from nose.tools import ok_, eq_
+from nose.plugins.skip import SkipTest
+
+from ckanext.publicamundi.model import CswRecord
+from ckanext.publicamundi.lib import pycsw_sync
+from ckanext.publicamundi.lib import pycsw_mapper
+from ckanext.publicamundi.tests import fixtures
+
+log = logging.getLogger(__name__)
+
+pkg_id = '91b54070-5adb-11e4-8ed6-0800200c9a66'
+
+# Columns that cannot be compared as plain values
+special_columns = ('insert_date', 'xml', 'anytext')
+
+def setup():
+    if not pycsw_sync.pycsw_context:
+        raise SkipTest('pycsw_sync is not configured')
+
+def _make_record(obj, direct):
+    return pycsw_sync.make_record_for_metadata(pkg_id, obj, direct=direct)
+
+def test_mapper_exists():
+    ok_(pycsw_mapper.mapper_for(fixtures.inspire1))
+    ok_(pycsw_mapper.mapper_for(fixtures.foo1) is None)
+
+def test_parity():
+    for name in ('inspire1', 'inspire3', 'inspire4'):
+        yield _test_parity, name
+
+def _test_parity(fixture_name):
+    obj = getattr(fixtures, fixture_name)
+    parsed = _make_record(obj, direct=False)
+    mapped = _make_record(obj, direct=True)
+    ok_(parsed is not None and mapped is not None)
+
+    for column in CswRecord.__table__.columns:
+        if column.key in special_columns:
+            continue
+        eq_(getattr(mapped, column.key, None), getattr(parsed, column.key, None),
+            'Column %s differs for %s' % (column.key, fixture_name))
+
+    # Words must appear in the same order (and as many times) as in the XML
+    eq_(mapped.anytext.split(), parsed.anytext.split())
+    eq_(etree.tostring(etree.fromstring(mapped.xml), method='c14n'),
+        etree.tostring(etree.fromstring(parsed.xml), method='c14n'))
+
+def test_benchmark():
+    obj = fixtures.inspire1
+    n = 20
+    for direct in (False, True):
+        t = timeit.timeit(lambda: _make_record(obj, direct), number=n)
+        log.info('%s: %.2fms per record',
+            'Mapped' if direct else 'Parsed', 1000.0 * t / n)
@@ -0,0 +1,115 @@
+from nose.tools import ok_, eq_
+from nose.plugins.skip import SkipTest
+
+from ckanext.publicamundi.lib import pycsw_sync
+from ckanext.publicamundi.lib import pycsw_queue
+from ckanext.publicamundi.tests import fixtures
+
+applied = []
+
+class FlakyRecords(object):
+    '''Replace pycsw_sync functions, failing (a number of times) for some datasets'''
+
+    def __init__(self, failures={}, unbuildable=()):
+        self.failures = dict(failures)
+        self.unbuildable = set(unbuildable)
+
+    def __enter__(self):
+        self.saved = (pycsw_sync.create_or_update_record, pycsw_sync.delete_record)
+        pycsw_sync.create_or_update_record = self.create_or_update_record
+        pycsw_sync.delete_record = self.delete_record
+
+    def __exit__(self, *args):
+        pycsw_sync.create_or_update_record, pycsw_sync.delete_record = self.saved
+
+    def create_or_update_record(self, session, pkg_dict, commit=True):
+        if self.failures.get(pkg_dict['id']):
+            self.failures[pkg_dict['id']] -= 1
+            raise RuntimeError('Failed to save %s' % (pkg_dict['id']))
+        if pkg_dict['id'] in self.unbuildable:
+            return None
+        applied.append(('update', pkg_dict['id'], pkg_dict['title']))
+        return pkg_dict
+
+    def delete_record(self, session, pkg_dict, commit=True):
+        applied.append(('delete', pkg_dict['id'], None))
+        return pkg_dict
+
+def test_coalesce_updates():
+    del applied[:]
+    q = pycsw_queue.SyncQueue(batch_size=10, delay=0.2)
+    with FlakyRecords():
+        for i in range(5):
+            q.put_update({'id': 'a', 'title': 'A%d' % (i)})
+        q.put_update({'id': 'b', 'title': 'B'})
+        q.put_delete('c')
+        eq_(q.get_stats()['depth'], 3)
+        ok_(q.flush(timeout=5.0))
+    eq_(sorted(applied), [('delete', 'c', None), ('update', 'a', 'A4'), ('update', 'b', 'B')])
+    stats = q.get_stats()
+    eq_(stats['depth'], 0)
+    eq_(stats['applied'], 3)
+    eq_(stats['coalesced'], 4)
+
+def test_retry_failed():
+    del applied[:]
+    q = pycsw_queue.SyncQueue(batch_size=10, delay=0, retry_delay=0.1)
+    # Fail for b, both in a batch and when applied alone 
+    with FlakyRecords(failures={'b': 2}):
+        for pkg_id in ('a', 'b', 'c'):
+            q.put_update({'id': pkg_id, 'title': pkg_id.upper()})
+        ok_(q.flush(timeout=5.0))
+    # Note Records of a failed batch are also applied (but rolled back)
+    eq_(dict((pkg_id, title) for op, pkg_id, title in applied), {'a': 'A', 'b': 'B', 'c': 'C'})
+    stats = q.get_stats()
+    eq_(stats['retried'], 1)
+    eq_(stats['failed'], 0)
+
+def test_unbuildable_record():
+    del applied[:]
+    q = pycsw_queue.SyncQueue(batch_size=10, delay=0)
+    with FlakyRecords(unbuildable=['b']):
+        for pkg_id in ('a', 'b'):
+            q.put_update({'id': pkg_id, 'title': pkg_id.upper()})
+        ok_(q.flush(timeout=5.0))
+    eq_(applied, [('update', 'a', 'A')])
+    stats = q.get_stats()
+    eq_(stats['applied'], 1)
+    eq_(stats['failed'], 1)
+    eq_(stats['retried'], 0)
+
+class BuiltRecords(object):
+    '''Replace pycsw_sync.create_or_update_record, building (but not saving) records'''
+
+    def __enter__(self):
+        self.saved = pycsw_sync.create_or_update_record
+        pycsw_sync.create_or_update_record = self.create_or_update_record
+        self.records = {}
+
+    def __exit__(self, *args):
+        pycsw_sync.create_or_update_record = self.saved
+
+    def create_or_update_record(self, session, pkg_dict, commit=True):
+        record = pycsw_sync.make_record(pkg_dict)
+        self.records[pkg_dict['id']] = record
+        return record
+
+def test_build_inspire_record():
+    if not pycsw_sync.pycsw_context:
+        raise SkipTest('pycsw_sync is not configured')
+    pkg_id = '91b54070-5adb-11e4-8ed6-0800200c9a66'
+    pkg_dict = dict(fixtures.inspire1.to_extras())
+    pkg_dict.update({'id': pkg_id, 'dataset_type': 'inspire'})
+    q = pycsw_queue.SyncQueue(batch_size=10, delay=0)
+    built = BuiltRecords()
+    # The record (and its XML document) is built by the worker thread
+    with built:
+        q.put_update(pkg_dict)
+        ok_(q.flush(timeout=30.0))
+    record = built.records.get(pkg_id)
+    ok_(record is not None)
+    eq_(record.identifier, pkg_id)
+    ok_(record.xml)
+    stats = q.get_stats()
+    eq_(stats['applied'], 1)
+    eq_(stats['failed'], 0)
@@ -0,0 +1,70 @@
+import tempfile
+from nose.tools import ok_, eq_
+from nose.plugins.skip import SkipTest
+
+from pylons import config
+
+import ckanext.publicamundi.storers.vector as vectorstorer
+
+def setup():
+    gdal_folder = config.get(
+        'ckanext.publicamundi.vectorstorer.gdal_folder',
+        '/usr/lib/python2.7/dist-packages')
+    try:
+        vectorstorer.setup(gdal_folder, tempfile.gettempdir())
+    except ImportError:
+        raise SkipTest('GDAL python bindings are not available')
+
+def test_cached_transformation():
+    from ckanext.publicamundi.storers.vector.lib import transform
+
+    t1 = transform.get_transformation(2100, 4326)
+    t2 = transform.get_transformation(2100, 4326)
+    ok_(t1 is t2)
+    ok_(transform.get_transformation(4326, 4326) is None)
+    ok_(transform.get_transformation(4326, 2100) is not t1)
+
+def test_transform_points():
+    from ckanext.publicamundi.storers.vector.lib import transform
+
+    points = [(23.7, 37.9), (21.7, 38.2), (25.1, 35.3)]
+    result = transform.transform_points(points, 4326, 3857)
+    eq_(len(result), len(points))
+    for (x, y), (x1, y1, z1) in zip(points, result):
+        geom = vectorstorer.ogr.CreateGeometryFromWkt('POINT (%f %f)' % (x, y))
+        transform.transform_geometry(geom, 4326, 3857)
+        ok_(abs(geom.GetX() - x1) < 1e-6 and abs(geom.GetY() - y1) < 1e-6)
+
+def test_transform_bbox():
+    from ckanext.publicamundi.storers.vector.lib import transform
+
+    bbox = transform.transform_bbox((100000, 3800000, 900000, 4600000), 2100, 4326)
+    eq_(len(bbox), 4)
+    ok_(bbox[0] < bbox[2] and bbox[1] < bbox[3])
+    eq_(transform.transform_bbox((1, 2, 3, 4), 4326, 4326), (1, 2, 3, 4))
+
+def test_cached_srs():
+    from ckanext.publicamundi.storers.vector.lib import transform
+
+    srs = transform.get_srs(2100)
+    ok_(transform.get_srs(2100) is srs)
+    ok_(transform.get_srs(4326) is not srs)
+    proj4 = '+proj=longlat +datum=WGS84 +no_defs'
+    ok_(transform.get_srs(proj4) is transform.get_srs(proj4))
+    # A transformation is built from the cached spatial references
+    ok_(transform.get_transformation(2100, 4326) is transform.get_transformation(2100, 4326))
+
+def test_batched_points():
+    from ckanext.publicamundi.storers.vector.lib import transform
+
+    ogr = vectorstorer.ogr
+    points = [(20.0 + i * 1e-2, 38.0 + i * 1e-2) for i in range(100)]
+    result = transform.transform_points(points, 4326, 2100)
+    eq_(len(result), len(points))
+    for (x, y), (x1, y1, z1) in zip(points, result):
+        geom = ogr.Geometry(ogr.wkbPoint)
+        geom.AddPoint_2D(x, y)
+        transform.transform_geometry(geom, 4326, 2100)
+        ok_(abs(geom.GetX() - x1) < 1e-6 and abs(geom.GetY() - y1) < 1e-6)
+    # Same spatial references: points are returned as (x, y, z) tuples
+    eq_(transform.transform_points(points[:2], 4326, 4326), [p + (0.0,) for p in points[:2]])